@@ -0,0 +1,130 @@
+"""
+Aggregates flow rollups in SQLite and returns NumPy arrays.
+
+The bucketing is already done by the rollups (see core/flow_rollup.py); the
+queries here only select the bucket timestamp, one label column and the byte
+count, and leave the SUM, GROUP BY and top-N to SQLite, so that the graphs
+over long time spans do not pull every rollup row into pandas.
+
+"""
+import time
+import numpy as np
+from peewee import Case, fn
+import core.model as model
+
+
+# Label of the traffic that is not in the top-N labels
+OTHERS_LABEL = '(others)'
+
+
+def get_search_filter(bucket_size, last_n_seconds, upload=True, search_filter=None):
+    """
+    Returns the filter for the rollups of the given bucket size that cover the
+    last n seconds and have traffic in the given direction.
+
+    """
+    since_ts = int(time.time()) - last_n_seconds
+
+    query_filter = (
+        (model.FlowRollup.bucket_size == bucket_size) &
+        (model.FlowRollup.bucket_ts > since_ts - bucket_size) &
+        (get_byte_count_col(upload) > 0)
+    )
+    if search_filter is not None:
+        query_filter &= search_filter
+
+    return query_filter
+
+
+def get_byte_count_col(upload=True):
+
+    if upload:
+        return model.FlowRollup.upload_byte_count
+    return model.FlowRollup.download_byte_count
+
+
+def get_top_labels(label_col, search_filter, upload=True, limit=5) -> list:
+    """Returns the (at most `limit`) labels with the most bytes, in descending order."""
+
+    byte_sum = fn.SUM(get_byte_count_col(upload))
+
+    with model.db:
+        query = model.FlowRollup.select(label_col) \
+            .where(search_filter) \
+            .group_by(label_col) \
+            .order_by(byte_sum.desc(), label_col) \
+            .limit(limit)
+        return [label for (label,) in query.tuples()]
+
+
+def get_label_totals(label_col, search_filter, upload=True):
+    """Returns (label_array, byte_count_array) with the total bytes per label."""
+
+    byte_sum = fn.SUM(get_byte_count_col(upload))
+
+    with model.db:
+        row_list = list(
+            model.FlowRollup.select(label_col, byte_sum)
+                .where(search_filter)
+                .group_by(label_col)
+                .tuples()
+        )
+
+    label_array = np.array([label for label, _ in row_list], dtype=object)
+    byte_count_array = np.fromiter((byte_count for _, byte_count in row_list), dtype=np.int64, count=len(row_list))
+
+    return label_array, byte_count_array
+
+
+def get_bucket_sums(label_col, search_filter, upload=True, top_label_list=None):
+    """
+    Returns (ts_array, label_array, byte_count_array) with the total bytes per
+    bucket and label. If `top_label_list` is given, all other labels are
+    combined into OTHERS_LABEL.
+
+    """
+    if top_label_list is not None:
+        label_col = Case(None, [(label_col.in_(top_label_list), label_col)], OTHERS_LABEL)
+
+    byte_sum = fn.SUM(get_byte_count_col(upload))
+
+    with model.db:
+        row_list = list(
+            model.FlowRollup.select(model.FlowRollup.bucket_ts, label_col, byte_sum)
+                .where(search_filter)
+                .group_by(model.FlowRollup.bucket_ts, label_col)
+                .tuples()
+        )
+
+    ts_array = np.fromiter((ts for ts, _, _ in row_list), dtype=np.int64, count=len(row_list))
+    label_array = np.array([label for _, label, _ in row_list], dtype=object)
+    byte_count_array = np.fromiter((byte_count for _, _, byte_count in row_list), dtype=np.int64, count=len(row_list))
+
+    return ts_array, label_array, byte_count_array
+
+
+def to_matrix(ts_array, label_array, byte_count_array, ts_axis, label_list):
+    """
+    Spreads the output of `get_bucket_sums` over a dense matrix with one row
+    per timestamp in `ts_axis` (evenly spaced) and one column per label in
+    `label_list`. Sums that fall outside either are dropped.
+
+    """
+    matrix = np.zeros((len(ts_axis), len(label_list)), dtype=np.float64)
+    if len(ts_array) == 0 or len(ts_axis) == 0:
+        return matrix
+
+    ts_step = ts_axis[1] - ts_axis[0] if len(ts_axis) > 1 else 1
+    row_array = (ts_array - ts_axis[0]) // ts_step
+
+    label_index_dict = {label: index for index, label in enumerate(label_list)}
+    col_array = np.fromiter(
+        (label_index_dict.get(label, -1) for label in label_array),
+        dtype=np.int64,
+        count=len(label_array)
+    )
+
+    valid = (row_array >= 0) & (row_array < len(ts_axis)) & (col_array >= 0)
+    np.add.at(matrix, (row_array[valid], col_array[valid]), byte_count_array[valid])
+
+    return matrix
@@ -1,18 +1,15 @@
 import core.model as model
-import peewee
+import core.flow_rollup as flow_rollup
+import analysis.flow_aggregation as flow_aggregation
+import numpy as np
 import pandas as pd
-import itertools
 import datetime
-import time
 
 
 def unix_timestamp_to_local_time(timestamp):
 
-    # Convert the timestamp to a datetime object
-    utc_datetime = datetime.datetime.utcfromtimestamp(timestamp)
-
-    # Convert the UTC datetime to local time
-    local_datetime = utc_datetime.replace(tzinfo=datetime.timezone.utc).astimezone()
+    # Convert the timestamp to a local datetime object
+    local_datetime = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).astimezone()
 
     # Format the local datetime as hours:minutes:seconds
     local_time = local_datetime.strftime('%H:%M:%S')
@@ -43,17 +40,17 @@ def get_traffic_rate_df(last_n_seconds=20):
     ```
 
     """
-    max_ts = int(time.time())
-
-    time_filter = model.Flow.end_ts > max_ts - last_n_seconds
-
-    with model.db:
-        graph_df = pd.DataFrame(model.Flow.select().where(time_filter).order_by(model.Flow.end_ts).dicts())
-    if len(graph_df) == 0:
+    # Upload and download rates come from the 2-second rollups
+    sum_list = [
+        flow_aggregation.get_bucket_sums(
+            model.FlowRollup.device_mac_addr,
+            flow_aggregation.get_search_filter(2, last_n_seconds, upload=upload),
+            upload=upload
+        )
+        for upload in (True, False)
+    ]
+    if all(len(ts_array) == 0 for ts_array, _, _ in sum_list):
         return (None, None)
-    graph_df['ts'] = graph_df['end_ts'].apply(int).apply(
-        lambda t: t - (t % 2)
-    )
 
     # Get all valid mac addresses
     all_mac_address_set = set()
@@ -62,58 +59,88 @@ def get_traffic_rate_df(last_n_seconds=20):
             if device.mac_addr:
                 all_mac_address_set.add(device.mac_addr)
 
-    min_ts = graph_df['ts'].min()
-    max_ts = graph_df['ts'].max()
-    min_ts = min_ts - min_ts % 2
-    max_ts = max_ts - max_ts % 2
+    all_mac_address_list = list(all_mac_address_set)
+
+    # Only show traffic of valid mac addresses
+    valid_mac_address_list = [mac_addr for mac_addr in all_mac_address_list if len(mac_addr) == 17]
+
+    # Show values during the min-max timeframe
+    all_ts_array = np.concatenate([ts_array for ts_array, _, _ in sum_list])
+    ts_axis = np.arange(all_ts_array.min(), all_ts_array.max() + 1)
+    human_ts_list = [unix_timestamp_to_local_time(ts) for ts in ts_axis]
 
     output_list = []
 
     # Generate the upload and download dataframes
-    for direction in ('src', 'dst'):
+    for ts_array, label_array, byte_count_array in sum_list:
 
-        mac_addr_col = f'{direction}_device_mac_addr'
+        byte_matrix = flow_aggregation.to_matrix(
+            ts_array, label_array, byte_count_array, ts_axis, valid_mac_address_list
+        )
+        mbps_dict = {
+            mac_addr: byte_matrix[:, index] * 8.0 / 1000000.0 / 2.0
+            for index, mac_addr in enumerate(valid_mac_address_list)
+        }
+        zero_array = np.zeros(len(ts_axis))
+
+        byte_graph_df = pd.DataFrame({
+            'device_mac_addr': np.repeat(all_mac_address_list, len(ts_axis)),
+            'ts': np.tile(ts_axis, len(all_mac_address_list)),
+            'Bandwidth (Mbps)': np.concatenate(
+                [mbps_dict.get(mac_addr, zero_array) for mac_addr in all_mac_address_list] or [zero_array[:0]]
+            ),
+            'Time': human_ts_list * len(all_mac_address_list)
+        })
 
-        # Remove invalid mac addresses
-        valid_mac_graph_df = graph_df[
-            (graph_df[mac_addr_col].str.len() == 17)
-        ]
+        output_list.append(byte_graph_df)
 
-        # Aggregate
-        byte_graph_df = valid_mac_graph_df.groupby([mac_addr_col, 'ts'])['byte_count'].sum().to_frame('Mbps').reset_index()
-        byte_graph_df['Mbps'] = (byte_graph_df['Mbps'] * 8.0 / 1000000.0 / 2.0)
+    return tuple(output_list)
 
-        # Show values during the min-max timeframe
-        all_ts_value_df = pd.DataFrame(
-            itertools.product(
-                all_mac_address_set,
-                range(min_ts, max_ts + 1)
-            ),
-            columns=[mac_addr_col, 'ts']
-        )
 
-        byte_graph_df = pd.merge(
-            all_ts_value_df,
-            byte_graph_df.reset_index(),
-            on=[mac_addr_col, 'ts'],
-            how='left'
-        ).fillna(0)
 
-        del byte_graph_df['index']
+def get_top_label_graph_df(label_col, search_filter, time_base, upload=True, empty_label=''):
+    """
+    Returns the bandwidth of the top five labels per `time_base` seconds, with
+    all other labels combined into '(others)' and empty labels renamed to
+    `empty_label`. Returns None if no data.
 
-        # Convert to ts into local times
-        byte_graph_df['human_ts'] = byte_graph_df['ts'].apply(unix_timestamp_to_local_time)
+    """
+    # Find top 10 labels with the most data usage
+    top_ten = flow_aggregation.get_top_labels(label_col, search_filter, upload=upload, limit=5)
+    if not top_ten:
+        return None
 
-        # Make the mac address field name consistent regardless of the direction
-        byte_graph_df = byte_graph_df.rename(columns={
-            mac_addr_col: 'device_mac_addr',
-            'human_ts': 'Time',
-            'Mbps': 'Bandwidth (Mbps)'
-        })
+    # Aggregate, combining the non-top-ten labels into a single label
+    ts_array, label_array, byte_count_array = flow_aggregation.get_bucket_sums(
+        label_col, search_filter, upload=upload, top_label_list=top_ten
+    )
+    label_list = sorted(set(label_array))
 
-        output_list.append(byte_graph_df)
+    # Show values during the min-max timeframe
+    ts_axis = np.arange(ts_array.min(), ts_array.max() + 1, time_base)
+    byte_matrix = flow_aggregation.to_matrix(ts_array, label_array, byte_count_array, ts_axis, label_list)
 
-    return tuple(output_list)
+    # Relabel empty fields
+    column_list = [label if label else empty_label for label in label_list]
+    byte_graph_df = pd.DataFrame(byte_matrix * 8.0 / 1000000.0 / 2.0, columns=column_list)
+    byte_graph_df['human_ts'] = [unix_timestamp_to_local_time(ts) for ts in ts_axis]
+
+    # Top ten should not include empty/unknown values
+    if '' in top_ten:
+        top_ten.remove('')
+
+    # Sort by top 10, plus other columns
+    final_columns = []
+    current_columns = set(byte_graph_df.columns)
+    for col in top_ten:
+        if col in current_columns:
+            final_columns.append(col)
+    remaining_columns = sorted(set(current_columns) - set(final_columns))
+    final_columns += remaining_columns
+    final_columns.remove('human_ts')
+    final_columns.append('human_ts')
+
+    return byte_graph_df[final_columns]
 
 
 
@@ -146,114 +173,32 @@ def get_activities(mac_addr, last_n_seconds=20, group_by_col='hostname', show_em
 
 def get_activities_helper(mac_addr, group_by_col='hostname', upload=True, show_empty=True, last_n_seconds=20):
 
-    max_ts = int(time.time())
-
-    device_prefix = 'src' if upload else 'dst'
-    remote_prefix = 'dst' if upload else 'src'
+    full_group_by_col = f'remote_{group_by_col}'
 
-    full_group_by_col = f'{remote_prefix}_{group_by_col}'
-
-    # Find all flow entries
-    search_filter = (
-        (model.Flow.end_ts > max_ts - last_n_seconds) &
-        (getattr(model.Flow, f'{device_prefix}_device_mac_addr') == mac_addr)
-    )
+    # Find all rollups of the device
+    search_filter = (model.FlowRollup.device_mac_addr == mac_addr)
 
     if not show_empty:
-        search_filter &= (getattr(model.Flow, full_group_by_col) != '')
-
-    with model.db:
-        graph_df = pd.DataFrame(
-            model.Flow.select() \
-                .where(search_filter) \
-                .order_by(model.Flow.end_ts) \
-                .dicts()
-            )
-
-    if len(graph_df) == 0:
-        return None
-
-    time_base = 60 * 30
-    if last_n_seconds <= 60 * 10:
-        time_base = 2
-    elif last_n_seconds <= 60 * 60:
-        time_base = 60
-    elif last_n_seconds <= 60 * 60 * 6:
-        time_base = 60 * 5
-
-    # Make timestamps multiples of `time_base`
-    graph_df['ts'] = graph_df['end_ts'].apply(int).apply(
-        lambda t: t - (t % time_base)
-    )
+        search_filter &= (getattr(model.FlowRollup, full_group_by_col) != '')
 
-    # Find top 10 group_by cols with the most data usage
-    data_usage_df = graph_df.groupby(full_group_by_col)['byte_count'].sum() \
-        .sort_values(ascending=False).to_frame('byte_count').reset_index().head(5)
-    top_ten = list(data_usage_df[full_group_by_col])
+    time_base = flow_rollup.get_bucket_size(last_n_seconds)
 
-    # Combine the non-top-ten labels into a single label
-    graph_df[full_group_by_col] = graph_df[full_group_by_col].apply(
-        lambda s: s if s in top_ten else '(others)'
-    )
-
-    # Aggregate
-    byte_graph_df = graph_df.groupby([full_group_by_col, 'ts'])['byte_count'].sum().to_frame('byte_count').reset_index()
-    byte_graph_df['Mbps'] = byte_graph_df['byte_count'] * 8.0 / 1000000.0 / 2.0
-
-    # Relabel empty fields
-    if show_empty:
-        unknown_label = '(unknown)'
-        if group_by_col == 'tracker_company':
-            unknown_label = '(may not be ad/tracker)'
-        byte_graph_df[full_group_by_col] = byte_graph_df[full_group_by_col].replace('', unknown_label)
-
-    # Pivot by the group_by_col
-    byte_graph_df = pd.pivot_table(
-        byte_graph_df,
-        index='ts',
-        columns=full_group_by_col,
-        values='Mbps',
-        aggfunc='sum'
-    ).reset_index()
+    unknown_label = '(unknown)'
+    if group_by_col == 'tracker_company':
+        unknown_label = '(may not be ad/tracker)'
 
-    # Show values during the min-max timeframe
-    min_ts = graph_df['ts'].min()
-    max_ts = graph_df['ts'].max()
-    min_ts = min_ts - min_ts % time_base
-    max_ts = max_ts - max_ts % time_base
-    all_ts_value_df = pd.DataFrame(
-        range(min_ts, max_ts + 1, time_base),
-        columns=['ts']
+    byte_graph_df = get_top_label_graph_df(
+        getattr(model.FlowRollup, full_group_by_col),
+        flow_aggregation.get_search_filter(time_base, last_n_seconds, upload=upload, search_filter=search_filter),
+        time_base,
+        upload=upload,
+        empty_label=unknown_label
     )
 
-    byte_graph_df = pd.merge(
-        all_ts_value_df,
-        byte_graph_df.reset_index(),
-        on='ts',
-        how='left'
-    ).fillna(0)
-
-    # Convert to ts into local times
-    byte_graph_df['human_ts'] = byte_graph_df['ts'].apply(unix_timestamp_to_local_time)
-    del byte_graph_df['index']
-    del byte_graph_df['ts']
-
-    # Top ten should not include empty/unknown values
-    if '' in top_ten:
-        top_ten.remove('')
-
-    # Sort by top 10, plus other columns
-    final_columns = []
-    current_columns = set(byte_graph_df.columns)
-    for col in top_ten:
-        if col in current_columns:
-            final_columns.append(col)
-    remaining_columns = sorted(set(current_columns) - set(final_columns))
-    final_columns += remaining_columns
-    final_columns.remove('human_ts')
-    final_columns.append('human_ts')
+    if byte_graph_df is None:
+        return None
 
-    return byte_graph_df[final_columns].rename(columns={
+    return byte_graph_df.rename(columns={
         'human_ts': 'Time',
     })
 
@@ -276,43 +221,34 @@ def get_data_usage(mac_addr, last_n_seconds=20, group_by_col='hostname', show_em
 
 def get_data_usage_helper(mac_addr, group_by_col='hostname', upload=True, show_empty=True, last_n_seconds=20):
 
-    max_ts = int(time.time())
-
-    device_prefix = 'src' if upload else 'dst'
-    remote_prefix = 'dst' if upload else 'src'
+    full_group_by_col = f'remote_{group_by_col}'
 
-    full_group_by_col = f'{remote_prefix}_{group_by_col}'
-
-    # Find all flow entries
-    search_filter = (
-        (model.Flow.end_ts > max_ts - last_n_seconds) &
-        (getattr(model.Flow, f'{device_prefix}_device_mac_addr') == mac_addr)
-    )
+    # Find all rollups of the device
+    search_filter = (model.FlowRollup.device_mac_addr == mac_addr)
 
     if not show_empty:
-        search_filter &= (getattr(model.Flow, full_group_by_col) != '')
+        search_filter &= (getattr(model.FlowRollup, full_group_by_col) != '')
 
-    with model.db:
-        data_df = pd.DataFrame(
-            model.Flow.select() \
-                .where(search_filter) \
-                .order_by(model.Flow.end_ts) \
-                .dicts()
-            )
+    bucket_size = flow_rollup.get_bucket_size(last_n_seconds)
+    label_array, byte_count_array = flow_aggregation.get_label_totals(
+        getattr(model.FlowRollup, full_group_by_col),
+        flow_aggregation.get_search_filter(bucket_size, last_n_seconds, upload=upload, search_filter=search_filter),
+        upload=upload
+    )
 
     unknown_label = '(unknown)'
     if group_by_col == 'tracker_company':
         unknown_label = '(may not be ad/tracker)'
 
-    if len(data_df) == 0:
-        data_df = pd.DataFrame({
-            full_group_by_col: [unknown_label],
-            'byte_count': [0]
-        })
+    if len(label_array) == 0:
+        label_array = np.array([unknown_label], dtype=object)
+        byte_count_array = np.zeros(1, dtype=np.int64)
 
-    # Aggregate data usage by each entity
-    data_df = data_df.groupby(full_group_by_col)['byte_count'].sum().to_frame('byte_count').reset_index()
-    data_df['byte_count'] = data_df['byte_count'] / 1000000.0
+    # Data usage by each entity
+    data_df = pd.DataFrame({
+        full_group_by_col: label_array,
+        'byte_count': byte_count_array / 1000000.0
+    }).sort_values(by=full_group_by_col).reset_index(drop=True)
 
     # Relabel empty fields
     if show_empty:
@@ -352,100 +288,24 @@ def get_all_device_rate_helper(upload=True, last_n_seconds=20):
     Returns None if no data.
 
     """
-    max_ts = int(time.time())
-
-    device_prefix = 'src' if upload else 'dst'
-    device_mac_group_by_col = f'{device_prefix}_device_mac_addr'
-
-    # Find all flow entries
-    search_filter = (
-        (model.Flow.end_ts > max_ts - last_n_seconds) &
-        (getattr(model.Flow, device_mac_group_by_col) != '')
+    time_base = flow_rollup.get_bucket_size(last_n_seconds)
+
+    # Find all rollups of all devices
+    byte_graph_df = get_top_label_graph_df(
+        model.FlowRollup.device_mac_addr,
+        flow_aggregation.get_search_filter(
+            time_base,
+            last_n_seconds,
+            upload=upload,
+            search_filter=(model.FlowRollup.device_mac_addr != '')
+        ),
+        time_base,
+        upload=upload
     )
 
-    with model.db:
-        graph_df = pd.DataFrame(
-            model.Flow.select() \
-                .where(search_filter) \
-                .order_by(model.Flow.end_ts) \
-                .dicts()
-            )
-
-    if len(graph_df) == 0:
+    if byte_graph_df is None:
         return None
 
-    time_base = 60 * 30
-    if last_n_seconds <= 60:
-        time_base = 2
-    elif last_n_seconds <= 60 * 60:
-        time_base = 60
-    elif last_n_seconds <= 60 * 60 * 6:
-        time_base = 60 * 5
-
-    # Make timestamps multiples of `time_base`
-    graph_df['ts'] = graph_df['end_ts'].apply(int).apply(
-        lambda t: t - (t % time_base)
-    )
-
-    # Find top 10 mac addresses with the most data usage
-
-    data_usage_df = graph_df.groupby(device_mac_group_by_col)['byte_count'].sum() \
-        .sort_values(ascending=False).to_frame('byte_count').reset_index().head(5)
-    top_ten = list(data_usage_df[device_mac_group_by_col])
-
-    # Combine the non-top-ten labels into a single label
-    graph_df[device_mac_group_by_col] = graph_df[device_mac_group_by_col].apply(
-        lambda s: s if s in top_ten else '(others)'
-    )
-
-    # Aggregate
-    byte_graph_df = graph_df.groupby([device_mac_group_by_col, 'ts'])['byte_count'].sum().to_frame('byte_count').reset_index()
-    byte_graph_df['Mbps'] = byte_graph_df['byte_count'] * 8.0 / 1000000.0 / 2.0
-
-    # Pivot by the group_by_col
-    byte_graph_df = pd.pivot_table(
-        byte_graph_df,
-        index='ts',
-        columns=device_mac_group_by_col,
-        values='Mbps',
-        aggfunc='sum'
-    ).reset_index()
-
-    # Show values during the min-max timeframe
-    min_ts = graph_df['ts'].min()
-    max_ts = graph_df['ts'].max()
-    min_ts = min_ts - min_ts % time_base
-    max_ts = max_ts - max_ts % time_base
-    all_ts_value_df = pd.DataFrame(
-        range(min_ts, max_ts + 1, time_base),
-        columns=['ts']
-    )
-
-    byte_graph_df = pd.merge(
-        all_ts_value_df,
-        byte_graph_df.reset_index(),
-        on='ts',
-        how='left'
-    ).fillna(0)
-
-    # Convert to ts into local times
-    byte_graph_df['human_ts'] = byte_graph_df['ts'].apply(unix_timestamp_to_local_time)
-    del byte_graph_df['index']
-    del byte_graph_df['ts']
-
-    # Sort by top 10, plus other columns
-    final_columns = []
-    current_columns = set(byte_graph_df.columns)
-    for col in top_ten:
-        if col in current_columns:
-            final_columns.append(col)
-    remaining_columns = sorted(set(current_columns) - set(final_columns))
-    final_columns += remaining_columns
-    final_columns.remove('human_ts')
-    final_columns.append('human_ts')
-
-    byte_graph_df = byte_graph_df[final_columns]
-
     # Label all the mac addresses
     rename_dict = {}
     with model.db:
@@ -0,0 +1,61 @@
+"""
+Compares the scalar and the batch burst feature computation.
+
+Usage: python benchmarks/burst_features.py [burst_count] [packets_per_burst]
+
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.burst_features import BurstAccumulator, get_numeric_features_batch
+
+
+REPEAT = 5
+
+
+def _time(func):
+
+    start_ts = time.perf_counter()
+    func()
+    return time.perf_counter() - start_ts
+
+
+def make_bursts(burst_count, packets_per_burst):
+
+    rng = random.Random(0)
+    burst_list = []
+    for burst_ix in range(burst_count):
+        burst = BurstAccumulator((6, '192.168.1.10', burst_ix, '93.184.216.34', 443, '5c:e9:1e:22:84:7d'))
+        ts = 1700000000.0
+        for _ in range(packets_per_burst):
+            ts += rng.expovariate(50)
+            if rng.random() < 0.5:
+                burst.add(ts, rng.randint(54, 1514), 'TCP', 'example.com', 6, '192.168.1.10', '93.184.216.34', '')
+            else:
+                burst.add(ts, 54, 'TCP', 'example.com', 6, '93.184.216.34', '192.168.1.10', '5c:e9:1e:22:84:7d')
+        burst_list.append(burst)
+
+    return burst_list
+
+
+def main():
+
+    burst_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    packets_per_burst = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    burst_list = make_bursts(burst_count, packets_per_burst)
+
+    # Best of REPEAT runs
+    scalar_time = min(_time(lambda: [burst.get_numeric_features() for burst in burst_list]) for _ in range(REPEAT))
+    batch_time = min(_time(lambda: get_numeric_features_batch(burst_list)) for _ in range(REPEAT))
+
+    print(f'{burst_count} bursts x {packets_per_burst} packets')
+    print(f'scalar: {scalar_time * 1000:.2f} ms')
+    print(f'batch:  {batch_time * 1000:.2f} ms ({scalar_time / batch_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Compares the hot Flow queries with the single-column indexes of earlier
+versions and with the current indexes (see core/model.py), on a synthetic
+Flow table. Prints the EXPLAIN QUERY PLAN output and the timing of each query.
+
+Usage: python benchmarks/flow_indexes.py [flow_count] [db_path]
+
+The default of 10M flows takes a few minutes to generate and about 2.5 GB of
+disk space; the database is deleted afterwards unless a path is given.
+
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import peewee
+import core.model as model
+
+
+REPEAT = 5
+
+DEVICE_COUNT = 50
+
+REMOTE_IP_COUNT = 20000
+
+# Flows per second in the synthetic table
+FLOW_RATE = 50
+
+# Fraction of the remote IP addresses without a hostname
+UNRESOLVED_RATIO = 0.02
+
+OLD_INDEX_SQL_LIST = [
+    f'CREATE INDEX "{index_name}" ON "flow" ("{index_name[len("flow_"):]}")'
+    for index_name in model.OBSOLETE_FLOW_INDEX_LIST
+]
+
+
+def generate_flows(db, flow_count):
+    """Fills the Flow table with uploads and downloads between devices and remote IP addresses."""
+
+    db.execute_sql(f"""
+        WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < {flow_count}),
+        r(i, device, remote, upload) AS MATERIALIZED (
+            SELECT i, abs(random()) % {DEVICE_COUNT}, abs(random()) % {REMOTE_IP_COUNT}, abs(random()) % 2 FROM n
+        )
+        INSERT INTO flow (
+            start_ts, end_ts, src_device_mac_addr, dst_device_mac_addr, src_port, dst_port,
+            src_ip_addr, dst_ip_addr, src_country, dst_country, src_hostname, dst_hostname,
+            src_reg_domain, dst_reg_domain, src_tracker_company, dst_tracker_company,
+            protocol, byte_count, packet_count
+        )
+        SELECT
+            1700000000.0 + i * 1.0 / {FLOW_RATE},
+            1700000000.0 + i * 1.0 / {FLOW_RATE} + 1,
+            CASE WHEN upload THEN printf('00:00:00:00:00:%02x', device) ELSE '' END,
+            CASE WHEN upload THEN '' ELSE printf('00:00:00:00:00:%02x', device) END,
+            50000, 443,
+            CASE WHEN upload THEN printf('192.168.0.%d', device) ELSE printf('10.%d.%d.1', remote / 256, remote % 256) END,
+            CASE WHEN upload THEN printf('10.%d.%d.1', remote / 256, remote % 256) ELSE printf('192.168.0.%d', device) END,
+            '', 'United States',
+            CASE WHEN upload OR remote < {int(REMOTE_IP_COUNT * UNRESOLVED_RATIO)} THEN '' ELSE printf('host%d.example.com', remote) END,
+            CASE WHEN NOT upload OR remote < {int(REMOTE_IP_COUNT * UNRESOLVED_RATIO)} THEN '' ELSE printf('host%d.example.com', remote) END,
+            '', '', '', '',
+            'tcp', 1 + abs(random()) % 100000, 1 + abs(random()) % 100
+        FROM r
+    """)
+
+
+def get_query_list(flow_count):
+
+    end_ts = 1700000000 + flow_count // FLOW_RATE
+
+    return [
+        (
+            'sidebar bandwidth (last 10 s)',
+            model.Flow.select(peewee.fn.SUM(model.Flow.byte_count)).where(
+                (model.Flow.src_device_mac_addr != '') &
+                (model.Flow.dst_device_mac_addr == '') &
+                (model.Flow.end_ts > end_ts - 10)
+            )
+        ),
+        (
+            'rollup backfill (last 24 h)',
+            model.Flow.select(model.Flow.dst_device_mac_addr, peewee.fn.SUM(model.Flow.byte_count)).where(
+                (model.Flow.end_ts > end_ts - 24 * 3600) &
+                (model.Flow.dst_device_mac_addr != '')
+            ).group_by(model.Flow.dst_device_mac_addr)
+        ),
+        (
+            'hostname back-fill: unresolved IPs',
+            model.Flow.select(model.Flow.dst_ip_addr).where(
+                (model.Flow.dst_ip_addr != '') &
+                (model.Flow.dst_hostname == '') &
+                (model.Flow.dst_device_mac_addr == '')
+            ).group_by(model.Flow.dst_ip_addr)
+        ),
+        (
+            'hostname back-fill: flows of one IP',
+            model.Flow.select(peewee.fn.COUNT(model.Flow.id)).where(
+                (model.Flow.dst_ip_addr == '10.0.1.1') &
+                (model.Flow.dst_hostname == '') &
+                (model.Flow.dst_device_mac_addr == '')
+            )
+        ),
+        (
+            'data donation (15 min)',
+            model.Flow.select(peewee.fn.COUNT(model.Flow.id)).where(
+                (model.Flow.start_ts >= end_ts - 900) &
+                (model.Flow.end_ts <= end_ts)
+            )
+        ),
+    ]
+
+
+def run_queries(db, flow_count):
+
+    for name, query in get_query_list(flow_count):
+        sql, params = query.sql()
+        plan = [row[-1] for row in db.execute_sql('EXPLAIN QUERY PLAN ' + sql, params).fetchall()]
+
+        best_time = float('inf')
+        for _ in range(REPEAT):
+            start_ts = time.perf_counter()
+            db.execute_sql(sql, params).fetchall()
+            best_time = min(best_time, time.perf_counter() - start_ts)
+
+        print(f'  {name}: {best_time * 1000:.2f} ms')
+        for line in plan:
+            print(f'      {line}')
+
+
+def main():
+
+    flow_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    db_path = sys.argv[2] if len(sys.argv) > 2 else None
+
+    temp_dir = None
+    if db_path is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(temp_dir.name, 'flow_indexes.sqlite3')
+
+    db = peewee.SqliteDatabase(db_path, pragmas={'journal_mode': 'wal'})
+    db.bind([model.Flow])
+
+    try:
+        with db:
+            if not db.table_exists('flow'):
+                print(f'Generating {flow_count} flows...')
+                start_ts = time.perf_counter()
+                # Create the table without any index
+                model.Flow._schema.create_table(safe=True)
+                generate_flows(db, flow_count)
+                print(f'Generated in {time.perf_counter() - start_ts:.1f} seconds')
+
+            for label, index_sql_list in (
+                ('Single-column indexes (earlier versions)', OLD_INDEX_SQL_LIST),
+                ('Current indexes', None),
+            ):
+                # Replace all Flow indexes
+                for (index_name,) in db.execute_sql(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'flow' AND sql IS NOT NULL"
+                ).fetchall():
+                    db.execute_sql(f'DROP INDEX "{index_name}"')
+
+                start_ts = time.perf_counter()
+                if index_sql_list is None:
+                    model.Flow._schema.create_indexes(safe=True)
+                else:
+                    for index_sql in index_sql_list:
+                        db.execute_sql(index_sql)
+                db.execute_sql('ANALYZE')
+                print(f'\n{label} (built in {time.perf_counter() - start_ts:.1f} seconds):')
+
+                run_queries(db, flow_count)
+
+    finally:
+        db.close()
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,454 @@
+"""
+Streaming computation of burst features.
+
+A BurstAccumulator is attached to each open burst and updated as packets
+arrive. It keeps running moments of the frame lengths and of the
+inter-arrival times, min/max, and the packet/byte counters by direction and
+locality, so that the numeric burst features (the first 22 columns of
+`cols_feat`) can be produced in O(1) when the burst closes, without building a
+DataFrame.
+
+The medians (medAbsDev, medianTBP) need the actual values; they are taken
+from a buffer of at most MEDIAN_BUFFER_SIZE values per burst, which holds
+every value unless the burst is longer than that (in which case it holds a
+uniform random sample).
+
+When many bursts close at once, `get_numeric_features_batch()` computes their
+features together with NumPy segmented reductions over the buffers, instead
+of one burst at a time.
+
+The features match those computed by BehavIoT with pandas/scipy/statsmodels:
+skew and kurtosis are the biased (population) estimates, varTBP uses one
+degree of freedom, and medAbsDev is scaled to be consistent with the normal
+standard deviation.
+
+"""
+import math
+import random
+from array import array
+
+import numpy as np
+
+import core.ip_classifier as ip_classifier
+
+
+# Maximum number of frame lengths and inter-arrival times kept per burst for
+# computing medians
+MEDIAN_BUFFER_SIZE = 4096
+
+# statsmodels.robust.mad's default normalization, scipy.stats.norm.ppf(0.75)
+MAD_NORMALIZATION = 0.6744897501960817
+
+# Direction codes of packets within a burst, relative to the burst's device
+DIRECTION_OUT_EXTERNAL = 0
+DIRECTION_IN_EXTERNAL = 1
+DIRECTION_OUT_LOCAL = 2
+DIRECTION_IN_LOCAL = 3
+DIRECTION_OTHER_LOCAL = 4
+DIRECTION_OTHER = 5
+
+# The numeric features, in the order of `cols_feat`
+numeric_cols_feat = [
+    "meanBytes", "minBytes", "maxBytes", "medAbsDev",
+    "skewLength", "kurtosisLength", "meanTBP", "varTBP",
+    "medianTBP", "kurtosisTBP", "skewTBP", "network_total",
+    "network_in", "network_out", "network_external", "network_local",
+    "network_in_local", "network_out_local", "meanBytes_out_external", "meanBytes_in_external",
+    "meanBytes_out_local", "meanBytes_in_local"
+]
+
+# Features that BurstAccumulator.get_numeric_features() returns as int
+_INT_FEATURE_IX_LIST = [
+    numeric_cols_feat.index(col) for col in (
+        "minBytes", "maxBytes", "network_total", "network_in", "network_out",
+        "network_external", "network_local", "network_in_local", "network_out_local"
+    )
+]
+
+# (feature, packet counter) pairs where the feature is the int 0 if the counter is 0
+_MEAN_BYTES_COUNTER_IX_LIST = [
+    (numeric_cols_feat.index(mean_col), numeric_cols_feat.index(counter_col)) for mean_col, counter_col in (
+        ("meanBytes_out_external", "network_out"), ("meanBytes_in_external", "network_in"),
+        ("meanBytes_out_local", "network_out_local"), ("meanBytes_in_local", "network_in_local")
+    )
+]
+
+# Features that get_numeric_features_batch() computes with different rounding
+_ROUNDED_FEATURE_IX_LIST = [
+    numeric_cols_feat.index(col) for col in (
+        "skewLength", "kurtosisLength", "varTBP", "kurtosisTBP", "skewTBP"
+    )
+]
+
+
+class RunningMoments(object):
+    """Running mean and central moments up to the fourth order."""
+
+    __slots__ = ('n', 'total', 'mean', 'm2', 'm3', 'm4')
+
+    def __init__(self):
+        self.n = 0
+        self.total = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.m3 = 0.0
+        self.m4 = 0.0
+
+    def add(self, x):
+        n1 = self.n
+        n = n1 + 1
+        delta = x - self.mean
+        delta_n = delta / n
+        delta_n2 = delta_n * delta_n
+        term1 = delta * delta_n * n1
+        self.mean += delta_n
+        self.m4 += term1 * delta_n2 * (n * n - 3 * n + 3) + 6 * delta_n2 * self.m2 - 4 * delta_n * self.m3
+        self.m3 += term1 * delta_n * (n - 2) - 3 * delta_n * self.m2
+        self.m2 += term1
+        self.n = n
+        self.total += x
+
+    def get_variance(self):
+        """Sample variance (one degree of freedom)."""
+        return self.m2 / (self.n - 1) if self.n > 1 else float('nan')
+
+    def get_skew(self):
+        """Biased sample skewness, as scipy.stats.skew."""
+        return math.sqrt(self.n) * self.m3 / self.m2 ** 1.5
+
+    def get_kurtosis(self):
+        """Biased excess kurtosis, as scipy.stats.kurtosis."""
+        return self.n * self.m4 / (self.m2 * self.m2) - 3.0
+
+
+def _median(values):
+
+    values = sorted(values)
+    n = len(values)
+    mid = n // 2
+    if n % 2:
+        return float(values[mid])
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+class BurstAccumulator(object):
+    """Incrementally computes the features of one burst."""
+
+    __slots__ = (
+        'my_device_mac', 'my_device_addr', 'external_destination_addr',
+        'length_moments', 'delta_moments', 'min_length', 'max_length',
+        'start_time', 'last_ts', 'length_buffer', 'delta_buffer', 'direction_buffer',
+        'counter_list', 'byte_counter_list', 'local_destination_device',
+        'hosts', 'protocols', 'trans_proto'
+    )
+
+    def __init__(self, flow_key):
+
+        # target devices meta information
+        self.my_device_mac = flow_key[-1]
+        self.my_device_addr = flow_key[1]
+        self.external_destination_addr = flow_key[3]
+
+        self.length_moments = RunningMoments()
+        self.delta_moments = RunningMoments()
+        self.min_length = None
+        self.max_length = None
+        self.start_time = None
+        self.last_ts = None
+
+        self.length_buffer = array('d')
+        self.delta_buffer = array('d')
+        # Direction code of each packet, for the batch engine; only complete
+        # while the burst fits the buffers (see is_buffered())
+        self.direction_buffer = array('b')
+
+        # Packet and byte counts, indexed by direction code
+        self.counter_list = [0] * 6
+        self.byte_counter_list = [0] * 6
+
+        self.local_destination_device = ''
+        self.hosts = set()
+        self.protocols = set()
+        self.trans_proto = None
+
+    @property
+    def packet_count(self):
+        return self.length_moments.n
+
+    def is_buffered(self):
+        """Returns True if the buffers hold every packet of the burst."""
+        return self.length_moments.n <= MEDIAN_BUFFER_SIZE
+
+    def add(self, ts, frame_len, protocol, host, ip_proto, src_ip_addr, dst_ip_addr, dst_mac_addr):
+        """Adds a packet to the burst."""
+
+        n = self.length_moments.n
+
+        if n == 0:
+            self.trans_proto = ip_proto
+            self.start_time = ts
+            self.min_length = frame_len
+            self.max_length = frame_len
+            delta = 0.0
+        else:
+            delta = ts - self.last_ts
+            self.start_time = min(self.start_time, ts)
+            self.min_length = min(self.min_length, frame_len)
+            self.max_length = max(self.max_length, frame_len)
+        self.last_ts = ts
+
+        self.length_moments.add(frame_len)
+        self.delta_moments.add(delta)
+        self._add_to_buffer(self.length_buffer, frame_len, n)
+        self._add_to_buffer(self.delta_buffer, delta, n)
+
+        self.hosts.add(host)
+        self.protocols.add(protocol)
+
+        direction = self.get_direction(src_ip_addr, dst_ip_addr, host)
+        self.counter_list[direction] += 1
+        self.byte_counter_list[direction] += frame_len
+        if n < MEDIAN_BUFFER_SIZE:
+            self.direction_buffer.append(direction)
+
+        # The first non-device packet to a local address identifies the local
+        # destination device
+        if not self.local_destination_device and dst_mac_addr != self.my_device_mac and ip_classifier.is_private(dst_ip_addr):
+            self.local_destination_device = dst_mac_addr
+
+    def get_direction(self, src_ip_addr, dst_ip_addr, host):
+        """Returns the direction code of a packet within this burst."""
+
+        src_is_private = ip_classifier.is_private(src_ip_addr)
+        dst_is_private = ip_classifier.is_private(dst_ip_addr)
+
+        if src_is_private and not dst_is_private:  # source addr; outbound packet
+            return DIRECTION_OUT_EXTERNAL
+        if dst_is_private and not src_is_private:  # destination addr; inbound packet
+            return DIRECTION_IN_EXTERNAL
+        if src_ip_addr == self.my_device_addr and dst_is_private:  # local outgoing packet
+            return DIRECTION_OUT_LOCAL
+        if src_is_private and dst_ip_addr == self.my_device_addr:  # local inbound packet
+            return DIRECTION_IN_LOCAL
+        if host == '(local network)':
+            return DIRECTION_OTHER_LOCAL
+        return DIRECTION_OTHER
+
+    def get_numeric_features(self):
+        """Returns the 22 numeric features, in the order of numeric_cols_feat."""
+
+        length_moments = self.length_moments
+        delta_moments = self.delta_moments
+        n = length_moments.n
+
+        meanBytes = length_moments.total / n
+        median_length = _median(self.length_buffer)
+        medAbsDev = _median([abs(x - median_length) for x in self.length_buffer]) / MAD_NORMALIZATION
+        if medAbsDev < 1e-10:
+            skewL = 0
+            kurtL = 0
+        else:
+            skewL = length_moments.get_skew()
+            kurtL = length_moments.get_kurtosis()
+
+        meanTBP = delta_moments.total / n
+        varTBP = delta_moments.get_variance()
+        medTBP = _median(self.delta_buffer)
+        if varTBP < 1e-10:
+            kurtT = 0
+            skewT = 0
+        else:
+            kurtT = delta_moments.get_kurtosis()
+            skewT = delta_moments.get_skew()
+
+        counter_list = self.counter_list
+        byte_counter_list = self.byte_counter_list
+
+        network_out = counter_list[DIRECTION_OUT_EXTERNAL]
+        network_in = counter_list[DIRECTION_IN_EXTERNAL]
+        network_out_local = counter_list[DIRECTION_OUT_LOCAL]
+        network_in_local = counter_list[DIRECTION_IN_LOCAL]
+        network_external = network_out + network_in
+        network_local = network_out_local + network_in_local + counter_list[DIRECTION_OTHER_LOCAL]
+
+        def _mean_bytes(direction):
+            count = counter_list[direction]
+            return byte_counter_list[direction] / count if count else 0
+
+        return [
+            meanBytes, self.min_length, self.max_length, medAbsDev, skewL,
+            kurtL, meanTBP, varTBP, medTBP, kurtT,
+            skewT, n, network_in, network_out, network_external,
+            network_local, network_in_local, network_out_local,
+            _mean_bytes(DIRECTION_OUT_EXTERNAL), _mean_bytes(DIRECTION_IN_EXTERNAL),
+            _mean_bytes(DIRECTION_OUT_LOCAL), _mean_bytes(DIRECTION_IN_LOCAL)
+        ]
+
+    @staticmethod
+    def _add_to_buffer(buffer, value, seen_count):
+        """Reservoir-samples `value` into `buffer`, given `seen_count` earlier values."""
+
+        if seen_count < MEDIAN_BUFFER_SIZE:
+            buffer.append(value)
+            return
+
+        ix = random.randint(0, seen_count)
+        if ix < MEDIAN_BUFFER_SIZE:
+            buffer[ix] = value
+
+
+def get_numeric_features_batch(burst_list):
+    """
+    Returns the numeric features of many bursts at once, as a list of lists in
+    the order of numeric_cols_feat, with the same values and types as
+    BurstAccumulator.get_numeric_features(). Each burst must have at least
+    two packets.
+
+    The variance, skew and kurtosis (_ROUNDED_FEATURE_IX_LIST) can differ in
+    the last bits: they are computed here in two passes over the values, and
+    by RunningMoments in one pass of online updates, which round differently.
+    All other features are equal.
+
+    Bursts whose buffers hold every packet are concatenated into flat arrays
+    of frame lengths, inter-arrival times and direction codes, with the
+    statistics computed by segmented reductions (`np.add.reduceat` etc.);
+    the remaining bursts fall back to BurstAccumulator.get_numeric_features().
+
+    """
+    feature_list = [None] * len(burst_list)
+
+    batch_ix_list = []
+    for ix, burst in enumerate(burst_list):
+        if burst.is_buffered():
+            batch_ix_list.append(ix)
+        else:
+            feature_list[ix] = burst.get_numeric_features()
+
+    if batch_ix_list:
+        batch_burst_list = [burst_list[ix] for ix in batch_ix_list]
+        counts = np.array([burst.packet_count for burst in batch_burst_list], dtype=np.int64)
+        offsets = np.zeros(len(counts), dtype=np.int64)
+        np.cumsum(counts[:-1], out=offsets[1:])
+        lengths = np.frombuffer(b''.join([burst.length_buffer for burst in batch_burst_list]), dtype=np.float64)
+        deltas = np.frombuffer(b''.join([burst.delta_buffer for burst in batch_burst_list]), dtype=np.float64)
+        directions = np.frombuffer(b''.join([burst.direction_buffer for burst in batch_burst_list]), dtype=np.int8)
+
+        feature_matrix = compute_numeric_features(lengths, deltas, directions, offsets)
+        for ix, features in zip(batch_ix_list, feature_matrix.tolist()):
+            feature_list[ix] = _match_scalar_types(features)
+
+    return feature_list
+
+
+def _match_scalar_types(features):
+    """
+    Converts a row of compute_numeric_features() in place to the types that
+    BurstAccumulator.get_numeric_features() returns, i.e., ints for the
+    counters, min/max, and the features it sets to 0.
+
+    """
+    for ix in _INT_FEATURE_IX_LIST:
+        features[ix] = int(features[ix])
+
+    # skewLength and kurtosisLength if medAbsDev is 0; kurtosisTBP and skewTBP if varTBP is 0
+    if features[3] < 1e-10:
+        features[4] = features[5] = 0
+    if features[7] < 1e-10:
+        features[9] = features[10] = 0
+
+    for mean_ix, counter_ix in _MEAN_BYTES_COUNTER_IX_LIST:
+        if not features[counter_ix]:
+            features[mean_ix] = 0
+
+    return features
+
+
+def compute_numeric_features(lengths, deltas, directions, offsets):
+    """
+    Computes the numeric features of the bursts stored back to back in the
+    flat arrays `lengths`, `deltas` (inter-arrival times, 0 for the first
+    packet of each burst) and `directions` (DIRECTION_* codes). `offsets`
+    holds the index of the first packet of each burst, in increasing order.
+
+    Returns a (number of bursts, 22) float array.
+
+    """
+    burst_count = len(offsets)
+    counts = np.diff(np.append(offsets, len(lengths)))
+    segment_ids = np.repeat(np.arange(burst_count), counts)
+
+    meanBytes, m2L, m3L, m4L = _segment_moments(lengths, offsets, counts)
+    minBytes = np.minimum.reduceat(lengths, offsets)
+    maxBytes = np.maximum.reduceat(lengths, offsets)
+    median_length = _segment_median(lengths, segment_ids, offsets, counts)
+    medAbsDev = _segment_median(np.abs(lengths - median_length[segment_ids]), segment_ids, offsets, counts) / MAD_NORMALIZATION
+
+    meanTBP, m2T, m3T, m4T = _segment_moments(deltas, offsets, counts)
+    varTBP = m2T * counts / (counts - 1)
+    medTBP = _segment_median(deltas, segment_ids, offsets, counts)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        skewL = np.where(medAbsDev < 1e-10, 0.0, m3L / m2L ** 1.5)
+        kurtL = np.where(medAbsDev < 1e-10, 0.0, m4L / (m2L * m2L) - 3.0)
+        skewT = np.where(varTBP < 1e-10, 0.0, m3T / m2T ** 1.5)
+        kurtT = np.where(varTBP < 1e-10, 0.0, m4T / (m2T * m2T) - 3.0)
+
+    # Packet and byte counts per (burst, direction)
+    bins = segment_ids * 6 + directions
+    counter_matrix = np.bincount(bins, minlength=burst_count * 6).reshape(burst_count, 6)
+    byte_counter_matrix = np.bincount(bins, weights=lengths, minlength=burst_count * 6).reshape(burst_count, 6)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_bytes_matrix = np.where(counter_matrix > 0, byte_counter_matrix / counter_matrix, 0.0)
+
+    network_out = counter_matrix[:, DIRECTION_OUT_EXTERNAL]
+    network_in = counter_matrix[:, DIRECTION_IN_EXTERNAL]
+    network_out_local = counter_matrix[:, DIRECTION_OUT_LOCAL]
+    network_in_local = counter_matrix[:, DIRECTION_IN_LOCAL]
+
+    return np.column_stack([
+        meanBytes, minBytes, maxBytes, medAbsDev, skewL,
+        kurtL, meanTBP, varTBP, medTBP, kurtT,
+        skewT, counts, network_in, network_out, network_out + network_in,
+        network_out_local + network_in_local + counter_matrix[:, DIRECTION_OTHER_LOCAL], network_in_local, network_out_local,
+        mean_bytes_matrix[:, DIRECTION_OUT_EXTERNAL], mean_bytes_matrix[:, DIRECTION_IN_EXTERNAL],
+        mean_bytes_matrix[:, DIRECTION_OUT_LOCAL], mean_bytes_matrix[:, DIRECTION_IN_LOCAL]
+    ]).astype(np.float64)
+
+
+def _segment_moments(values, offsets, counts):
+    """Returns the per-segment mean and 2nd-4th (biased) central moments."""
+
+    mean = np.add.reduceat(values, offsets) / counts
+    dev = values - np.repeat(mean, counts)
+    dev2 = dev * dev
+    m2 = np.add.reduceat(dev2, offsets) / counts
+    m3 = np.add.reduceat(dev2 * dev, offsets) / counts
+    m4 = np.add.reduceat(dev2 * dev2, offsets) / counts
+
+    return mean, m2, m3, m4
+
+
+def _segment_median(values, segment_ids, offsets, counts):
+    """Returns the median of each segment."""
+
+    max_count = counts.max()
+
+    if len(counts) * max_count <= 4 * len(values):
+        # Segments of similar sizes: sort the rows of a matrix with one
+        # segment per row, padded with +inf
+        matrix = np.full((len(counts), max_count), np.inf)
+        matrix[segment_ids, np.arange(len(values)) - offsets[segment_ids]] = values
+        matrix.sort(axis=1)
+        rows = np.arange(len(counts))
+        lower = matrix[rows, (counts - 1) // 2]
+        upper = matrix[rows, counts // 2]
+
+    else:
+        # Sort by value, then (stably) by segment
+        order = np.argsort(values)
+        order = order[np.argsort(segment_ids[order], kind='stable')]
+        sorted_values = values[order]
+        lower = sorted_values[offsets + (counts - 1) // 2]
+        upper = sorted_values[offsets + counts // 2]
+
+    return (lower + upper) / 2.0
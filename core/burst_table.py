@@ -0,0 +1,83 @@
+"""
+Holds the open bursts of the packet processor.
+
+A burst covers the packets of one flow seen within BURST_WRITE_INTERVAL
+seconds of the flow's first packet; the table stores one object per burst
+(see `burst_features.BurstAccumulator`). Open bursts are kept in a dict keyed
+by flow key, plus a min-heap ordered by burst start time, so that finding the
+bursts that have expired only touches those bursts, i.e., O(log n) per
+expired burst instead of a scan over all open bursts per packet.
+
+Closing a burst early (see `pop()`) leaves its heap entry behind; such stale
+entries are recognized by their sequence number and skipped.
+
+"""
+import heapq
+import itertools
+
+
+class BurstTable(object):
+
+    def __init__(self):
+
+        # Maps flow key -> [seq, start_ts, burst]
+        self._burst_dict = {}
+
+        # Heap of (start_ts, seq, flow_key)
+        self._heap = []
+        self._seq_counter = itertools.count()
+
+    def __len__(self):
+        return len(self._burst_dict)
+
+    def __contains__(self, flow_key):
+        return flow_key in self._burst_dict
+
+    def get_start_ts(self, flow_key):
+        """Returns the start time of the open burst of a flow, or None."""
+
+        entry = self._burst_dict.get(flow_key)
+        return None if entry is None else entry[1]
+
+    def open(self, flow_key, start_ts, burst):
+        """Opens a new burst for a flow that does not have one yet."""
+
+        seq = next(self._seq_counter)
+        self._burst_dict[flow_key] = [seq, start_ts, burst]
+        heapq.heappush(self._heap, (start_ts, seq, flow_key))
+
+    def get(self, flow_key):
+        """Returns the open burst of a flow, or None."""
+
+        entry = self._burst_dict.get(flow_key)
+        return None if entry is None else entry[2]
+
+    def pop(self, flow_key):
+        """Closes the open burst of a flow; returns (start_ts, burst) or None."""
+
+        entry = self._burst_dict.pop(flow_key, None)
+        if entry is None:
+            return None
+
+        return entry[1], entry[2]
+
+    def pop_expired(self, current_ts, interval):
+        """
+        Closes every burst that started more than `interval` seconds before
+        `current_ts`; returns a list of (flow_key, start_ts, burst) in the
+        order of their start times.
+
+        """
+        expired_list = []
+        heap = self._heap
+
+        while heap and current_ts - heap[0][0] > interval:
+            start_ts, seq, flow_key = heapq.heappop(heap)
+            entry = self._burst_dict.get(flow_key)
+            # Skip stale heap entries of bursts that were already closed
+            if entry is None or entry[0] != seq:
+                continue
+            del self._burst_dict[flow_key]
+            expired_list.append((flow_key, start_ts, entry[2]))
+
+        return expired_list
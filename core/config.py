@@ -5,10 +5,10 @@ The Configuration table acts like a key-value store.
 
 """
 import core.model as model
+import core.db_writer as db_writer
 import json
 
 
-
 def get(config_key, default_config_value=None):
     """
     Returns an object associated with the configuration key. If the key is not
@@ -17,18 +17,28 @@ def get(config_key, default_config_value=None):
     and return the default_config_value.
 
     """
-    with model.write_lock:
-        with model.db:
-            try:
-                return json.loads(
-                    model.Configuration.get(model.Configuration.key == config_key).value
-                )
-            except model.Configuration.DoesNotExist:
-                if default_config_value is None:
-                    raise KeyError
-                model.Configuration.create(key=config_key, value=json.dumps(default_config_value))
-                return default_config_value
+    with model.db:
+        try:
+            return json.loads(
+                model.Configuration.get(model.Configuration.key == config_key).value
+            )
+        except model.Configuration.DoesNotExist:
+            if default_config_value is None:
+                raise KeyError
+
+    return json.loads(
+        db_writer.execute(_get_or_create, config_key, json.dumps(default_config_value))
+    )
+
+
+def _get_or_create(config_key, default_config_value_str):
+    """Returns the stored configuration value, creating it if missing; runs on the DB writer."""
 
+    config, _ = model.Configuration.get_or_create(
+        key=config_key,
+        defaults={'value': default_config_value_str}
+    )
+    return config.value
 
 
 def set(config_key, config_value):
@@ -40,21 +50,24 @@ def set(config_key, config_value):
     """
     config_value_str = json.dumps(config_value)
 
-    with model.write_lock:
-        with model.db:
-            try:
-                model.Configuration.get(model.Configuration.key == config_key)
+    db_writer.execute(_set, config_key, config_value_str)
 
-            except model.Configuration.DoesNotExist:
-                # Create the entry because it doesn't exist yet
-                model.Configuration.create(key=config_key, value=config_value_str)
+    return config_value
 
-            else:
-                # Update the entry because it already exists
-                model.Configuration.update(value=config_value_str).where(model.Configuration.key == config_key).execute()
 
-    return config_value
+def _set(config_key, config_value_str):
+    """Writes a configuration value; runs on the DB writer."""
+
+    try:
+        model.Configuration.get(model.Configuration.key == config_key)
+
+    except model.Configuration.DoesNotExist:
+        # Create the entry because it doesn't exist yet
+        model.Configuration.create(key=config_key, value=config_value_str)
 
+    else:
+        # Update the entry because it already exists
+        model.Configuration.update(value=config_value_str).where(model.Configuration.key == config_key).execute()
 
 
 def items():
@@ -4,6 +4,7 @@ Donates data.
 """
 import core.config as config
 import core.model as model
+import core.flow_shard as flow_shard
 import core.global_state as global_state
 import core.networking as networking
 import core.common as common
@@ -55,12 +56,15 @@ def donate_network_data(user_key):
         config.get('last_donation_ts', 0)
     )
 
-    # Slice the flows based on these times
-    with model.db:
-        q = model.Flow().select().where(
-            (model.Flow.start_ts >= start_time) &
-            (model.Flow.end_ts <= end_time)
-        )
+    # Slice the flows based on these times, reading only the flow shards (if
+    # enabled) that overlap them
+    q = []
+    for flow_db in flow_shard.get_flow_databases(start_time, end_time):
+        with flow_db:
+            q += model.Flow().select().where(
+                (model.Flow.start_ts >= start_time) &
+                (model.Flow.end_ts <= end_time)
+            ).execute(flow_db)
 
     # Maps MAC address to {remote_hostname_set, remote_ip_addr_set}
     pending_donation_dict = {}
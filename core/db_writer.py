@@ -0,0 +1,127 @@
+"""
+Serializes all writes to the database through a single writer thread.
+
+Instead of taking a lock and opening its own transaction, a caller hands a
+function that performs its writes (with the models in core/model.py) to the
+writer thread, which does all the writing:
+
+def rename_device(mac_addr, name):
+    model.Device.update(product_name=name).where(model.Device.mac_addr == mac_addr).execute()
+
+db_writer.execute(rename_device, mac_addr, name)  # waits; returns the function's result
+db_writer.submit(rename_device, mac_addr, name)   # returns a Future right away
+
+The writer runs the queued functions back to back in one transaction (group
+commit), collecting them for at most DB_WRITER_COMMIT_INTERVAL seconds. Each
+function runs in its own savepoint, so a function that raises only rolls back
+its own writes; its exception is passed on to the caller (and logged).
+
+Within a function, `with model.db:` blocks are nested in the writer's
+transaction, and functions submitted from the writer thread run directly.
+
+"""
+import concurrent.futures
+import queue
+import threading
+import time
+import traceback
+import core.common as common
+import core.model as model
+
+
+# Longest time (in seconds) to wait for more writes before committing
+DB_WRITER_COMMIT_INTERVAL = 0.005
+
+# Maximum number of functions per transaction
+DB_WRITER_MAX_BATCH_SIZE = 256
+
+_lock = threading.Lock()
+
+_queue = [None]
+
+_writer_thread = [None]
+
+
+def submit(func, *args, **kwargs) -> concurrent.futures.Future:
+    """Queues a function for the writer thread; returns a Future of its result."""
+
+    future = concurrent.futures.Future()
+
+    if threading.current_thread() is _writer_thread[0]:
+        _run(future, func, args, kwargs)
+    else:
+        _queue[0].put((future, func, args, kwargs))
+
+    return future
+
+
+def execute(func, *args, **kwargs):
+    """Runs a function on the writer thread and waits for its result."""
+
+    return submit(func, *args, **kwargs).result()
+
+
+def _run(future, func, args, kwargs):
+    """Runs a function in a savepoint and records its outcome in the future."""
+
+    try:
+        with model.db.atomic():
+            result = func(*args, **kwargs)
+    except Exception as e:
+        common.log('[DB Writer] Exception in {}: {} - traceback: {}'.format(
+            func, e, traceback.format_exc())
+        )
+        future.set_exception(e)
+    else:
+        future.set_result(result)
+
+
+def _worker():
+
+    while True:
+
+        job_list = [_queue[0].get()]
+
+        # Collect more writes for the same transaction
+        deadline = time.time() + DB_WRITER_COMMIT_INTERVAL
+        while len(job_list) < DB_WRITER_MAX_BATCH_SIZE:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                job_list.append(_queue[0].get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        # Results are only handed out once the transaction has been committed
+        pending_list = []
+        try:
+            with model.db:
+                for future, func, args, kwargs in job_list:
+                    pending_future = concurrent.futures.Future()
+                    _run(pending_future, func, args, kwargs)
+                    pending_list.append((future, pending_future))
+
+        except Exception as e:
+            common.log('[DB Writer] Commit failed: {} - traceback: {}'.format(e, traceback.format_exc()))
+            for future, _, _, _ in job_list:
+                future.set_exception(e)
+            continue
+
+        for future, pending_future in pending_list:
+            if pending_future.exception() is None:
+                future.set_result(pending_future.result())
+            else:
+                future.set_exception(pending_future.exception())
+
+
+# Start the writer thread automatically
+with _lock:
+    if _queue[0] is None:
+        # Start the writer thread exactly once
+        _queue[0] = queue.Queue()
+        _writer_thread[0] = threading.Thread(
+            target=_worker,
+            daemon=True
+        )
+        _writer_thread[0].start()
@@ -0,0 +1,159 @@
+"""
+In-memory copy of the IP address and DHCP hostname of every device.
+
+ARP and DHCP packets update devices all the time, almost always with values
+the Device table already holds. This cache answers those lookups without SQL
+and only marks a device dirty if a value actually changes; `flush()`, which
+runs every DEVICE_FLUSH_INTERVAL seconds, writes the dirty devices in one
+batch through the DB writer.
+
+The cache is loaded from the Device table on first use. It is authoritative
+for the two columns it holds: no other code writes them. Code that deletes
+devices must call `clear()` on the DB writer, in the same job as the delete,
+so that neither a later nor an in-flight flush writes them back.
+
+"""
+import threading
+import core.common as common
+import core.db_writer as db_writer
+import core.model as model
+
+
+# How often to write changed devices to the database (in seconds)
+DEVICE_FLUSH_INTERVAL = 2
+
+_lock = threading.Lock()
+
+# Maps mac_addr -> {'ip_addr': str, 'dhcp_hostname': str}; None until loaded
+_device_dict = [None]
+
+# MAC addresses of devices that are not in the database yet
+_new_mac_set = set()
+
+# MAC addresses of devices whose values have changed since the last flush
+_dirty_mac_set = set()
+
+# Incremented by `clear()`; rows taken by a flush of an earlier generation are dropped
+_generation = [0]
+
+
+def _load():
+    """Loads the cache from the database. Must hold the lock."""
+
+    if _device_dict[0] is not None:
+        return
+
+    device_dict = {}
+    with model.db:
+        for mac_addr, ip_addr, dhcp_hostname in model.Device.select(
+            model.Device.mac_addr, model.Device.ip_addr, model.Device.dhcp_hostname
+        ).tuples():
+            device_dict[mac_addr] = {'ip_addr': ip_addr, 'dhcp_hostname': dhcp_hostname}
+
+    _device_dict[0] = device_dict
+
+
+def update(mac_addr, **field_dict) -> bool:
+    """
+    Sets the given fields (ip_addr and/or dhcp_hostname) of a device, creating
+    the device if needed. Returns True if anything changed.
+
+    """
+    with _lock:
+        _load()
+        device = _device_dict[0].get(mac_addr)
+        if device is None:
+            device = {'ip_addr': '', 'dhcp_hostname': ''}
+            device.update(field_dict)
+            _device_dict[0][mac_addr] = device
+            _new_mac_set.add(mac_addr)
+            _dirty_mac_set.add(mac_addr)
+            return True
+
+        if all(device[field] == value for field, value in field_dict.items()):
+            return False
+
+        device.update(field_dict)
+        _dirty_mac_set.add(mac_addr)
+        return True
+
+
+def get_ip_mac_dict() -> dict:
+    """Returns a dict that maps the IP address of each device to its MAC address."""
+
+    with _lock:
+        _load()
+        return {device['ip_addr']: mac_addr for mac_addr, device in _device_dict[0].items()}
+
+
+def clear():
+    """Drops the cached and unwritten devices; the cache is reloaded on next use."""
+
+    with _lock:
+        _device_dict[0] = None
+        _new_mac_set.clear()
+        _dirty_mac_set.clear()
+        _generation[0] += 1
+
+
+def flush():
+    """Writes the devices that have changed to the database."""
+
+    with _lock:
+        if not _dirty_mac_set:
+            return
+        new_row_list = []
+        changed_row_list = []
+        for mac_addr in _dirty_mac_set:
+            row = dict(_device_dict[0][mac_addr], mac_addr=mac_addr)
+            if mac_addr in _new_mac_set:
+                new_row_list.append(row)
+            else:
+                changed_row_list.append(row)
+        dirty_mac_set = set(_dirty_mac_set)
+        _dirty_mac_set.clear()
+        _new_mac_set.clear()
+        generation = _generation[0]
+
+    try:
+        db_writer.execute(_write_rows, new_row_list, changed_row_list, generation)
+    except Exception:
+        # Write these devices again next time, unless they have been cleared
+        with _lock:
+            if generation == _generation[0]:
+                _dirty_mac_set.update(dirty_mac_set)
+                _new_mac_set.update(row['mac_addr'] for row in new_row_list)
+        raise
+
+    common.log(f'[Device Cache] Wrote {len(new_row_list)} new and {len(changed_row_list)} changed devices.')
+
+
+def _write_rows(new_row_list, changed_row_list, generation):
+    """
+    Writes device rows, unless the cache has been cleared since they were
+    taken; runs on the DB writer.
+
+    """
+    with _lock:
+        if generation != _generation[0]:
+            return
+
+    # A new device may already be in the table, e.g., if it was written
+    # before the cache was loaded; update it instead of adding a duplicate
+    if new_row_list:
+        existing_mac_set = {
+            mac_addr for (mac_addr,) in model.Device.select(model.Device.mac_addr).where(
+                model.Device.mac_addr.in_([row['mac_addr'] for row in new_row_list])
+            ).tuples()
+        }
+        changed_row_list = changed_row_list + [row for row in new_row_list if row['mac_addr'] in existing_mac_set]
+        new_row_list = [row for row in new_row_list if row['mac_addr'] not in existing_mac_set]
+
+    if new_row_list:
+        model.Device.insert_many(new_row_list).execute()
+
+    for row in changed_row_list:
+        model.Device.update(
+            ip_addr=row['ip_addr'],
+            dhcp_hostname=row['dhcp_hostname']
+        ).where(model.Device.mac_addr == row['mac_addr']).execute()
@@ -0,0 +1,327 @@
+"""
+Retention of the Flow and FlowRollup tables.
+
+Every flow is added to the rollups when it is written (see
+core/flow_rollup.py), so raw flows can be deleted after a number of days (the
+`flow_retention_days` configuration value) without losing the traffic
+history; flows from before the rollups existed are rolled up first. The
+rollups of each bucket size are in turn kept for ROLLUP_RETENTION_DICT
+seconds, so that older traffic remains available at a coarser granularity.
+
+Rows are deleted RETENTION_DELETE_BATCH_SIZE at a time, each batch in its own
+DB writer job, so that other writes are not held up; if flows are stored in
+daily shards (see core/flow_shard.py), the shards of old days are deleted as
+whole files. After deleting, `run()` returns free pages to the file system
+(incremental vacuum) and checkpoints the WAL.
+
+The tier sizes are estimated on demand by `get_stats()` without reading the
+tables, so that the metrics stay cheap on large databases.
+
+"""
+import os
+import threading
+import time
+import peewee
+import core.common as common
+import core.config as config
+import core.db_writer as db_writer
+import core.flow_rollup as flow_rollup
+import core.flow_shard as flow_shard
+import core.model as model
+
+
+# Default number of days to keep raw flows for
+FLOW_RETENTION_DAYS = 7
+
+# Maps bucket size -> number of seconds to keep rollups for; None keeps them
+ROLLUP_RETENTION_DICT = {
+    2: 24 * 3600,
+    60: 7 * 24 * 3600,
+    300: 30 * 24 * 3600,
+    1800: None,
+}
+
+# How often to apply the retention policy (in seconds)
+RETENTION_INTERVAL = 600
+
+# Number of rows per delete
+RETENTION_DELETE_BATCH_SIZE = 5000
+
+# Pause between deletes (in seconds)
+RETENTION_BATCH_PAUSE = 0.05
+
+# Maximum number of free pages to return to the file system per run
+VACUUM_PAGES_PER_RUN = 10000
+
+# Number of free pages to return per DB writer job
+VACUUM_BATCH_SIZE = 1000
+
+# Set to True to rebuild databases without incremental vacuum at startup; the
+# full VACUUM blocks the startup and takes long on large databases
+RETENTION_VACUUM_AT_STARTUP = False
+
+_stat_lock = threading.Lock()
+
+_stat_dict = {
+    'run_count': 0,
+    'deleted_flows': 0,
+    'deleted_rollups': 0,
+    'deleted_shards': 0,
+    'vacuumed_pages': 0,
+    'last_run_ts': 0,
+    'last_run_duration': 0,
+}
+
+
+def initialize():
+    """
+    Enables incremental vacuum on databases created by earlier versions, which
+    requires rebuilding the database once; only if RETENTION_VACUUM_AT_STARTUP
+    is set.
+
+    """
+    with model.db.connection_context():
+        if model.db.pragma('auto_vacuum') == 2:
+            return
+
+        if not RETENTION_VACUUM_AT_STARTUP:
+            common.log('[Flow Retention] Warning: incremental vacuum is disabled on this database, so deleted '
+                       'rows do not shrink the file; set RETENTION_VACUUM_AT_STARTUP to rebuild it at startup')
+            return
+
+        common.log('[Flow Retention] Enabling incremental vacuum; rebuilding the database')
+        start_ts = time.time()
+        model.db.pragma('auto_vacuum', 'incremental')
+        model.db.execute_sql('VACUUM')
+
+    common.log('[Flow Retention] Rebuilt the database in {:.1f} seconds'.format(time.time() - start_ts))
+
+
+def run():
+    """Applies the retention policy once."""
+
+    start_ts = time.time()
+
+    # Delete old flows
+    flow_cutoff_ts = start_ts - config.get('flow_retention_days', FLOW_RETENTION_DAYS) * 24 * 3600
+    rollup_start_ts = config.get('flow_rollup_start_ts', 0)
+    deleted_flow_count = _delete_in_batches(
+        _roll_up_and_delete_flows, min(flow_cutoff_ts, rollup_start_ts)
+    )
+    deleted_flow_count += _delete_in_batches(_delete_flows, flow_cutoff_ts)
+
+    # Delete the shards of old days, if flows are stored in shards
+    deleted_shard_count = flow_shard.delete_shards_before(flow_cutoff_ts)
+
+    # Delete old rollups
+    deleted_rollup_count = 0
+    for bucket_size, retention_seconds in ROLLUP_RETENTION_DICT.items():
+        if retention_seconds is not None:
+            deleted_rollup_count += _delete_in_batches(
+                _delete_rollups, bucket_size, start_ts - retention_seconds
+            )
+
+    vacuumed_page_count = _vacuum_in_batches()
+    _checkpoint()
+
+    duration = time.time() - start_ts
+    with _stat_lock:
+        _stat_dict['run_count'] += 1
+        _stat_dict['deleted_flows'] += deleted_flow_count
+        _stat_dict['deleted_rollups'] += deleted_rollup_count
+        _stat_dict['deleted_shards'] += deleted_shard_count
+        _stat_dict['vacuumed_pages'] += vacuumed_page_count
+        _stat_dict['last_run_ts'] = start_ts
+        _stat_dict['last_run_duration'] = duration
+
+    common.log('[Flow Retention] Deleted {} flows, {} rollups and {} shards, freed {} pages in {:.3f} seconds'.format(
+        deleted_flow_count, deleted_rollup_count, deleted_shard_count, vacuumed_page_count, duration
+    ))
+
+
+def get_stats() -> dict:
+    """Returns the retention counters and the current tier sizes."""
+
+    with _stat_lock:
+        stat_dict = dict(_stat_dict)
+
+    stat_dict['tiers'] = get_tier_sizes()
+
+    return stat_dict
+
+
+def _delete_in_batches(delete_func, *args) -> int:
+    """Calls a delete function on the DB writer until it deletes less than a batch."""
+
+    total_count = 0
+
+    while True:
+        count = db_writer.execute(delete_func, *args)
+        total_count += count
+        if count < RETENTION_DELETE_BATCH_SIZE:
+            return total_count
+        time.sleep(RETENTION_BATCH_PAUSE)
+
+
+def _roll_up_and_delete_flows(cutoff_ts) -> int:
+    """
+    Adds a batch of flows that ended before `cutoff_ts` to the rollups and
+    deletes them; runs on the DB writer.
+
+    """
+    flow_row_list = list(
+        model.Flow.select()
+            .where(model.Flow.end_ts <= cutoff_ts)
+            .order_by(model.Flow.end_ts)
+            .limit(RETENTION_DELETE_BATCH_SIZE)
+            .dicts()
+    )
+    if not flow_row_list:
+        return 0
+
+    flow_rollup.update(flow_row_list)
+
+    return model.Flow.delete().where(
+        model.Flow.id.in_([flow_row['id'] for flow_row in flow_row_list])
+    ).execute()
+
+
+def _delete_flows(cutoff_ts) -> int:
+    """Deletes a batch of flows that ended before `cutoff_ts`; runs on the DB writer."""
+
+    return model.Flow.delete().where(
+        model.Flow.id.in_(
+            model.Flow.select(model.Flow.id)
+                .where(model.Flow.end_ts < cutoff_ts)
+                .limit(RETENTION_DELETE_BATCH_SIZE)
+        )
+    ).execute()
+
+
+def _delete_rollups(bucket_size, cutoff_ts) -> int:
+    """Deletes a batch of rollups of a bucket size from before `cutoff_ts`; runs on the DB writer."""
+
+    return model.FlowRollup.delete().where(
+        model.FlowRollup.id.in_(
+            model.FlowRollup.select(model.FlowRollup.id)
+                .where(
+                    (model.FlowRollup.bucket_size == bucket_size) &
+                    (model.FlowRollup.bucket_ts < cutoff_ts)
+                )
+                .limit(RETENTION_DELETE_BATCH_SIZE)
+        )
+    ).execute()
+
+
+def _vacuum_in_batches() -> int:
+    """
+    Returns up to VACUUM_PAGES_PER_RUN free pages to the file system,
+    VACUUM_BATCH_SIZE pages per DB writer job. Does nothing unless incremental
+    vacuum is enabled (see `initialize()`).
+
+    """
+    with model.db.connection_context():
+        if model.db.pragma('auto_vacuum') != 2:
+            return 0
+
+    total_count = 0
+
+    while total_count < VACUUM_PAGES_PER_RUN:
+        page_count = min(VACUUM_BATCH_SIZE, VACUUM_PAGES_PER_RUN - total_count)
+        count = db_writer.execute(_incremental_vacuum, page_count)
+        total_count += count
+        if count < page_count:
+            return total_count
+        time.sleep(RETENTION_BATCH_PAUSE)
+
+    return total_count
+
+
+def _incremental_vacuum(page_count) -> int:
+    """Returns up to `page_count` free pages to the file system; runs on the DB writer."""
+
+    start_free_count = model.db.pragma('freelist_count')
+    page_count = min(start_free_count, page_count)
+
+    # Each step of the pragma frees one page
+    model.db.execute_sql(f'PRAGMA incremental_vacuum({page_count})').fetchall()
+
+    # Python's sqlite3 stops pragmas without result columns after the first
+    # step; step through the remaining pages
+    free_count = model.db.pragma('freelist_count')
+    while free_count > start_free_count - page_count:
+        model.db.execute_sql(f'PRAGMA incremental_vacuum({free_count - start_free_count + page_count})').fetchall()
+        last_free_count = free_count
+        free_count = model.db.pragma('freelist_count')
+        # Nothing is freed without incremental vacuum
+        if free_count >= last_free_count:
+            break
+
+    return start_free_count - free_count
+
+
+def _checkpoint():
+    """Copies the WAL into the database without waiting for readers or writers."""
+
+    with model.db.connection_context():
+        model.db.execute_sql('PRAGMA wal_checkpoint(PASSIVE)')
+
+
+def get_tier_sizes() -> dict:
+    """
+    Returns estimates of the number of rows and bytes of the raw flows (in the
+    main database and in the shards), of the rollups of each bucket size and of
+    the main database as a whole; unknown values are None.
+
+    Nothing reads the tables: the rows of the raw flows are their ID range
+    (flows are deleted oldest first, so the range has few gaps), the rollups
+    are counted over the index that starts with the bucket size, and the bytes
+    come from the page counts and file sizes.
+
+    """
+    with model.db:
+        flow_row_count = _get_id_range(model.db)
+        rollup_row_count_dict = dict(
+            model.FlowRollup.select(model.FlowRollup.bucket_size, peewee.fn.COUNT(peewee.SQL('*')))
+                .group_by(model.FlowRollup.bucket_size)
+                .tuples()
+        )
+        used_page_count = model.db.pragma('page_count') - model.db.pragma('freelist_count')
+        database_bytes = used_page_count * model.db.pragma('page_size')
+
+    tier_dict = {
+        'database': {'rows': None, 'bytes': database_bytes},
+        'flow': {'rows': flow_row_count, 'bytes': None},
+    }
+
+    if flow_shard.is_enabled():
+        shard_row_count = 0
+        shard_bytes = 0
+        for day in flow_shard.list_days():
+            shard_db = flow_shard.get_shard_db(day)
+            if shard_db is None:
+                continue
+            with shard_db:
+                shard_row_count += _get_id_range(shard_db)
+            shard_path = flow_shard.get_shard_path(day)
+            for path in (shard_path, shard_path + '-wal'):
+                if os.path.exists(path):
+                    shard_bytes += os.path.getsize(path)
+        tier_dict['flow_shards'] = {'rows': shard_row_count, 'bytes': shard_bytes}
+
+    for bucket_size in flow_rollup.BUCKET_SIZE_LIST:
+        tier_dict[f'rollup_{bucket_size}'] = {'rows': rollup_row_count_dict.get(bucket_size, 0), 'bytes': None}
+
+    return tier_dict
+
+
+def _get_id_range(flow_db) -> int:
+    """Returns the number of IDs from the first to the last flow in a database."""
+
+    min_id, max_id = model.Flow.select(peewee.fn.MIN(model.Flow.id), peewee.fn.MAX(model.Flow.id)) \
+        .tuples() \
+        .execute(flow_db)[0]
+    if min_id is None:
+        return 0
+
+    return max_id - min_id + 1
@@ -0,0 +1,183 @@
+"""
+Maintains the FlowRollup table, i.e., pre-aggregated flow byte counts.
+
+Every flow adds its bytes to the upload column of its source device and to
+the download column of its destination device (if either endpoint is a
+device), in one bucket of each size in BUCKET_SIZE_LIST. Rollups are keyed by
+device and remote IP address and carry the remote hostname, registered
+domain, tracker company and country, so that the traffic graphs and data
+usage tables (analysis/traffic_rate.py) can read a few hundred rollup rows
+instead of the raw flows.
+
+"""
+import time
+from peewee import EXCLUDED, Case, Value, chunked, fn
+import core.common as common
+import core.config as config
+import core.db_writer as db_writer
+import core.model as model
+
+
+# Bucket sizes (in seconds) to maintain rollups for
+BUCKET_SIZE_LIST = [2, 60, 300, 1800]
+
+# When the rollup table is empty at startup, aggregate the flows of this many
+# past seconds into it
+BACKFILL_SECONDS = 24 * 3600
+
+# Number of rows per INSERT statement
+ROLLUP_INSERT_BATCH_SIZE = 50
+
+_REMOTE_FIELD_LIST = ['hostname', 'reg_domain', 'tracker_company', 'country']
+
+_ROLLUP_KEY = [
+    model.FlowRollup.bucket_size, model.FlowRollup.bucket_ts,
+    model.FlowRollup.device_mac_addr, model.FlowRollup.remote_ip_addr
+]
+
+
+def get_bucket_size(last_n_seconds) -> int:
+    """Returns the bucket size for a graph of the last n seconds."""
+
+    if last_n_seconds <= 60 * 10:
+        return 2
+    elif last_n_seconds <= 60 * 60:
+        return 60
+    elif last_n_seconds <= 60 * 60 * 6:
+        return 60 * 5
+    return 60 * 30
+
+
+def _get_upsert_update_dict() -> dict:
+    """
+    On conflict, adds up the byte counts and fills in the remote entity
+    information if it was still unknown.
+
+    """
+    update_dict = {
+        model.FlowRollup.upload_byte_count: model.FlowRollup.upload_byte_count + EXCLUDED.upload_byte_count,
+        model.FlowRollup.download_byte_count: model.FlowRollup.download_byte_count + EXCLUDED.download_byte_count,
+    }
+    for field in _REMOTE_FIELD_LIST:
+        col = getattr(model.FlowRollup, f'remote_{field}')
+        update_dict[col] = Case(None, [(col == '', getattr(EXCLUDED, f'remote_{field}'))], col)
+
+    return update_dict
+
+
+def update(flow_row_list):
+    """
+    Adds the bytes of new Flow rows (dicts of column values) to the rollups;
+    runs on the DB writer.
+
+    """
+    # Maps (bucket_size, bucket_ts, device_mac_addr, remote_ip_addr) -> rollup row
+    rollup_dict = {}
+
+    for flow_row in flow_row_list:
+        end_ts = int(flow_row['end_ts'])
+        for device_prefix, remote_prefix, byte_col in (
+            ('src', 'dst', 'upload_byte_count'),
+            ('dst', 'src', 'download_byte_count')
+        ):
+            device_mac_addr = flow_row[f'{device_prefix}_device_mac_addr']
+            if not device_mac_addr:
+                continue
+            remote_ip_addr = flow_row[f'{remote_prefix}_ip_addr']
+            for bucket_size in BUCKET_SIZE_LIST:
+                key = (bucket_size, end_ts - end_ts % bucket_size, device_mac_addr, remote_ip_addr)
+                rollup_row = rollup_dict.get(key)
+                if rollup_row is None:
+                    rollup_row = dict(
+                        bucket_size=key[0],
+                        bucket_ts=key[1],
+                        device_mac_addr=device_mac_addr,
+                        remote_ip_addr=remote_ip_addr,
+                        upload_byte_count=0,
+                        download_byte_count=0
+                    )
+                    rollup_dict[key] = rollup_row
+                rollup_row[byte_col] += flow_row['byte_count']
+                for field in _REMOTE_FIELD_LIST:
+                    if not rollup_row.get(f'remote_{field}'):
+                        rollup_row[f'remote_{field}'] = flow_row.get(f'{remote_prefix}_{field}', '')
+
+    update_dict = _get_upsert_update_dict()
+    for rollup_row_batch in chunked(rollup_dict.values(), ROLLUP_INSERT_BATCH_SIZE):
+        model.FlowRollup.insert_many(rollup_row_batch).on_conflict(
+            conflict_target=_ROLLUP_KEY,
+            update=update_dict
+        ).execute()
+
+
+def add_hostname_info(remote_ip_addr, hostname, reg_domain, tracker_company):
+    """
+    Fills in the hostname information of the rollups of a remote IP address
+    that had none; runs on the DB writer.
+
+    """
+    return model.FlowRollup.update(
+        remote_hostname=hostname,
+        remote_reg_domain=reg_domain,
+        remote_tracker_company=tracker_company
+    ).where(
+        (model.FlowRollup.remote_ip_addr == remote_ip_addr) &
+        (model.FlowRollup.remote_hostname == '')
+    ).execute()
+
+
+def backfill(since_ts):
+    """Aggregates the flows that ended after `since_ts` into the rollups; runs on the DB writer."""
+
+    end_ts = model.Flow.end_ts.cast('INTEGER')
+    update_dict = _get_upsert_update_dict()
+
+    for bucket_size in BUCKET_SIZE_LIST:
+        # Integer division, as peewee's % operator means LIKE
+        bucket_ts = end_ts / bucket_size * bucket_size
+        for device_prefix, remote_prefix, upload in (('src', 'dst', True), ('dst', 'src', False)):
+            device_mac_col = getattr(model.Flow, f'{device_prefix}_device_mac_addr')
+            remote_ip_col = getattr(model.Flow, f'{remote_prefix}_ip_addr')
+            byte_sum = fn.SUM(model.Flow.byte_count)
+            query = model.Flow.select(
+                Value(bucket_size),
+                bucket_ts,
+                device_mac_col,
+                remote_ip_col,
+                *[fn.MAX(getattr(model.Flow, f'{remote_prefix}_{field}')) for field in _REMOTE_FIELD_LIST],
+                byte_sum if upload else Value(0),
+                Value(0) if upload else byte_sum
+            ).where(
+                (model.Flow.end_ts > since_ts) & (device_mac_col != '')
+            ).group_by(
+                bucket_ts, device_mac_col, remote_ip_col
+            )
+            model.FlowRollup.insert_from(query, [
+                model.FlowRollup.bucket_size,
+                model.FlowRollup.bucket_ts,
+                model.FlowRollup.device_mac_addr,
+                model.FlowRollup.remote_ip_addr,
+                *[getattr(model.FlowRollup, f'remote_{field}') for field in _REMOTE_FIELD_LIST],
+                model.FlowRollup.upload_byte_count,
+                model.FlowRollup.download_byte_count
+            ]).on_conflict(
+                conflict_target=_ROLLUP_KEY,
+                update=update_dict
+            ).execute()
+
+
+def initialize():
+    """Fills the rollup table from recent flows if it is empty."""
+
+    with model.db:
+        if model.FlowRollup.select().exists():
+            return
+
+    since_ts = time.time() - BACKFILL_SECONDS
+    db_writer.execute(backfill, since_ts)
+
+    # Flows that ended before this time are not in the rollups; see
+    # core/flow_retention.py
+    config.set('flow_rollup_start_ts', since_ts)
+
+    common.log('[Flow Rollup] Backfilled rollups from the last {} seconds of flows'.format(BACKFILL_SECONDS))
@@ -0,0 +1,256 @@
+"""
+Optional storage of flows in one SQLite file per day.
+
+If FLOW_SHARDS_ENABLED is set, the flow writer stores each flow in the shard
+of the (UTC) day its `end_ts` falls in, under FLOW_SHARD_DIRECTORY, instead of
+the Flow table of the main database; the rollups stay in the main database.
+Range queries then only read the shards that overlap their time window, and
+expiring a day of flows deletes its file (see core/flow_retention.py).
+
+Each shard is a separate database with the schema of model.Flow, opened on
+demand. Queries built with model.Flow run on a shard by passing its database
+to `execute()`:
+
+for flow_db in flow_shard.get_flow_databases(start_ts, end_ts):
+    with flow_db:
+        for flow in model.Flow.select().where(...).execute(flow_db):
+            ...
+
+`get_flow_databases()` also returns the main database, which holds the flows
+written before shards were enabled, until the retention policy removes them.
+
+Deleting a shard closes the connections of every thread to it. A deleted
+shard is not recreated: readers never create shard files, and flows of days
+before the last retention cutoff are dropped instead of being written.
+
+"""
+import datetime
+import glob
+import os
+import pathlib
+import threading
+import peewee
+import core.common as common
+import core.model as model
+
+
+# Set to True to store flows in daily shard files
+FLOW_SHARDS_ENABLED = False
+
+FLOW_SHARD_DIRECTORY = os.path.join(common.get_project_directory(), 'flow_shards')
+
+FLOW_SHARD_FILE_PREFIX = 'flow-'
+FLOW_SHARD_FILE_SUFFIX = '.sqlite3'
+
+_lock = threading.Lock()
+
+# Maps day (YYYYMMDD) -> ShardDatabase of the shard
+_shard_db_dict = {}
+
+# Days before this one (YYYYMMDD) have been deleted; '' if none
+_deleted_before_day = ['']
+
+
+class ShardDatabase(peewee.SqliteDatabase):
+    """
+    The database of a shard. Keeps track of the connections of all threads,
+    so that `close_all()` can close them before the file is deleted, and
+    never creates the file.
+
+    """
+    def __init__(self, shard_path, **kwargs):
+
+        uri = pathlib.Path(shard_path).absolute().as_uri() + '?mode=rw'
+        super().__init__(uri, uri=True, check_same_thread=False, **kwargs)
+        self._conn_lock = threading.Lock()
+        self._conn_set = set()
+
+    def _connect(self):
+
+        conn = super()._connect()
+        with self._conn_lock:
+            self._conn_set.add(conn)
+        return conn
+
+    def _close(self, conn):
+
+        with self._conn_lock:
+            self._conn_set.discard(conn)
+        super()._close(conn)
+
+    def close_all(self):
+        """Closes the connections of all threads."""
+
+        with self._conn_lock:
+            conn_list = list(self._conn_set)
+            self._conn_set.clear()
+
+        for conn in conn_list:
+            conn.close()
+
+
+def is_enabled() -> bool:
+    """Returns True if flows are stored in daily shards."""
+
+    return FLOW_SHARDS_ENABLED
+
+
+def get_day(ts) -> str:
+    """Returns the shard day (YYYYMMDD, in UTC) of a timestamp."""
+
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime('%Y%m%d')
+
+
+def get_shard_path(day) -> str:
+
+    return os.path.join(FLOW_SHARD_DIRECTORY, FLOW_SHARD_FILE_PREFIX + day + FLOW_SHARD_FILE_SUFFIX)
+
+
+def list_days() -> list:
+    """Returns the days of the existing shards, oldest first."""
+
+    day_list = []
+    for shard_path in glob.glob(get_shard_path('*')):
+        day = os.path.basename(shard_path)[len(FLOW_SHARD_FILE_PREFIX):-len(FLOW_SHARD_FILE_SUFFIX)]
+        if len(day) == 8 and day.isdigit():
+            day_list.append(day)
+
+    return sorted(day_list)
+
+
+def get_shard_db(day, create=False):
+    """
+    Returns the database of a shard day; returns None if the shard does not
+    exist, unless `create` is set and the day has not been deleted.
+
+    """
+    with _lock:
+        shard_db = _shard_db_dict.get(day)
+        if shard_db is not None:
+            return shard_db
+
+        shard_path = get_shard_path(day)
+        if not os.path.exists(shard_path):
+            if not create or day < _deleted_before_day[0]:
+                return None
+            os.makedirs(FLOW_SHARD_DIRECTORY, exist_ok=True)
+            # An empty file is an empty SQLite database
+            open(shard_path, 'ab').close()
+
+        shard_db = ShardDatabase(
+            shard_path,
+            pragmas={'journal_mode': 'wal'}
+        )
+
+        # Create the Flow table and its indexes in the shard
+        with shard_db:
+            for query in [model.Flow._schema._create_table(safe=True)] + model.Flow._schema._create_indexes(safe=True):
+                shard_db.execute(query)
+
+        _shard_db_dict[day] = shard_db
+
+    return shard_db
+
+
+def get_flow_databases(start_ts=None, end_ts=None) -> list:
+    """
+    Returns the databases that may hold flows whose end_ts is between start_ts
+    and end_ts (inclusive; either may be None for an open range).
+
+    """
+    if not is_enabled():
+        return [model.db]
+
+    start_day = get_day(start_ts) if start_ts is not None else None
+    end_day = get_day(end_ts) if end_ts is not None else None
+
+    flow_db_list = [model.db]
+    for day in list_days():
+        if start_day is not None and day < start_day:
+            continue
+        if end_day is not None and day > end_day:
+            continue
+        shard_db = get_shard_db(day)
+        if shard_db is not None:
+            flow_db_list.append(shard_db)
+
+    return flow_db_list
+
+
+def get_day_row_dict(flow_row_list) -> dict:
+    """Returns a dict that maps each shard day to its Flow rows."""
+
+    day_row_dict = {}
+    for flow_row in flow_row_list:
+        day_row_dict.setdefault(get_day(flow_row['end_ts']), []).append(flow_row)
+
+    return day_row_dict
+
+
+def insert_day_rows(day, day_row_list, batch_size):
+    """
+    Inserts the Flow rows of a day into its shard in one transaction,
+    `batch_size` rows per INSERT; drops them if the day has been deleted.
+
+    """
+    shard_db = get_shard_db(day, create=True)
+    if shard_db is None:
+        common.log(f'[Flow Shard] Dropped {len(day_row_list)} flows of {day}, which has been deleted')
+        return
+
+    with shard_db:
+        for flow_row_batch in peewee.chunked(day_row_list, batch_size):
+            model.Flow.insert_many(flow_row_batch).execute(shard_db)
+
+
+def insert_flow_rows(flow_row_list, batch_size):
+    """Inserts Flow rows into the shards of their days, `batch_size` rows per INSERT."""
+
+    for day, day_row_list in get_day_row_dict(flow_row_list).items():
+        insert_day_rows(day, day_row_list, batch_size)
+
+
+def delete_shards_before(cutoff_ts) -> int:
+    """Deletes the shards of the days that ended before `cutoff_ts`; returns the number of shards deleted."""
+
+    cutoff_day = get_day(cutoff_ts)
+    deleted_count = 0
+
+    with _lock:
+        _deleted_before_day[0] = max(_deleted_before_day[0], cutoff_day)
+
+    for day in list_days():
+        if day >= cutoff_day:
+            break
+        _delete_shard(day)
+        deleted_count += 1
+
+    return deleted_count
+
+
+def delete_all_shards() -> int:
+    """Deletes every shard, e.g., when the local data is reset; returns the number of shards deleted."""
+
+    day_list = list_days()
+    for day in day_list:
+        _delete_shard(day)
+
+    return len(day_list)
+
+
+def _delete_shard(day):
+    """Closes the connections to a shard and deletes its files."""
+
+    with _lock:
+        shard_db = _shard_db_dict.pop(day, None)
+    if shard_db is not None:
+        shard_db.close_all()
+
+    shard_path = get_shard_path(day)
+    for path in (shard_path, shard_path + '-wal', shard_path + '-shm'):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    common.log(f'[Flow Shard] Deleted the flows of {day}')
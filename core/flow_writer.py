@@ -0,0 +1,227 @@
+"""
+Writes flow statistics to the database in a dedicated thread.
+
+The packet processor counts packets into `packet_processor.flow_dict`. Every
+FLOW_WRITE_INTERVAL seconds it swaps in a fresh dict and hands the previous
+one to this module through a bounded queue, so that slow database writes no
+longer pause packet processing. If the writer has fallen FLOW_WRITER_QUEUE_SIZE
+dicts behind, the handoff is skipped and the packet processor keeps counting
+into its current dict until the next interval.
+
+"""
+import queue
+import threading
+import time
+from peewee import chunked
+import core.common as common
+import core.db_writer as db_writer
+import core.flow_rollup as flow_rollup
+import core.flow_shard as flow_shard
+import core.friendly_organizer as friendly_organizer
+import core.global_state as global_state
+import core.model as model
+
+
+# Maximum number of flow dicts waiting to be written
+FLOW_WRITER_QUEUE_SIZE = 4
+
+# Number of flows per INSERT statement; each flow row has 19 columns, and
+# SQLite limits the number of variables per statement (999 in older versions)
+FLOW_INSERT_BATCH_SIZE = 50
+
+# How many times to try writing a flow dict before giving up on it
+FLOW_WRITE_ATTEMPTS = 3
+
+_handoff_queue = queue.Queue(maxsize=FLOW_WRITER_QUEUE_SIZE)
+_handoff_lock = threading.Lock()
+_is_running = [False]
+
+_stat_lock = threading.Lock()
+_stat_dict = {
+    'write_count': 0,
+    'written_flows': 0,
+    'failed_flows': 0,
+    'skipped_handoffs': 0,
+    'max_backlog': 0,
+    'last_write_latency': 0.0,
+    'max_write_latency': 0.0,
+    'total_write_latency': 0.0
+}
+
+
+def start():
+    """Starts the flow writer thread."""
+
+    _is_running[0] = True
+    common.SafeLoopThread(write_next_flows, sleep_time=0)
+
+
+def is_running() -> bool:
+    return _is_running[0]
+
+
+def submit(swap_flow_dict_func) -> bool:
+    """
+    Calls `swap_flow_dict_func()` and queues the flow dict it returns for
+    writing, provided the queue has room; otherwise leaves the flows where
+    they are.
+
+    Returns True if the flows were handed off.
+
+    """
+    with _handoff_lock:
+        if _handoff_queue.full():
+            with _stat_lock:
+                _stat_dict['skipped_handoffs'] += 1
+            return False
+        _handoff_queue.put_nowait(swap_flow_dict_func())
+        backlog = _handoff_queue.qsize()
+
+    with _stat_lock:
+        _stat_dict['max_backlog'] = max(_stat_dict['max_backlog'], backlog)
+
+    return True
+
+
+def write_next_flows():
+    """Waits for the next flow dict and writes it to the database."""
+
+    pending_flow_dict = _handoff_queue.get()
+
+    try:
+        write_flows_to_db(pending_flow_dict, FLOW_WRITE_ATTEMPTS)
+    except Exception:
+        with _stat_lock:
+            _stat_dict['failed_flows'] += len(pending_flow_dict)
+
+
+def write_flows_to_db(pending_flow_dict, attempts=1):
+    """
+    Writes the flows of a flow dict into the Flow table, trying each step up
+    to `attempts` times.
+
+    """
+
+    start_ts = time.time()
+
+    # Look up the country, hostname etc. of each flow before handing the rows to
+    # the DB writer
+    flow_row_list = [
+        get_flow_row(flow_key, flow_stat_dict)
+        for flow_key, flow_stat_dict in pending_flow_dict.items()
+    ]
+
+    if flow_shard.is_enabled():
+        # The shards are only written by this thread; the rollups are in the
+        # main database. Each day and the rollups are committed separately, so
+        # each is retried on its own, lest a retry insert the same flows twice.
+        for day, day_row_list in flow_shard.get_day_row_dict(flow_row_list).items():
+            _call_with_retries(attempts, f'writing {len(day_row_list)} flows to the shard of {day}',
+                               flow_shard.insert_day_rows, day, day_row_list, FLOW_INSERT_BATCH_SIZE)
+        _call_with_retries(attempts, f'updating the rollups with {len(flow_row_list)} flows',
+                           db_writer.execute, flow_rollup.update, flow_row_list)
+    else:
+        _call_with_retries(attempts, f'writing {len(flow_row_list)} flows',
+                           db_writer.execute, insert_flow_rows, flow_row_list)
+
+    latency = time.time() - start_ts
+    with _stat_lock:
+        _stat_dict['write_count'] += 1
+        _stat_dict['written_flows'] += len(flow_row_list)
+        _stat_dict['last_write_latency'] = latency
+        _stat_dict['max_write_latency'] = max(_stat_dict['max_write_latency'], latency)
+        _stat_dict['total_write_latency'] += latency
+
+    queue_stat_dict = global_state.packet_queue.get_stats()
+    common.log('[Flow Writer] Wrote {} flows to database in {:.3f} seconds; flow writer backlog: {}. Pending packet_queue size: {} (max depth {}); dropped packets: {} oldest, {} newest, {} sampled out'.format(
+        len(flow_row_list), latency, _handoff_queue.qsize(), queue_stat_dict['depth'], queue_stat_dict['max_depth'],
+        queue_stat_dict['drop_oldest'], queue_stat_dict['drop_newest'], queue_stat_dict['sampled_out']
+    ))
+
+
+def _call_with_retries(attempts, description, func, *args):
+    """Calls `func(*args)` up to `attempts` times until it succeeds; raises the last exception."""
+
+    for attempt in range(attempts):
+        try:
+            return func(*args)
+        except Exception as e:
+            common.log(f'[Flow Writer] Error {description} (attempt {attempt + 1}): {e}')
+            if attempt + 1 >= attempts:
+                raise
+            time.sleep(1)
+
+
+def insert_flow_rows(flow_row_list):
+    """Inserts rows into the Flow table and updates the rollups; runs on the DB writer."""
+
+    for flow_row_batch in chunked(flow_row_list, FLOW_INSERT_BATCH_SIZE):
+        model.Flow.insert_many(flow_row_batch).execute()
+
+    flow_rollup.update(flow_row_list)
+
+
+def get_flow_row(flow_key, flow_stat_dict) -> dict:
+    """Returns the Flow table row for a flow in the flow_dict."""
+
+    # Unpack the flow key
+    src_mac_addr, dst_mac_addr, src_ip_addr, dst_ip_addr, src_port, dst_port, protocol = flow_key
+
+    # Find the country in both directions
+    src_country = ''
+    dst_country = ''
+    if src_mac_addr == '' and src_ip_addr != '':
+        src_country = friendly_organizer.get_country_from_ip_addr(src_ip_addr)
+    if dst_mac_addr == '' and dst_ip_addr != '':
+        dst_country = friendly_organizer.get_country_from_ip_addr(dst_ip_addr)
+
+    # Fill in the hostname information
+    src_hostname = friendly_organizer.get_hostname_from_ip_addr(src_ip_addr, in_memory_only=True, ts=flow_stat_dict['start_ts'])
+    dst_hostname = friendly_organizer.get_hostname_from_ip_addr(dst_ip_addr, in_memory_only=True, ts=flow_stat_dict['start_ts'])
+
+    # Fill out the registered domain info and tracker company info per hostname
+    src_reg_domain = ''
+    dst_reg_domain = ''
+    src_tracker_company = ''
+    dst_tracker_company = ''
+    if src_hostname:
+        src_reg_domain = friendly_organizer.get_reg_domain(src_hostname)
+        src_tracker_company = friendly_organizer.get_tracker_company(src_hostname)
+    if dst_hostname:
+        dst_reg_domain = friendly_organizer.get_reg_domain(dst_hostname)
+        dst_tracker_company = friendly_organizer.get_tracker_company(dst_hostname)
+
+    return dict(
+        start_ts=flow_stat_dict['start_ts'],
+        end_ts=flow_stat_dict['end_ts'],
+        src_device_mac_addr=src_mac_addr,
+        dst_device_mac_addr=dst_mac_addr,
+        src_port=src_port,
+        dst_port=dst_port,
+        src_ip_addr=src_ip_addr,
+        dst_ip_addr=dst_ip_addr,
+        src_country=src_country,
+        dst_country=dst_country,
+        src_hostname=src_hostname,
+        dst_hostname=dst_hostname,
+        src_reg_domain=src_reg_domain,
+        dst_reg_domain=dst_reg_domain,
+        src_tracker_company=src_tracker_company,
+        dst_tracker_company=dst_tracker_company,
+        protocol=protocol,
+        byte_count=flow_stat_dict['byte_count'],
+        packet_count=flow_stat_dict['pkt_count']
+    )
+
+
+def get_stats() -> dict:
+    """Returns the write latency (in seconds) and backlog of the flow writer."""
+
+    with _stat_lock:
+        stat_dict = dict(_stat_dict)
+
+    stat_dict['backlog'] = _handoff_queue.qsize()
+    stat_dict['mean_write_latency'] = \
+        stat_dict['total_write_latency'] / stat_dict['write_count'] if stat_dict['write_count'] else 0.0
+
+    return stat_dict
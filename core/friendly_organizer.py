@@ -6,16 +6,22 @@ import core.model as model
 import core.common as common
 import core.global_state as global_state
 import core.networking as networking
+import core.ip_classifier as ip_classifier
+import core.db_writer as db_writer
+import core.flow_rollup as flow_rollup
+import core.flow_shard as flow_shard
 import core.config as config
 import core.anonymization as anonymization
+import core.tracker_trie as tracker_trie
+import core.hostname_resolver as hostname_resolver
+import core.ptr_resolver as ptr_resolver
 from core.oui_parser import get_vendor
 from core.ttl_cache import ttl_cache
 import os
+import concurrent.futures
 import geoip2.database
 import functools
 import tldextract
-import json
-import ipaddress
 
 
 ip_country_parser = geoip2.database.Reader(
@@ -28,7 +34,14 @@ tracker_directory = os.path.join(
     common.get_python_code_directory(), '..', 'data'
 )
 
+# Snapshot of global_state.hostname_store, so that restarts do not begin with an empty store
+HOSTNAME_STORE_PATH = os.path.join(common.get_project_directory(), 'hostname_store.json')
+
+# How often to snapshot the hostname store (in seconds)
+HOSTNAME_STORE_SAVE_INTERVAL = 60
+
 # Source: https://github.com/duckduckgo/tracker-blocklists/tree/main
+# The lists may be outdated -- TODO: Update these lists in future versions
 tracker_json_list = [
     os.path.join(tracker_directory, 'tds.json'),
     os.path.join(tracker_directory, 'apple-tds.json'),
@@ -63,14 +76,16 @@ def add_product_info_to_devices():
         inferred_product_name_dict[mac_addr] = ' / '.join(friendly_names)
 
     # Update the database with the inferred product names into the `friendly_product` field
-    with model.write_lock:
-        with model.db:
-            for mac_addr, product_name in inferred_product_name_dict.items():
-                row_count = model.Device.update(
-                    friendly_product=product_name
-                ).where(model.Device.mac_addr == mac_addr
-                ).execute()
-                updated_row_count += row_count
+    def _update_product_names():
+        row_count = 0
+        for mac_addr, product_name in inferred_product_name_dict.items():
+            row_count += model.Device.update(
+                friendly_product=product_name
+            ).where(model.Device.mac_addr == mac_addr
+            ).execute()
+        return row_count
+
+    updated_row_count += db_writer.execute(_update_product_names)
 
     common.log(f'[Friendly Organizer] Updated {updated_row_count} rows of product info.')
 
@@ -104,134 +119,237 @@ def infer_product_name(device_mac_addr: str) -> str:
 
 
 
-@ttl_cache(maxsize=8192, ttl=15)
-def get_hostname_from_ip_addr(ip_addr: str, in_memory_only=False) -> str:
+def get_hostname_from_ip_addr(ip_addr: str, in_memory_only=False, ts=None) -> str:
     """
-    Returns the hostname associated with an IP address.
+    Returns the hostname associated with an IP address at time `ts` (now if
+    None).
 
     Returns an empty string if the hostname is not found.
 
     """
+    hostname = get_special_hostname(ip_addr)
+    if hostname:
+        return hostname
+
+    # Ask the in-memory store
+    hostname = global_state.hostname_store.get(ip_addr, ts)
+    if hostname or in_memory_only:
+        return hostname
+
+    return get_hostname_from_db(ip_addr)
+
+
+
+@functools.lru_cache(maxsize=8192)
+def get_special_hostname(ip_addr: str) -> str:
+    """Returns '(local network)' or '(multicast)' for such IP addresses; otherwise an empty string."""
+
     if networking.is_private_ip_addr(ip_addr):
         return '(local network)'
 
     # Note: Jakaria added code block for multicast ip checking
     # Note: consult Danny
-    if ipaddress.ip_address(ip_addr).is_multicast:
+    if ip_classifier.is_multicast(ip_addr):
         return '(multicast)'
 
-    # Ask the in-memory cache
-    try:
-        with global_state.global_state_lock:
-            return global_state.hostname_dict[ip_addr]
-    except KeyError:
-        pass
+    return ''
 
-    if in_memory_only:
-        return ''
 
-    # Ask the database
+
+@ttl_cache(maxsize=8192, ttl=15)
+def get_hostname_from_db(ip_addr: str) -> str:
+    """
+    Returns a hostname of an IP address from the Hostname table and saves it in
+    the in-memory store; returns an empty string if there is none.
+
+    The NYU server and reverse DNS are asked in the background by
+    add_hostname_info_to_flows().
+
+    """
     try:
         with model.db:
             hostname = model.Hostname.get(model.Hostname.ip_addr == ip_addr).hostname
-            if hostname:
-                # Save the hostname value in memory
-                with global_state.global_state_lock:
-                    global_state.hostname_dict[ip_addr] = hostname
-                return hostname
     except model.Hostname.DoesNotExist:
-        pass
+        return ''
 
-    # Ask NYU server, but first we make sure that we're donating data
+    # The table does not record when the hostname was seen, so it applies
+    # from the start unless the store has learned of the IP address since
+    if hostname:
+        global_state.hostname_store.add(ip_addr, hostname, 'db', ts=0, only_if_missing=True)
+
+    return hostname
+
+
+
+def save_hostname_store():
+    """Snapshots the in-memory hostname store to disk."""
+
+    global_state.hostname_store.save(HOSTNAME_STORE_PATH)
+
+
+
+def clear_hostname_store():
+    """Empties the in-memory hostname store and deletes its snapshot."""
+
+    global_state.hostname_store.clear()
+    if os.path.exists(HOSTNAME_STORE_PATH):
+        os.remove(HOSTNAME_STORE_PATH)
+
+
+
+def load_hostname_store():
+    """Restores the in-memory hostname store from its last snapshot."""
+
+    try:
+        ip_addr_count = global_state.hostname_store.load(HOSTNAME_STORE_PATH)
+    except (OSError, ValueError, TypeError, KeyError) as e:
+        common.log(f'[Friendly Organizer] Unable to load the hostname store: {e}')
+        return
+
+    common.log(f'[Friendly Organizer] Loaded the hostnames of {ip_addr_count} IP addresses.')
+
+
+
+def get_ip_insights_url_prefix() -> str:
+    """
+    Returns the URL prefix for asking the NYU server about IP addresses, or an
+    empty string if we are not donating data or the user_key is not set.
+
+    """
     if config.get('donation_start_ts', 0) == 0:
         return ''
 
-    # Also we make sure that the user_key has been set
     user_key = config.get('user_key', '')
     if not user_key:
         return ''
 
-    # Send an HTTP GET request to the NYU server and ask
-    url = global_state.IP_INSIGHTS_URL + f'/{user_key}/{ip_addr}'
-    hostname = ''
-    try:
-        hostname = common.http_request(
-            method='get',
-            field_to_extract='hostname',
-            args=[url],
-            kwargs=dict(timeout=10)
-        )
-    except IOError:
-        pass
+    return global_state.IP_INSIGHTS_URL + f'/{user_key}'
 
-    if not hostname:
-        return ''
 
-    # Remove trailing dots
-    if hostname.endswith('.'):
-        hostname = hostname[:-1]
 
-    # Add question mark to denoate uncertainty only if the hostname is not parenthesized
-    if '(' not in hostname and '?' not in hostname:
-        hostname += '?'
+def add_hostname_info_to_flows():
+    """
+    Adds hostname, reg_domain, and tracker_company to flows retroactively.
 
-    # Save the hostname value in memory
-    with global_state.global_state_lock:
-        global_state.hostname_dict[ip_addr] = hostname
+    IP addresses without a hostname in memory or in the database are passed to
+    the hostname resolver and the PTR resolver, which add the hostnames they
+    find to the flows.
 
-    return hostname
+    """
+    updated_row_count = 0
 
+    # Futures of the number of updated rows
+    row_count_future_list = []
 
+    unresolved_ip_addr_set = set()
 
-def add_hostname_info_to_flows():
+    for flow_db in flow_shard.get_flow_databases():
+
+        for direction in ['src', 'dst']:
+
+            ip_addr_col = getattr(model.Flow, f'{direction}_ip_addr')
+            hostname_col = getattr(model.Flow, f'{direction}_hostname')
+            mac_addr_col = getattr(model.Flow, f'{direction}_device_mac_addr')
+
+            ip_addr_list = list()
+
+            # Find all distinct IP addresses for which the hostname field is empty
+
+            with flow_db:
+                q = model.Flow.select(ip_addr_col) \
+                    .group_by(ip_addr_col) \
+                    .where((ip_addr_col != '') & (hostname_col == '') & (mac_addr_col == ''))
+                ip_addr_list = [getattr(flow, f'{direction}_ip_addr') for flow in q.execute(flow_db)]
+
+            # For each IP address, find the corresponding hostname and update the
+            # reg_domain and tracker_company fields
+
+            for ip_addr in ip_addr_list:
+                hostname = get_hostname_from_ip_addr(ip_addr)
+                if not hostname:
+                    unresolved_ip_addr_set.add(ip_addr)
+                    continue
+                row_count_future_list.append(
+                    _update_flow_hostname(flow_db, direction, ip_addr, hostname)
+                )
+
+    updated_row_count += sum(future.result() for future in row_count_future_list)
+
+    # Ask the NYU server and reverse DNS about the rest in the background
+    queued_count = 0
+    ptr_queued_count = 0
+    if unresolved_ip_addr_set:
+        unresolved_ip_addr_list = sorted(unresolved_ip_addr_set)
+        url_prefix = get_ip_insights_url_prefix()
+        # Reverse DNS is only a fallback, as its hostnames are less useful
+        if url_prefix:
+            queued_count = hostname_resolver.submit(
+                unresolved_ip_addr_list, url_prefix, add_resolved_hostname_to_flows, submit_to_ptr_resolver
+            )
+        else:
+            ptr_queued_count = ptr_resolver.submit(unresolved_ip_addr_list, add_resolved_hostname_to_flows)
+
+    common.log(
+        f'[Friendly Organizer] Updated {updated_row_count} rows of hostname info; '
+        f'{queued_count} IP addresses queued for resolution, {ptr_queued_count} for reverse DNS.'
+    )
+
+
+
+def submit_to_ptr_resolver(ip_addr: str):
+    """Queues a reverse DNS lookup of an IP address the NYU server has no hostname for."""
+
+    ptr_resolver.submit([ip_addr], add_resolved_hostname_to_flows)
+
+
+
+def add_resolved_hostname_to_flows(ip_addr: str, hostname: str):
     """
-    Adds hostname, reg_domain, and tracker_company to flows retroactively.
+    Adds the hostname of an IP address to its flows without waiting for the
+    writes; called by the hostname and PTR resolvers.
 
     """
-    updated_row_count = 0
+    for flow_db in flow_shard.get_flow_databases():
+        for direction in ['src', 'dst']:
+            _update_flow_hostname(flow_db, direction, ip_addr, hostname)
 
-    for direction in ['src', 'dst']:
 
-        ip_addr_col = getattr(model.Flow, f'{direction}_ip_addr')
-        hostname_col = getattr(model.Flow, f'{direction}_hostname')
-        mac_addr_col = getattr(model.Flow, f'{direction}_device_mac_addr')
 
-        ip_addr_list = list()
+def _update_flow_hostname(flow_db, direction, ip_addr, hostname) -> concurrent.futures.Future:
+    """
+    Adds hostname, reg_domain, and tracker_company to the flows of an IP
+    address in one direction. Returns a Future of the number of updated rows.
 
-        # Find all distinct IP addresses for which the hostname field is empty
+    """
+    ip_addr_col = getattr(model.Flow, f'{direction}_ip_addr')
+    hostname_col = getattr(model.Flow, f'{direction}_hostname')
+    mac_addr_col = getattr(model.Flow, f'{direction}_device_mac_addr')
+
+    reg_domain = get_reg_domain(hostname)
+    tracker_company = get_tracker_company(reg_domain)
+    update_query = model.Flow.update(
+        **{
+            f'{direction}_hostname': hostname,
+            f'{direction}_reg_domain': reg_domain,
+            f'{direction}_tracker_company': tracker_company
+        }
+    ).where(
+        (ip_addr_col == ip_addr) &
+        (hostname_col == '') &
+        (mac_addr_col == '')
+    )
 
-        with model.db:
-            q = model.Flow.select(ip_addr_col) \
-                .group_by(ip_addr_col) \
-                .where((ip_addr_col != '') & (hostname_col == '') & (mac_addr_col == ''))
-            ip_addr_list = [getattr(flow, f'{direction}_ip_addr') for flow in q]
-
-        # For each IP address, find the corresponding hostname and update the
-        # reg_domain and tracker_company fields
-
-        for ip_addr in ip_addr_list:
-            # Find the hostname from various sources; could be a slow operation
-            hostname = get_hostname_from_ip_addr(ip_addr)
-            if not hostname:
-                continue
-            reg_domain = get_reg_domain(hostname)
-            tracker_company = get_tracker_company(reg_domain)
-            with model.write_lock:
-                with model.db:
-                    row_count = model.Flow.update(
-                        **{
-                            f'{direction}_hostname': hostname,
-                            f'{direction}_reg_domain': reg_domain,
-                            f'{direction}_tracker_company': tracker_company
-                        }
-                    ).where(
-                        (ip_addr_col == ip_addr) &
-                        (hostname_col == '') &
-                        (mac_addr_col == '')
-                    ).execute()
-                    updated_row_count += row_count
-
-    common.log(f'[Friendly Organizer] Updated {updated_row_count} rows of hostname info.')
+    db_writer.submit(flow_rollup.add_hostname_info, ip_addr, hostname, reg_domain, tracker_company)
+
+    if flow_db is model.db:
+        return db_writer.submit(update_query.execute)
+
+    # Flow shards are written directly rather than through the DB writer
+    row_count_future = concurrent.futures.Future()
+    with flow_db:
+        row_count_future.set_result(update_query.execute(flow_db))
+
+    return row_count_future
 
 
 @functools.lru_cache(maxsize=8192)
@@ -265,53 +383,27 @@ def parse_tracking_json(json_contents):
 
 
 @functools.lru_cache(maxsize=1)
-def initialize_ad_tracking_db():
-    """
-    Initializes the AdTracker table with the default list of trackers. Ran only once at startup.
-
-    """
+def get_tracker_trie():
+    """Returns the memory-mapped suffix trie of the tracker lists; see core/tracker_trie.py."""
 
-    # If the AdTracker table is empty, initialize it with the default list
-    with model.db:
-
-        if model.AdTracker.select().count() > 0:
-            return
-
-        block_list_dict = dict()
-
-        # Load trackers from file; may be outdated -- TODO: Update these lists
-        # in future versions
-        for tracker_json_file in tracker_json_list:
-            with open(tracker_json_file, 'r') as f:
-                block_list_dict.update(parse_tracking_json(json.load(f)))
-
-        # Add trackers to database
-        for hostname, tracker_company in block_list_dict.items():
-            model.AdTracker.create(
-                hostname=hostname,
-                tracker_company=tracker_company
-            )
+    return tracker_trie.load(tracker_json_list, parse_tracking_json)
 
 
 @functools.lru_cache(maxsize=8192)
 def get_tracker_company(hostname: str) -> str:
     """
-    Returns the tracker company for a given hostname; if not a tracking company, returns an empty string
+    Returns the tracker company for a given hostname or any of its parent
+    domains; if not a tracking company, returns an empty string
 
     """
-    initialize_ad_tracking_db()
-
     uncertain = '?' in hostname
     hostname = hostname.replace('?', '')
 
-    try:
-        company =  model.AdTracker.get(model.AdTracker.hostname == hostname).tracker_company
-    except model.AdTracker.DoesNotExist:
-        return ''
-    else:
-        if uncertain:
-            company += '?'
-        return company
+    company = get_tracker_trie().lookup(hostname)
+    if company and uncertain:
+        company += '?'
+
+    return company
 
 
 @functools.lru_cache(maxsize=8192)
@@ -5,6 +5,8 @@ Maintains the global state in a singleton design pattern.
 import threading
 import queue
 import os
+from core.packet_queue import BoundedPacketQueue
+from core.hostname_store import HostnameStore
 
 
 DEBUG = False
@@ -44,11 +46,28 @@ arp_cache = None
 inspector_started = [False]
 inspector_started_ts = 0
 
-# A queue that holds packets to be processed
-packet_queue = queue.Queue()
-
-# A dictionary that maps IP addresses to hostnames
-hostname_dict = dict()
+# A queue that holds packets to be processed. Bounded so that memory does not
+# grow without limit when the packet processor falls behind; see
+# core/packet_queue.py for the available overload policies.
+PACKET_QUEUE_MAX_SIZE = 100000
+PACKET_QUEUE_POLICY = 'drop_oldest'
+PACKET_QUEUE_HIGH_WATER_MARK = 80000
+PACKET_QUEUE_SAMPLE_RATE = 10
+packet_queue = BoundedPacketQueue(
+    maxsize=PACKET_QUEUE_MAX_SIZE,
+    policy=PACKET_QUEUE_POLICY,
+    high_water_mark=PACKET_QUEUE_HIGH_WATER_MARK,
+    sample_rate=PACKET_QUEUE_SAMPLE_RATE
+)
+
+# Maps IP addresses to the hostnames they had over time; see
+# core/hostname_store.py. Has its own lock.
+HOSTNAME_STORE_MAX_SIZE = 65536
+HOSTNAME_STORE_HISTORY_SIZE = 8
+hostname_store = HostnameStore(
+    maxsize=HOSTNAME_STORE_MAX_SIZE,
+    history_size=HOSTNAME_STORE_HISTORY_SIZE
+)
 
 # Where to upload donated data
 INSPECTOR_DATA_DONATION_SERVER = 'https://inspector.engineering.nyu.edu/backend_api'
@@ -0,0 +1,249 @@
+"""
+Resolves IP addresses to hostnames with the NYU server in the background.
+
+Instead of asking the server one IP address at a time, callers hand the IP
+addresses they could not resolve locally to `submit()` and carry on:
+
+hostname_resolver.submit(ip_addr_list, url_prefix, callback, not_found_callback)
+
+The resolver thread (`run()`) deduplicates the pending IP addresses, collects
+them into batches of up to RESOLVER_BATCH_SIZE, and requests
+`<url_prefix>/<ip_addr>` for each address of a batch concurrently (at most
+RESOLVER_CONCURRENCY requests at a time) over a single pooled aiohttp session.
+Each hostname found is saved in global_state.hostname_store and passed to
+`callback(ip_addr, hostname)` on the resolver thread, which should not block;
+each IP address the server has no hostname for is passed to
+`not_found_callback(ip_addr)`, e.g. to fall back to reverse DNS.
+
+Answers are cached: hostnames for RESOLVER_POSITIVE_TTL seconds, and IP
+addresses without a hostname (or whose request failed) for
+RESOLVER_NEGATIVE_TTL seconds, during which they are not requested again.
+
+"""
+import asyncio
+import collections
+import queue
+import threading
+import time
+import aiohttp
+import core.common as common
+import core.global_state as global_state
+
+
+# Maximum number of IP addresses per batch
+RESOLVER_BATCH_SIZE = 64
+
+# How long to wait for more IP addresses before resolving a batch (in seconds)
+RESOLVER_BATCH_WAIT = 0.5
+
+# Maximum number of concurrent requests
+RESOLVER_CONCURRENCY = 8
+
+# Timeout per request (in seconds)
+RESOLVER_TIMEOUT = 10
+
+# How long to cache a hostname (in seconds)
+RESOLVER_POSITIVE_TTL = 3600
+
+# How long to wait before asking again about an IP address without a hostname (in seconds)
+RESOLVER_NEGATIVE_TTL = 600
+
+# Maximum number of cached answers
+RESOLVER_CACHE_SIZE = 65536
+
+_lock = threading.Lock()
+
+# (ip_addr, url_prefix, callback, not_found_callback) of the IP addresses to resolve
+_pending_queue = queue.Queue()
+
+# IP addresses that are queued or being resolved
+_pending_ip_addr_set = set()
+
+# Maps IP address -> (hostname, expiry timestamp); the hostname is '' if not found
+_cache = collections.OrderedDict()
+
+# Event loop and session of the resolver thread
+_loop = [None]
+_session = [None]
+
+_stat_dict = {
+    'requests': 0,
+    'resolved': 0,
+    'not_found': 0,
+    'failed': 0,
+}
+
+
+def submit(ip_addr_list, url_prefix, callback=None, not_found_callback=None) -> int:
+    """
+    Queues IP addresses for resolution, skipping those that are pending or
+    cached; returns the number of IP addresses queued.
+
+    """
+    queued_count = 0
+    now = time.time()
+
+    with _lock:
+        for ip_addr in ip_addr_list:
+            if ip_addr in _pending_ip_addr_set:
+                continue
+            cached = _cache.get(ip_addr)
+            if cached is not None and cached[1] > now:
+                continue
+            _pending_ip_addr_set.add(ip_addr)
+            _pending_queue.put((ip_addr, url_prefix, callback, not_found_callback))
+            queued_count += 1
+
+    return queued_count
+
+
+def get_cached(ip_addr: str) -> str:
+    """Returns the cached hostname of an IP address; '' if it has none, None if unknown or expired."""
+
+    with _lock:
+        cached = _cache.get(ip_addr)
+
+    if cached is None or cached[1] <= time.time():
+        return None
+
+    return cached[0]
+
+
+def get_stats() -> dict:
+
+    with _lock:
+        return dict(_stat_dict, pending=len(_pending_ip_addr_set), cached=len(_cache))
+
+
+def run():
+    """Resolves the next batch of pending IP addresses; blocks until there is one."""
+
+    job_list = [_pending_queue.get()]
+
+    # Collect more IP addresses for the same batch
+    deadline = time.time() + RESOLVER_BATCH_WAIT
+    while len(job_list) < RESOLVER_BATCH_SIZE:
+        remaining = deadline - time.time()
+        try:
+            if remaining > 0:
+                job_list.append(_pending_queue.get(timeout=remaining))
+            else:
+                job_list.append(_pending_queue.get_nowait())
+        except queue.Empty:
+            break
+
+    if _loop[0] is None:
+        _loop[0] = asyncio.new_event_loop()
+
+    try:
+        result_list = _loop[0].run_until_complete(_resolve_batch(job_list))
+    finally:
+        with _lock:
+            for ip_addr, _, _, _ in job_list:
+                _pending_ip_addr_set.discard(ip_addr)
+
+    resolved_count = 0
+    for (ip_addr, _, callback, not_found_callback), hostname in zip(job_list, result_list):
+        if hostname is None:
+            continue
+        if not hostname:
+            if not_found_callback is not None:
+                not_found_callback(ip_addr)
+            continue
+        resolved_count += 1
+        global_state.hostname_store.add(ip_addr, hostname, 'nyu')
+        if callback is not None:
+            callback(ip_addr, hostname)
+
+    common.log(f'[Hostname Resolver] Resolved {resolved_count} of {len(job_list)} IP addresses')
+
+
+def close():
+    """Closes the session and the event loop of the resolver thread."""
+
+    if _loop[0] is None:
+        return
+
+    if _session[0] is not None:
+        _loop[0].run_until_complete(_session[0].close())
+        _session[0] = None
+
+    _loop[0].close()
+    _loop[0] = None
+
+
+async def _resolve_batch(job_list) -> list:
+    """
+    Returns the hostnames of a batch of (ip_addr, url_prefix, callback,
+    not_found_callback); '' if not found, None if the request failed.
+
+    """
+
+    if _session[0] is None:
+        _session[0] = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=RESOLVER_CONCURRENCY),
+            timeout=aiohttp.ClientTimeout(total=RESOLVER_TIMEOUT)
+        )
+
+    semaphore = asyncio.Semaphore(RESOLVER_CONCURRENCY)
+
+    async def _resolve_with_semaphore(ip_addr, url_prefix):
+        async with semaphore:
+            return await _resolve(ip_addr, url_prefix)
+
+    return await asyncio.gather(*[
+        _resolve_with_semaphore(ip_addr, url_prefix) for ip_addr, url_prefix, _, _ in job_list
+    ])
+
+
+async def _resolve(ip_addr, url_prefix) -> str:
+    """
+    Requests the hostname of an IP address and caches the answer; returns ''
+    if not found, None if the request failed.
+
+    """
+
+    url = f'{url_prefix}/{ip_addr}'
+    hostname = ''
+    outcome = 'not_found'
+
+    try:
+        async with _session[0].get(url) as response:
+            if response.status != 200:
+                raise IOError(f'status code {response.status}')
+            response_dict = await response.json(content_type=None)
+    except Exception as ex:
+        common.log(f'[Hostname Resolver] Error: request to {url} failed: {ex}')
+        outcome = 'failed'
+    else:
+        if response_dict.get('success'):
+            hostname = response_dict.get('hostname') or ''
+        elif response_dict.get('error', '') != 'No data for this ip_addr':
+            # The most common error only means that the server has not analyzed the IP address yet
+            common.log(f'[Hostname Resolver] Error: request to {url} did not succeed: {response_dict.get("error", "")}')
+
+    if hostname:
+        outcome = 'resolved'
+
+        # Remove trailing dots
+        if hostname.endswith('.'):
+            hostname = hostname[:-1]
+
+        # Add question mark to denoate uncertainty only if the hostname is not parenthesized
+        if '(' not in hostname and '?' not in hostname:
+            hostname += '?'
+
+    ttl = RESOLVER_POSITIVE_TTL if hostname else RESOLVER_NEGATIVE_TTL
+
+    with _lock:
+        _stat_dict['requests'] += 1
+        _stat_dict[outcome] += 1
+        _cache[ip_addr] = (hostname, time.time() + ttl)
+        _cache.move_to_end(ip_addr)
+        while len(_cache) > RESOLVER_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    if outcome == 'failed':
+        return None
+
+    return hostname
@@ -0,0 +1,212 @@
+"""
+A bounded, time-aware map from IP addresses to hostnames.
+
+An IP address can map to different hostnames over time (e.g., a CDN address
+that serves several domains). For each IP address, the store keeps the
+hostnames it was seen with, oldest first, as [hostname, first_seen,
+last_seen, source] entries, where the source is 'dns', 'sni', 'db' (loaded
+from the Hostname table), 'nyu' (the NYU server) or 'ptr' (reverse DNS).
+`get(ip_addr, ts)` returns the hostname that was valid at `ts`, i.e. the
+latest one first seen at or before `ts`; the latest hostname if `ts` is None.
+
+At most `maxsize` IP addresses are kept, evicting the least recently used,
+and at most `history_size` hostnames per IP address. The store is snapshotted
+to disk with `save()` and restored with `load()`, so that a restart does not
+begin with an empty map.
+
+"""
+import bisect
+import collections
+import json
+import os
+import threading
+import time
+
+
+# Format version of the files written by save()
+_FILE_VERSION = 1
+
+
+class HostnameStore(object):
+
+    def __init__(self, maxsize=65536, history_size=8):
+
+        self.maxsize = maxsize
+        self.history_size = history_size
+
+        # Maps IP address -> list of [hostname, first_seen, last_seen, source], by first_seen
+        self._entry_dict = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        # Maps IP address -> number of the change that last modified it, oldest first
+        self._change_dict = collections.OrderedDict()
+        self._change_count = 0
+
+    def add(self, ip_addr, hostname, source, ts=None, only_if_missing=False) -> bool:
+        """
+        Records that an IP address maps to a hostname at `ts` (by default now).
+        If `only_if_missing` is set, does nothing if the IP address already has
+        a hostname. Returns True if the hostname was recorded.
+
+        """
+        if not hostname:
+            return False
+
+        if ts is None:
+            ts = time.time()
+
+        with self._lock:
+
+            entry_list = self._entry_dict.get(ip_addr)
+            if entry_list is None:
+                entry_list = self._entry_dict[ip_addr] = []
+            elif only_if_missing:
+                return False
+
+            self._entry_dict.move_to_end(ip_addr)
+            self._add_entry(entry_list, [hostname, ts, ts, source])
+            self._mark_changed(ip_addr)
+            self._evict()
+
+        return True
+
+    def _mark_changed(self, ip_addr):
+        """Records that an IP address's entries changed; must be called with the lock held."""
+
+        self._change_count += 1
+        self._change_dict[ip_addr] = self._change_count
+        self._change_dict.move_to_end(ip_addr)
+
+    def _evict(self):
+        """Evicts the least recently used IP addresses beyond maxsize; must be called with the lock held."""
+
+        while len(self._entry_dict) > self.maxsize:
+            ip_addr, _ = self._entry_dict.popitem(last=False)
+            self._change_dict.pop(ip_addr, None)
+
+    def _add_entry(self, entry_list, new_entry):
+        """Adds an entry to an IP address's list; must be called with the lock held."""
+
+        hostname, first_seen, last_seen, _ = new_entry
+
+        ix = bisect.bisect_right([entry[1] for entry in entry_list], first_seen)
+
+        # Seen again with the hostname that was valid at the time: extend it
+        if ix > 0 and entry_list[ix - 1][0] == hostname:
+            entry_list[ix - 1][2] = max(entry_list[ix - 1][2], last_seen)
+            return
+
+        # Seen with the hostname that becomes valid right after: move its start back
+        if ix < len(entry_list) and entry_list[ix][0] == hostname:
+            entry_list[ix][1] = first_seen
+            entry_list[ix][2] = max(entry_list[ix][2], last_seen)
+            return
+
+        entry_list.insert(ix, list(new_entry))
+        if len(entry_list) > self.history_size:
+            del entry_list[0]
+
+    def get(self, ip_addr, ts=None) -> str:
+        """
+        Returns the hostname of an IP address at `ts` (the latest hostname if
+        None), or an empty string if unknown. If all hostnames of the IP
+        address were first seen after `ts`, returns the earliest.
+
+        """
+        with self._lock:
+
+            entry_list = self._entry_dict.get(ip_addr)
+            if not entry_list:
+                return ''
+
+            self._entry_dict.move_to_end(ip_addr)
+
+            if ts is None or ts >= entry_list[-1][1]:
+                return entry_list[-1][0]
+
+            for entry in reversed(entry_list):
+                if entry[1] <= ts:
+                    return entry[0]
+
+            return entry_list[0][0]
+
+    def get_entries(self, ip_addr) -> list:
+        """Returns the (hostname, first_seen, last_seen, source) of an IP address, oldest first."""
+
+        with self._lock:
+            return [tuple(entry) for entry in self._entry_dict.get(ip_addr, [])]
+
+    def __len__(self):
+
+        with self._lock:
+            return len(self._entry_dict)
+
+    def snapshot(self) -> dict:
+        """Returns a copy of the store as a dict of IP address -> list of entries."""
+
+        with self._lock:
+            return {
+                ip_addr: [list(entry) for entry in entry_list]
+                for ip_addr, entry_list in self._entry_dict.items()
+            }
+
+    def get_changes(self, since=0):
+        """
+        Returns (change number, snapshot) where the snapshot (see `snapshot()`)
+        only has the IP addresses changed after change number `since`. Pass
+        the returned change number as `since` to get the next changes.
+
+        """
+        with self._lock:
+            change_dict = {}
+            for ip_addr in reversed(self._change_dict):
+                if self._change_dict[ip_addr] <= since:
+                    break
+                change_dict[ip_addr] = [list(entry) for entry in self._entry_dict[ip_addr]]
+            return self._change_count, change_dict
+
+    def merge(self, snapshot_dict):
+        """Adds the entries of a snapshot (see `snapshot()`) to the store."""
+
+        with self._lock:
+            for ip_addr, snapshot_entry_list in snapshot_dict.items():
+                entry_list = self._entry_dict.get(ip_addr)
+                if entry_list is None:
+                    entry_list = self._entry_dict[ip_addr] = []
+                for entry in snapshot_entry_list:
+                    self._add_entry(entry_list, entry)
+                self._entry_dict.move_to_end(ip_addr)
+                self._mark_changed(ip_addr)
+
+            self._evict()
+
+    def clear(self):
+
+        with self._lock:
+            self._entry_dict.clear()
+            self._change_dict.clear()
+
+    def save(self, path):
+        """Writes a snapshot of the store to a file, least recently used first."""
+
+        snapshot_dict = self.snapshot()
+
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'version': _FILE_VERSION, 'entries': snapshot_dict}, f)
+        os.replace(temp_path, path)
+
+    def load(self, path) -> int:
+        """Merges a snapshot written by `save()` into the store; returns the number of IP addresses read."""
+
+        if not os.path.exists(path):
+            return 0
+
+        with open(path, 'r') as f:
+            contents = json.load(f)
+        if contents.get('version') != _FILE_VERSION:
+            return 0
+
+        self.merge(contents['entries'])
+
+        return len(contents['entries'])
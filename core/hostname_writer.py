@@ -0,0 +1,92 @@
+"""
+Write-behind cache for the Hostname table.
+
+DNS responses and TLS ClientHellos repeat the same (device, hostname, IP,
+source) tuples over and over. `add()` remembers the tuples seen so far and
+only buffers new ones; `flush()`, which runs every HOSTNAME_FLUSH_INTERVAL
+seconds, writes the buffered rows with INSERT OR IGNORE, relying on the
+unique index over these four columns (see `model.Hostname`).
+
+"""
+import threading
+from peewee import chunked
+import core.common as common
+import core.db_writer as db_writer
+import core.model as model
+
+
+# How often to write new hostnames to the database (in seconds)
+HOSTNAME_FLUSH_INTERVAL = 2
+
+# Forget the known tuples once there are this many
+HOSTNAME_KNOWN_SET_SIZE = 100000
+
+# Number of rows per INSERT statement
+HOSTNAME_INSERT_BATCH_SIZE = 100
+
+_lock = threading.Lock()
+
+# (device_mac_addr, hostname, ip_addr, data_source) tuples that have been
+# written or are pending
+_known_set = set()
+
+# Rows waiting to be written
+_pending_list = []
+
+
+def add(device_mac_addr, hostname, ip_set, data_source):
+    """Buffers the hostname-IP mappings that have not been seen before."""
+
+    new_ip_set = set()
+
+    with _lock:
+        if len(_known_set) >= HOSTNAME_KNOWN_SET_SIZE:
+            _known_set.clear()
+        for ip_addr in ip_set:
+            key = (device_mac_addr, hostname, ip_addr, data_source)
+            if key in _known_set:
+                continue
+            _known_set.add(key)
+            _pending_list.append(key)
+            new_ip_set.add(ip_addr)
+
+    if new_ip_set:
+        common.log(f'[Pkt Processor] {data_source.upper()}: Device {device_mac_addr}: {hostname} -> {new_ip_set}')
+
+
+def clear():
+    """Forgets the known and buffered rows, e.g., after the Hostname table has been emptied."""
+
+    with _lock:
+        _known_set.clear()
+        _pending_list.clear()
+
+
+def flush():
+    """Writes the buffered rows to the database."""
+
+    with _lock:
+        if not _pending_list:
+            return
+        pending_list = list(_pending_list)
+        _pending_list.clear()
+
+    row_list = [
+        dict(device_mac_addr=device_mac_addr, hostname=hostname, ip_addr=ip_addr, data_source=data_source)
+        for device_mac_addr, hostname, ip_addr, data_source in pending_list
+    ]
+
+    try:
+        db_writer.execute(_insert_rows, row_list)
+    except Exception:
+        # Write these rows again next time
+        with _lock:
+            _pending_list.extend(pending_list)
+        raise
+
+
+def _insert_rows(row_list):
+    """Inserts rows into the Hostname table, skipping existing ones; runs on the DB writer."""
+
+    for row_batch in chunked(row_list, HOSTNAME_INSERT_BATCH_SIZE):
+        model.Hostname.insert_many(row_batch).on_conflict_ignore().execute()
@@ -0,0 +1,84 @@
+"""
+Memoized classification of IP addresses.
+
+Building an `ipaddress.ip_address` object and evaluating `is_private` etc.
+is relatively expensive, and the packet processor does so several times per
+packet for the same few hundred addresses. `classify()` computes all the
+properties of an address at once, as a bit mask of the flags below, and
+remembers the result for the IP_CACHE_SIZE most recently seen addresses.
+
+Addresses can be given as strings or as integers, as `ipaddress.ip_address`
+accepts. Invalid addresses raise ValueError, as `ipaddress.ip_address` does.
+
+"""
+import functools
+import ipaddress
+
+
+# Maximum number of addresses whose classification is remembered
+IP_CACHE_SIZE = 4096
+
+PRIVATE = 1
+GLOBAL = 2
+MULTICAST = 4
+LINK_LOCAL = 8
+LOOPBACK = 16
+BROADCAST = 32
+
+_BROADCAST_ADDR = ipaddress.IPv4Address('255.255.255.255')
+
+
+@functools.lru_cache(maxsize=IP_CACHE_SIZE)
+def classify(ip_addr) -> int:
+    """Returns the flags of an IP address."""
+
+    ip_obj = ipaddress.ip_address(ip_addr)
+
+    flags = 0
+    if ip_obj.is_private:
+        flags |= PRIVATE
+    if ip_obj.is_global:
+        flags |= GLOBAL
+    if ip_obj.is_multicast:
+        flags |= MULTICAST
+    if ip_obj.is_link_local:
+        flags |= LINK_LOCAL
+    if ip_obj.is_loopback:
+        flags |= LOOPBACK
+    if ip_obj == _BROADCAST_ADDR:
+        flags |= BROADCAST
+
+    return flags
+
+
+@functools.lru_cache(maxsize=IP_CACHE_SIZE)
+def get_sort_key(ip_addr) -> tuple:
+    """
+    Returns a key that orders addresses as `ipaddress` objects do, i.e.,
+    numerically (with IPv4 before IPv6).
+
+    """
+    ip_obj = ipaddress.ip_address(ip_addr)
+    return (ip_obj.version, int(ip_obj))
+
+
+def is_valid(ip_addr) -> bool:
+    """Returns True if the given string is a valid IP address."""
+
+    try:
+        classify(ip_addr)
+    except ValueError:
+        return False
+    return True
+
+
+def is_private(ip_addr) -> bool:
+    return bool(classify(ip_addr) & PRIVATE)
+
+
+def is_global(ip_addr) -> bool:
+    return bool(classify(ip_addr) & GLOBAL)
+
+
+def is_multicast(ip_addr) -> bool:
+    return bool(classify(ip_addr) & MULTICAST)
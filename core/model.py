@@ -3,11 +3,9 @@ from peewee import *
 import os
 import json
 import uuid
-import threading
 
 
-# Should be held whenever writing to the database.
-write_lock = threading.Lock()
+# Writes to the database go through the DB writer thread; see core/db_writer.py
 
 
 # Create the project directory if it doesn't exist yet
@@ -20,7 +18,9 @@ if not os.path.exists(project_directory):
 db_path = os.path.join(common.get_project_directory(), 'data.sqlite3')
 db = SqliteDatabase(
     db_path,
-    pragmas={'journal_mode': 'wal'}
+    # auto_vacuum only takes effect before the first table is created (see
+    # core/flow_retention.py for existing databases)
+    pragmas=(('auto_vacuum', 'incremental'), ('journal_mode', 'wal'))
 )
 
 
@@ -64,18 +64,18 @@ class Device(BaseModel):
 
 class Flow(BaseModel):
 
-    start_ts = FloatField(index=True)
+    start_ts = FloatField()
     end_ts = FloatField()
-    src_device_mac_addr = TextField(index=True)
-    dst_device_mac_addr = TextField(index=True)
+    src_device_mac_addr = TextField()
+    dst_device_mac_addr = TextField()
     src_port = IntegerField(null=True)
     dst_port = IntegerField(null=True)
-    src_ip_addr = TextField(index=True)
-    dst_ip_addr = TextField(index=True)
+    src_ip_addr = TextField()
+    dst_ip_addr = TextField()
     src_country = TextField(default="")
     dst_country = TextField(default="")
-    src_hostname = TextField(default="", index=True)
-    dst_hostname = TextField(default="", index=True)
+    src_hostname = TextField(default="")
+    dst_hostname = TextField(default="")
     src_reg_domain = TextField(default="")
     dst_reg_domain = TextField(default="")
     src_tracker_company = TextField(default="")
@@ -84,6 +84,60 @@ class Flow(BaseModel):
     byte_count = IntegerField()
     packet_count = IntegerField()
 
+    class Meta:
+        indexes = (
+            # Data donation: flows within a time range
+            (('start_ts', 'end_ts'), False),
+            # Sidebar bandwidth and rollup backfill: recent flows; covers the
+            # bandwidth query
+            (('end_ts', 'src_device_mac_addr', 'dst_device_mac_addr', 'byte_count'), False),
+        )
+
+
+# Hostname back-fill (friendly_organizer.add_hostname_info_to_flows): remote IP
+# addresses of flows without a hostname. Flows leave these indexes once they
+# have a hostname; the (constant) filter columns make the indexes covering.
+def _add_hostname_backfill_index(direction):
+
+    Flow.add_index(
+        Flow.index(
+            getattr(Flow, f'{direction}_ip_addr'),
+            getattr(Flow, f'{direction}_hostname'),
+            getattr(Flow, f'{direction}_device_mac_addr'),
+            name=f'flow_{direction}_ip_addr_without_hostname'
+        ).where(SQL(f"{direction}_hostname = '' AND {direction}_device_mac_addr = ''"))
+    )
+
+
+_add_hostname_backfill_index('src')
+_add_hostname_backfill_index('dst')
+
+
+class FlowRollup(BaseModel):
+    """
+    Bytes sent and received by each device to/from each remote IP address,
+    per time bucket of `bucket_size` seconds; maintained by core/flow_rollup.py
+    as flows are written.
+
+    """
+    bucket_size = IntegerField()
+    bucket_ts = IntegerField()
+    device_mac_addr = TextField()
+    remote_ip_addr = TextField()
+    remote_hostname = TextField(default="")
+    remote_reg_domain = TextField(default="")
+    remote_tracker_company = TextField(default="")
+    remote_country = TextField(default="")
+    upload_byte_count = IntegerField(default=0)
+    download_byte_count = IntegerField(default=0)
+
+    class Meta:
+        indexes = (
+            (('bucket_size', 'bucket_ts', 'device_mac_addr', 'remote_ip_addr'), True),
+            # Graphs and data usage of a single device
+            (('bucket_size', 'device_mac_addr', 'bucket_ts'), False),
+        )
+
 
 class Hostname(BaseModel):
 
@@ -95,8 +149,14 @@ class Hostname(BaseModel):
     is_advertising = IntegerField(default=0)
     data_source = TextField(default="")
 
-    # todo [Jakaria] we need to include the (epoch)time information here 
-    # use case: given an IP address, we want to know the hostname (can be different based on access time)
+    # The time at which an IP address had a hostname (which can change over
+    # time) is kept by global_state.hostname_store; see core/hostname_store.py
+
+    class Meta:
+        # Lets core/hostname_writer.py insert rows with INSERT OR IGNORE
+        indexes = (
+            (('device_mac_addr', 'hostname', 'ip_addr', 'data_source'), True),
+        )
 
 
 class FriendlyIdentity(BaseModel):
@@ -118,10 +178,42 @@ class AdTracker(BaseModel):
     tracker_company = TextField(default='')
 
 
+HOSTNAME_UNIQUE_INDEX = 'hostname_device_mac_addr_hostname_ip_addr_data_source'
+
+# Single-column Flow indexes of earlier versions, replaced by the indexes in
+# Flow.Meta and the partial indexes above
+OBSOLETE_FLOW_INDEX_LIST = [
+    'flow_start_ts',
+    'flow_src_device_mac_addr',
+    'flow_dst_device_mac_addr',
+    'flow_src_ip_addr',
+    'flow_dst_ip_addr',
+    'flow_src_hostname',
+    'flow_dst_hostname',
+]
+
+
 def initialize_tables():
     """Creates the tables if they don't exist yet, and creates initial data."""
 
     with db:
 
-        # Create tables
-        db.create_tables([Device, Flow, Hostname, FriendlyIdentity, Configuration, AdTracker])
+        # Databases from earlier versions may hold duplicate hostname rows,
+        # which would prevent the creation of the unique index
+        if db.table_exists('hostname') and HOSTNAME_UNIQUE_INDEX not in [index.name for index in db.get_indexes('hostname')]:
+            Hostname.delete().where(
+                Hostname.id.not_in(
+                    Hostname.select(fn.MIN(Hostname.id)).group_by(
+                        Hostname.device_mac_addr, Hostname.hostname, Hostname.ip_addr, Hostname.data_source
+                    )
+                )
+            ).execute()
+
+        # Create tables; also creates missing indexes on existing tables
+        db.create_tables([Device, Flow, FlowRollup, Hostname, FriendlyIdentity, Configuration, AdTracker])
+
+        for index_name in OBSOLETE_FLOW_INDEX_LIST:
+            db.execute_sql(f'DROP INDEX IF EXISTS "{index_name}"')
+
+        # Refresh the query planner statistics if the indexes have changed
+        db.execute_sql('PRAGMA optimize')
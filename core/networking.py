@@ -1,4 +1,3 @@
-import ipaddress
 import socket
 import subprocess
 import sys
@@ -7,6 +6,8 @@ import core.common as common
 import core.global_state as global_state
 import core.model as model
 import core.networking as networking
+import core.ip_classifier as ip_classifier
+import core.device_cache as device_cache
 import scapy.all as sc
 import netifaces
 import netaddr
@@ -17,16 +18,17 @@ import threading
 class ARPCache(object):
     """Stores a mapping between IP and MAC addresses"""
 
-    def __init__(self):
+    def __init__(self, load_from_db=True):
         # Initialize the variables
         self._ip_mac_cache = {}
         self._mac_ip_cache = {}
         self._lock = threading.Lock()
-        # Load previous ARP cache from the database
-        with model.db:
-            for device in model.Device.select():
-                self._ip_mac_cache[device.ip_addr] = device.mac_addr
-                self._mac_ip_cache[device.mac_addr] = device.ip_addr
+        if not load_from_db:
+            return
+        # Load previous ARP cache from the devices table
+        for ip_addr, mac_addr in device_cache.get_ip_mac_dict().items():
+            self._ip_mac_cache[ip_addr] = mac_addr
+            self._mac_ip_cache[mac_addr] = ip_addr
 
     def update(self, ip_addr:str , mac_addr: str):
         """Updates the cache with the given IP and MAC addresses."""
@@ -44,6 +46,11 @@ class ARPCache(object):
         with self._lock:
             return self._mac_ip_cache[mac_addr]
 
+    def snapshot(self) -> dict:
+        """Returns a copy of the IP-to-MAC mapping."""
+        with self._lock:
+            return dict(self._ip_mac_cache)
+
 
 def update_network_info():
     """Updates the network info in global_state."""
@@ -179,8 +186,7 @@ def get_network_ip_range():
 def is_private_ip_addr(ip_addr):
     """Returns True if the given IP address is a private local IP address."""
 
-    ip_addr = ipaddress.ip_address(ip_addr)
-    return not ip_addr.is_global
+    return not ip_classifier.is_global(ip_addr)
 
 
 
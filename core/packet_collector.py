@@ -2,11 +2,21 @@
 Captures and analyzes packets from the network.
 
 """
+import socket
+import struct
 import scapy.all as sc
 import core.global_state as global_state
 import core.common as common
+import core.ring_capture as ring_capture
+import core.packet_parser as packet_parser
 
 
+# Which capture backend to use: 'scapy' uses scapy's sniff loop, which
+# dissects every frame on the capture thread; 'ring' uses a Linux TPACKET_V3
+# mmap ring and hands raw frames to the packet processor, which only dissects
+# what it needs. Falls back to 'scapy' if the ring cannot be set up.
+CAPTURE_BACKEND = 'scapy'
+
 
 WINDOWS_TEXT = '\n' * 20 + """
 ==================================================
@@ -28,6 +38,12 @@ def start_packet_collector():
 
     sc.load_layer('tls')
 
+    if CAPTURE_BACKEND == 'ring' and ring_capture.is_supported():
+        try:
+            return start_ring_packet_collector()
+        except OSError as e:
+            common.log(f'[Packet Collector] Unable to use the ring capture backend, falling back to scapy: {e}')
+
     # Continuously sniff packets for 30 second intervals
     sc.sniff(
         prn=add_packet_to_queue,
@@ -38,6 +54,27 @@ def start_packet_collector():
     )
 
 
+def start_ring_packet_collector():
+    """
+    Reads raw frames from a TPACKET_V3 ring and adds them to the packet queue
+    in batches. The ring stays open until Inspector stops or the active
+    interface changes; the caller's loop then sets up a new one, as it does
+    after an error.
+
+    """
+    if not global_state.is_running:
+        return
+
+    iface = global_state.host_active_interface
+
+    def stop_func():
+        return not global_state.is_running or global_state.host_active_interface != iface
+
+    with ring_capture.RingCapture(iface) as ring:
+        for frame_batch in ring.read_batches(stop_func=stop_func):
+            add_frames_to_queue(frame_batch)
+
+
 def add_packet_to_queue(pkt):
     """
     Adds a packet to the packet queue.
@@ -47,4 +84,38 @@ def add_packet_to_queue(pkt):
         if not global_state.is_inspecting:
             return
 
-    global_state.packet_queue.put(pkt)
\ No newline at end of file
+    global_state.packet_queue.put(pkt)
+
+
+def add_frames_to_queue(frame_batch):
+    """
+    Adds a batch of raw (frame, timestamp) tuples to the packet queue.
+
+    Applies the same filter as the scapy sniff loop on the raw bytes, i.e.,
+    keeps ARP, plus IPv4 frames that are not to or from this host, with or
+    without VLAN tags. Frames are copied out of the ring here; they are
+    dissected later by the packet processor and only if needed.
+
+    """
+    with global_state.global_state_lock:
+        if not global_state.is_inspecting:
+            return
+
+    try:
+        host_ip_addr = socket.inet_aton(global_state.host_ip_addr)
+    except OSError:
+        host_ip_addr = b''
+
+    for frame, ts in frame_batch:
+        try:
+            ether_type, l3 = packet_parser.get_ether_type(frame)
+        except struct.error:
+            continue
+        if ether_type == packet_parser.ETHER_TYPE_ARP:
+            pass
+        elif ether_type == packet_parser.ETHER_TYPE_IPV4:
+            if host_ip_addr in (frame[l3 + 12:l3 + 16], frame[l3 + 16:l3 + 20]):
+                continue
+        else:
+            continue
+        global_state.packet_queue.put((bytes(frame), ts))
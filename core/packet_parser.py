@@ -0,0 +1,191 @@
+"""
+Fast-path parser for Ethernet/IPv4/TCP/UDP headers.
+
+Parses the fixed-size headers of a raw frame with precompiled `struct`
+unpackers, without building scapy layers. Scapy is only needed for the few
+frames whose payload we actually inspect (ARP, DHCP, DNS and TLS
+ClientHello); use the `needs_*` helpers below to decide.
+
+"""
+import socket
+import struct
+
+
+ETHER_TYPE_IPV4 = 0x0800
+ETHER_TYPE_ARP = 0x0806
+ETHER_TYPE_VLAN = 0x8100
+ETHER_TYPE_QINQ = 0x88a8
+
+# 802.1Q and 802.1ad (QinQ) tags that may precede the EtherType
+VLAN_ETHER_TYPES = frozenset([ETHER_TYPE_VLAN, ETHER_TYPE_QINQ])
+
+# Maximum number of stacked VLAN tags to skip
+MAX_VLAN_TAGS = 2
+
+IP_PROTO_TCP = 6
+IP_PROTO_UDP = 17
+
+# UDP ports on which scapy dissects DHCP (BOOTP) and DNS (incl. mDNS)
+DHCP_PORTS = frozenset([67, 68])
+DNS_PORTS = frozenset([53, 5353])
+
+_ETHER_TYPE = struct.Struct('!H')
+_IP_FRAG = struct.Struct('!H')
+_PORTS = struct.Struct('!HH')
+_TCP_SEQ_ACK = struct.Struct('!II')
+
+_inet_ntoa = socket.inet_ntoa
+
+
+class PacketRecord(object):
+    """Header fields of a single Ethernet/IPv4 frame."""
+
+    __slots__ = (
+        'ts', 'length', 'src_mac', 'dst_mac', 'src_ip', 'dst_ip', 'ip_proto',
+        'protocol', 'src_port', 'dst_port', 'tcp_seq', 'tcp_ack', 'frame',
+        'payload_offset', 'weight'
+    )
+
+    def __init__(self, ts, length, src_mac, dst_mac, src_ip, dst_ip, ip_proto,
+                 protocol='', src_port=None, dst_port=None, tcp_seq=None,
+                 tcp_ack=None, frame=b'', payload_offset=0, weight=1):
+
+        self.ts = ts
+        self.length = length
+        self.src_mac = src_mac
+        self.dst_mac = dst_mac
+        self.src_ip = src_ip
+        self.dst_ip = dst_ip
+        self.ip_proto = ip_proto
+        # 'tcp', 'udp', or '' if neither (or a non-first IP fragment)
+        self.protocol = protocol
+        self.src_port = src_port
+        self.dst_port = dst_port
+        self.tcp_seq = tcp_seq
+        self.tcp_ack = tcp_ack
+        self.frame = frame
+        self.payload_offset = payload_offset
+        # Number of captured packets this record stands for (> 1 when the
+        # packet queue is sampling)
+        self.weight = weight
+
+    def __repr__(self):
+        return 'PacketRecord(%s %s:%s -> %s:%s %s, %d bytes)' % (
+            self.protocol, self.src_ip, self.src_port, self.dst_ip,
+            self.dst_port, self.ip_proto, self.length
+        )
+
+    @property
+    def payload(self) -> bytes:
+        """The L4 payload (TCP/UDP) or L3 payload otherwise."""
+        return bytes(self.frame[self.payload_offset:])
+
+
+def get_ether_type(frame):
+    """
+    Returns (EtherType, offset of the L3 header) of a raw Ethernet frame,
+    skipping up to MAX_VLAN_TAGS 802.1Q/802.1ad tags. Raises struct.error if
+    the frame is truncated.
+
+    """
+    offset = 12
+    ether_type, = _ETHER_TYPE.unpack_from(frame, offset)
+    for _ in range(MAX_VLAN_TAGS):
+        if ether_type not in VLAN_ETHER_TYPES:
+            break
+        offset += 4
+        ether_type, = _ETHER_TYPE.unpack_from(frame, offset)
+
+    return ether_type, offset + 2
+
+
+def parse_frame(frame, ts=0.0):
+    """
+    Parses a raw Ethernet frame into a PacketRecord.
+
+    Returns None if the frame is not IPv4 (optionally VLAN-tagged) or is
+    truncated.
+
+    """
+    try:
+        ether_type, l3 = get_ether_type(frame)
+        if ether_type != ETHER_TYPE_IPV4:
+            return None
+
+        ihl = (frame[l3] & 0x0f) * 4
+        ip_proto = frame[l3 + 9]
+        record = PacketRecord(
+            ts=ts,
+            length=len(frame),
+            src_mac=bytes(frame[6:12]).hex(':'),
+            dst_mac=bytes(frame[0:6]).hex(':'),
+            src_ip=_inet_ntoa(frame[l3 + 12:l3 + 16]),
+            dst_ip=_inet_ntoa(frame[l3 + 16:l3 + 20]),
+            ip_proto=ip_proto,
+            frame=frame,
+            payload_offset=l3 + ihl
+        )
+
+        # Non-first fragments carry no L4 header
+        frag_offset, = _IP_FRAG.unpack_from(frame, l3 + 6)
+        if frag_offset & 0x1fff:
+            return record
+
+        l4 = l3 + ihl
+        if ip_proto == IP_PROTO_TCP:
+            record.src_port, record.dst_port = _PORTS.unpack_from(frame, l4)
+            record.tcp_seq, record.tcp_ack = _TCP_SEQ_ACK.unpack_from(frame, l4 + 4)
+            record.payload_offset = l4 + (frame[l4 + 12] >> 4) * 4
+            record.protocol = 'tcp'
+        elif ip_proto == IP_PROTO_UDP:
+            record.src_port, record.dst_port = _PORTS.unpack_from(frame, l4)
+            record.payload_offset = l4 + 8
+            record.protocol = 'udp'
+
+    except (struct.error, IndexError, OSError):
+        return None
+
+    return record
+
+
+def is_arp_frame(frame) -> bool:
+    """Returns True if the frame carries ARP (optionally VLAN-tagged)."""
+
+    try:
+        return get_ether_type(frame)[0] == ETHER_TYPE_ARP
+    except struct.error:
+        return False
+
+
+def needs_dhcp_dissection(record: PacketRecord) -> bool:
+    """Returns True if the frame may carry DHCP."""
+
+    return record.protocol == 'udp' and \
+        (record.src_port in DHCP_PORTS or record.dst_port in DHCP_PORTS)
+
+
+def needs_dns_dissection(record: PacketRecord) -> bool:
+    """Returns True if the frame may carry DNS."""
+
+    if record.protocol == 'udp':
+        return record.src_port in DNS_PORTS or record.dst_port in DNS_PORTS
+    if record.protocol == 'tcp':
+        return record.src_port == 53 or record.dst_port == 53
+    return False
+
+
+def needs_client_hello_dissection(record: PacketRecord) -> bool:
+    """
+    Returns True if the frame may carry a TLS ClientHello, i.e., its TCP
+    payload starts with a TLS handshake record of type ClientHello.
+
+    """
+    if record.protocol != 'tcp':
+        return False
+
+    offset = record.payload_offset
+    frame = record.frame
+    if len(frame) < offset + 6:
+        return False
+
+    return frame[offset] == 0x16 and frame[offset + 5] == 0x01
@@ -7,22 +7,30 @@ import core.networking as networking
 import traceback
 from core.tls_processor import extract_sni
 import core.friendly_organizer as friendly_organizer
+import core.flow_writer as flow_writer
+import core.device_cache as device_cache
+import core.hostname_writer as hostname_writer
+import core.parquet_archive as parquet_archive
+import core.packet_parser as packet_parser
+from core.burst_table import BurstTable
+from core.burst_features import BurstAccumulator, get_numeric_features_batch
 
 # Jakaria: import additional libraries
 import core.utils as utils
-import ipaddress
-import pandas as pd
-import numpy as np
-from scipy.stats import kurtosis
-from scipy.stats import skew
-from statsmodels import robust
+import core.ip_classifier as ip_classifier
 
 # Jakaria: How often to write the burst statistics to the database (in seconds)
 BURST_WRITE_INTERVAL = 1
 
-# Jakaria: Timestamp of the last time the burst_dict was written to db
-burst_dict_start_time = {}
-burst_dict_all_burst = {}  # key (flow key) -> {key (time) -> [[packet element]]}
+# Compute the features of bursts that close at the same time in one batch
+# (see burst_features.get_numeric_features_batch) if they have at least this
+# many packets in total; benchmarks/burst_features.py breaks even at roughly
+# 1000-2000 packets, whether in many short or few long bursts
+BURST_BATCH_MIN_PACKETS = 4096
+
+# Jakaria: Open bursts, i.e., flow key -> start time and BurstAccumulator,
+# indexed by start time so that expired bursts are found without a full scan
+burst_table = BurstTable()
 
 
 # How often to write the flow statistics to the database (in seconds)
@@ -34,63 +42,210 @@ flow_dict = {}
 # Timestamp of the last time the flow_dict was written to db
 flow_dict_last_db_write_ts = {'_': 0}
 
+# Batch mode: process up to PACKET_BATCH_SIZE packets, or as many as arrive
+# within PACKET_BATCH_TIMEOUT seconds, per call; 0 or 1 processes one packet
+# at a time (see process_packet)
+PACKET_BATCH_SIZE = 1
+PACKET_BATCH_TIMEOUT = 0.01
+
 # write function to detect re-transmission and duplicate packets
 seen_packets = set()
 
+# Set in shard worker processes (see core/packet_shard.py) to the queue through
+# which flows and bursts are merged back into the main process
+shard_result_queue = [None]
+
 def process_packet():
 
-    pkt = global_state.packet_queue.get()
+    pkt, weight = global_state.packet_queue.get_with_weight()
 
     try:
-        process_packet_helper(pkt)
+        process_packet_helper(pkt, weight)
 
     except Exception as e:
         common.log('[Pkt Processor] Error processing packet: ' + str(e) + ' for packet: ' + str(pkt) + '\n' + traceback.format_exc())
 
 
-def process_packet_helper(pkt):
+def process_packet_batch():
+    """
+    Processes a batch of packets from the packet queue.
+
+    The batch shares a single timestamp and a single snapshot of the ARP
+    cache, taken after the ARP packets of the batch have been processed, and
+    its flow counters are merged into flow_dict at once.
+
+    """
+    batch = global_state.packet_queue.get_batch(PACKET_BATCH_SIZE, PACKET_BATCH_TIMEOUT)
+
+    current_ts = time.time()
+
+    # Write pending flows to database if the flow_dict has not been updated for FLOW_WRITE_INTERVAL sec
+    if current_ts - flow_dict_last_db_write_ts['_'] > FLOW_WRITE_INTERVAL:
+        write_pending_flows_to_db()
+        flow_dict_last_db_write_ts['_'] = current_ts
+
+    record_list = []
+    for pkt, weight in batch:
+        try:
+            record = preprocess_packet(pkt, weight)
+            if record is not None:
+                record_list.append(record)
+        except Exception as e:
+            common.log('[Pkt Processor] Error processing packet: ' + str(e) + ' for packet: ' + str(pkt) + '\n' + traceback.format_exc())
+
+    ip_mac_dict = global_state.arp_cache.snapshot()
+
+    # Maps flow key -> [byte_count, pkt_count] for this batch
+    batch_flow_dict = {}
+
+    for record in record_list:
+        try:
+            try: process_burst(record, ip_mac_dict)
+            except Exception as e: common.log('[Burst Processor] Error processing packet: ' + str(e))
+
+            flow_key = get_flow_key(record, ip_mac_dict)
+            if flow_key is None:
+                continue
+            weight = record.weight
+            counters = batch_flow_dict.get(flow_key)
+            if counters is None:
+                batch_flow_dict[flow_key] = [record.length * weight, weight]
+            else:
+                counters[0] += record.length * weight
+                counters[1] += weight
+
+        except Exception as e:
+            common.log('[Pkt Processor] Error processing packet: ' + str(e) + ' for packet: ' + str(record) + '\n' + traceback.format_exc())
+
+    for flow_key, (byte_count, pkt_count) in batch_flow_dict.items():
+        flow_stat_dict = flow_dict.setdefault(flow_key, {
+            'start_ts': current_ts,
+            'end_ts': current_ts,
+            'byte_count': 0,
+            'pkt_count': 0
+        })
+        flow_stat_dict['end_ts'] = current_ts
+        flow_stat_dict['byte_count'] += byte_count
+        flow_stat_dict['pkt_count'] += pkt_count
+
+
+def decode_frame(frame, ts):
+    """Dissects a raw Ethernet frame with scapy."""
+
+    pkt = sc.Ether(frame)
+    pkt.time = ts
+    return pkt
+
 
+def process_packet_helper(pkt, weight=1):
+    """
+    Processes a single packet (see preprocess_packet) and counts it towards
+    its burst and flow.
+
+    """
     # Write pending flows to database if the flow_dict has not been updated for FLOW_WRITE_INTERVAL sec
     if time.time() - flow_dict_last_db_write_ts['_'] > FLOW_WRITE_INTERVAL:
         write_pending_flows_to_db()
         flow_dict_last_db_write_ts['_'] = time.time()
 
+    record = preprocess_packet(pkt, weight)
+    if record is None:
+        return
+
+    # Jakaria: process burst
+    # Note: not considering ARP, DHCP, DNS packets in burst
+    try: process_burst(record)
+    except Exception as e: common.log('[Burst Processor] Error processing packet: ' + str(e))
+
+    # Process flow
+    return process_flow(record)
+
+
+def preprocess_packet(pkt, weight=1):
+    """
+    Processes either a scapy packet (from the scapy sniff loop) or a raw
+    (frame, timestamp) tuple (from the ring capture backend) up to the point
+    where flow and burst accounting would start.
+
+    Handles ARP, DHCP, DNS and TLS ClientHello packets, which are the only
+    ones dissected with scapy. Returns the fast-path PacketRecord if the packet
+    should also be counted towards flows and bursts; otherwise returns None.
+    The record's weight is set to `weight`, i.e., the number of captured
+    packets this packet stands for when the packet queue is sampling.
+
+    """
+    if isinstance(pkt, tuple):
+        frame, ts = pkt
+        scapy_pkt = None
+    else:
+        # Sniffed packets keep their raw bytes; avoid re-serializing them
+        frame, ts = getattr(pkt, 'original', None) or bytes(pkt), float(pkt.time)
+        scapy_pkt = pkt
+
+    record = packet_parser.parse_frame(frame, ts)
+    if record is not None:
+        record.weight = weight
+
     # ====================
     # Process individual packets and terminate
     # ====================
 
-    if sc.ARP in pkt:
-        return process_arp(pkt)
-
-    if sc.DHCP in pkt:
-        return process_dhcp(pkt)
+    # Must have Ether frame and IP frame, unless this is ARP
+    if record is None:
+        if packet_parser.is_arp_frame(frame):
+            process_control_packet('arp', frame, ts, scapy_pkt)
+        return None
 
-    # Must have Ether frame and IP frame.
-    if not (sc.Ether in pkt and sc.IP in pkt):
-        return
+    if packet_parser.needs_dhcp_dissection(record):
+        scapy_pkt = scapy_pkt or decode_frame(frame, ts)
+        if sc.DHCP in scapy_pkt:
+            process_control_packet('dhcp', frame, ts, scapy_pkt)
+            return None
 
     # Ignore traffic to and from this host's IP
-    if global_state.host_ip_addr in (pkt[sc.IP].src, pkt[sc.IP].dst):
-        return
+    if global_state.host_ip_addr in (record.src_ip, record.dst_ip):
+        return None
 
     # DNS
-    if sc.DNS in pkt:
-        return process_dns(pkt)
+    if packet_parser.needs_dns_dissection(record):
+        scapy_pkt = scapy_pkt or decode_frame(frame, ts)
+        if sc.DNS in scapy_pkt:
+            process_control_packet('dns', frame, ts, scapy_pkt)
+            return None
 
     # ====================
     # Process flows and their first packets
     # ====================
 
-    process_client_hello(pkt)
+    if record.dst_mac == global_state.host_mac_addr and packet_parser.needs_client_hello_dissection(record):
+        process_control_packet('client_hello', frame, ts, scapy_pkt)
 
-    # Jakaria: process burst; Resolve BuG burst processing error
-    # BUG: Resolve BuG burst processing error: dictionary updated while in loop
-    # Note: not considering ARP, DHCP, DNS packets in burst
-    try: process_burst(pkt)
-    except Exception as e: common.log('[Burst Processor] Error processing packet: ' + str(e))
+    return record
 
-    # Process flow
-    return process_flow(pkt)
+
+def process_control_packet(kind, frame, ts, scapy_pkt=None):
+    """
+    Processes an ARP, DHCP, DNS or TLS ClientHello packet (`kind` is 'arp',
+    'dhcp', 'dns' or 'client_hello'), which updates the devices, the ARP cache
+    and the hostnames. In a shard worker process, hands the frame to the main
+    process instead, which owns that state.
+
+    """
+    if shard_result_queue[0] is not None:
+        shard_result_queue[0].put(('control', (kind, bytes(frame), ts)))
+        return
+
+    scapy_pkt = scapy_pkt or decode_frame(frame, ts)
+
+    if kind == 'arp':
+        if sc.ARP in scapy_pkt:
+            process_arp(scapy_pkt)
+    elif kind == 'dhcp':
+        process_dhcp(scapy_pkt)
+    elif kind == 'dns':
+        process_dns(scapy_pkt)
+    elif kind == 'client_hello':
+        process_client_hello(scapy_pkt)
 
 
 def process_arp(pkt):
@@ -111,21 +266,8 @@ def process_arp(pkt):
     ip_addr = pkt.psrc
     mac_addr = pkt.hwsrc
 
-    # Update the devices table
-    has_updated = False
-    with model.write_lock:
-        with model.db:
-            device = model.Device.get_or_none(mac_addr=mac_addr)
-            if device is None:
-                # Never seen this device before, so create one
-                model.Device.create(mac_addr=mac_addr, ip_addr=ip_addr)
-                has_updated = True
-            else:
-                # Update the IP address if different
-                if device.ip_addr != ip_addr:
-                    device.ip_addr = ip_addr
-                    device.save()
-                    has_updated = True
+    # Update the devices table (via the device cache)
+    has_updated = device_cache.update(mac_addr, ip_addr=ip_addr)
 
     # Update the ARP cache
     global_state.arp_cache.update(ip_addr, mac_addr)
@@ -175,52 +317,60 @@ def process_dns(pkt):
                 if networking.is_ipv4_addr(ip):
                     ip_set.add(ip)
                     # Write to cache
-                    with global_state.global_state_lock:
-                        global_state.hostname_dict[ip] = hostname
+                    global_state.hostname_store.add(ip, hostname, 'dns', ts=float(pkt.time))
 
     # If we don't have an IP address, that's fine. We'll still store the domain queried, setting the IP address to empty.
     if not ip_set:
         ip_set.add('')
 
     # Write to domain-IP mapping to database
-    created = False
-    with model.write_lock:
-        with model.db:
-            for ip_addr in ip_set:
-                _, created = model.Hostname.get_or_create(
-                    device_mac_addr=device_mac_addr,
-                    hostname=hostname,
-                    ip_addr=ip_addr,
-                    data_source='dns'
-                )
+    hostname_writer.add(device_mac_addr, hostname, ip_set, 'dns')
 
-    if created:
-        common.log(f'[Pkt Processor] DNS: Device {device_mac_addr}: {hostname} -> {ip_set}')
 
+def process_flow(record):
 
-def process_flow(pkt):
+    flow_key = get_flow_key(record)
+    if flow_key is None:
+        return
 
+    # todo: Check if stats updates in the dics
+    flow_stat_dict = flow_dict.setdefault(flow_key, {
+        'start_ts': time.time(),
+        'end_ts': time.time(),
+        'byte_count': 0,
+        'pkt_count': 0
+    })
+    flow_stat_dict['end_ts'] = time.time()
+    flow_stat_dict['byte_count'] += record.length * record.weight
+    flow_stat_dict['pkt_count'] += record.weight
+
+
+def get_flow_key(record, ip_mac_dict=None):
+    """
+    Returns the flow key <src_device_mac_addr, dst_device_mac_addr,
+    src_ip_addr, dst_ip_addr, src_port, dst_port, protocol> of a packet, or
+    None if the packet does not count towards any flow.
+
+    MAC addresses are resolved with `ip_mac_dict` (a snapshot of the ARP
+    cache) if given, or with the ARP cache itself otherwise.
+
+    """
     # Must have TCP or UDP layer
-    if sc.TCP in pkt:
-        protocol = 'tcp'
-        layer = sc.TCP
-    elif sc.UDP in pkt:
-        protocol = 'udp'
-        layer = sc.UDP
-    else:
-        return
+    protocol = record.protocol
+    if not protocol:
+        return None
 
     # Parse packet
-    src_mac_addr = pkt[sc.Ether].src
-    dst_mac_addr = pkt[sc.Ether].dst
-    src_ip_addr = pkt[sc.IP].src
-    dst_ip_addr = pkt[sc.IP].dst
-    src_port = pkt[layer].sport
-    dst_port = pkt[layer].dport
+    src_mac_addr = record.src_mac
+    dst_mac_addr = record.dst_mac
+    src_ip_addr = record.src_ip
+    dst_ip_addr = record.dst_ip
+    src_port = record.src_port
+    dst_port = record.dst_port
 
     # No broadcast
     if dst_mac_addr == 'ff:ff:ff:ff:ff:ff' or dst_ip_addr == '255.255.255.255':
-        return
+        return None
 
     inspector_host_mac_addr = global_state.host_mac_addr
 
@@ -228,98 +378,81 @@ def process_flow(pkt):
     # is a local communication; otherwise, assume that Inspector pretends to be
     # the gateway
     if src_mac_addr == inspector_host_mac_addr:
-        try:
-            src_mac_addr = global_state.arp_cache.get_mac_addr(src_ip_addr)
-        except KeyError:
-            src_mac_addr = ''
+        src_mac_addr = get_mac_addr(src_ip_addr, ip_mac_dict)
     elif dst_mac_addr == inspector_host_mac_addr:
-        try:
-            dst_mac_addr = global_state.arp_cache.get_mac_addr(dst_ip_addr)
-        except KeyError:
-            dst_mac_addr = ''
+        dst_mac_addr = get_mac_addr(dst_ip_addr, ip_mac_dict)
     else:
-        return
+        return None
 
-    # Save the flow into a temporary flow queue
-    flow_key = (
+    return (
         src_mac_addr, dst_mac_addr, src_ip_addr, dst_ip_addr, src_port, dst_port, protocol
     )
 
-    # todo: Check if stats updates in the dics
-    flow_stat_dict = flow_dict.setdefault(flow_key, {
-        'start_ts': time.time(),
-        'end_ts': time.time(),
-        'byte_count': 0,
-        'pkt_count': 0
-    })
-    flow_stat_dict['end_ts'] = time.time()
-    flow_stat_dict['byte_count'] += len(pkt)
-    flow_stat_dict['pkt_count'] += 1
+
+def get_mac_addr(ip_addr, ip_mac_dict=None):
+    """
+    Returns the MAC address of ip_addr from the ARP cache snapshot
+    `ip_mac_dict` if given, or from the ARP cache itself; returns '' if not
+    found.
+
+    """
+    if ip_mac_dict is not None:
+        return ip_mac_dict.get(ip_addr, '')
+
+    try:
+        return global_state.arp_cache.get_mac_addr(ip_addr)
+    except KeyError:
+        return ''
+
+
+def merge_flows(other_flow_dict):
+    """Merges the flow statistics in other_flow_dict into flow_dict."""
+
+    for flow_key, other_stat_dict in other_flow_dict.items():
+        flow_stat_dict = flow_dict.get(flow_key)
+        if flow_stat_dict is None:
+            flow_dict[flow_key] = other_stat_dict
+            continue
+        flow_stat_dict['start_ts'] = min(flow_stat_dict['start_ts'], other_stat_dict['start_ts'])
+        flow_stat_dict['end_ts'] = max(flow_stat_dict['end_ts'], other_stat_dict['end_ts'])
+        flow_stat_dict['byte_count'] += other_stat_dict['byte_count']
+        flow_stat_dict['pkt_count'] += other_stat_dict['pkt_count']
+
+
+def swap_flow_dict() -> dict:
+    """
+    Replaces flow_dict with an empty dict and returns the previous one, so
+    that packets can be counted into the new dict while the previous one is
+    being written.
+
+    """
+    global flow_dict
+
+    pending_flow_dict = flow_dict
+    flow_dict = {}
+
+    return pending_flow_dict
 
 
 def write_pending_flows_to_db():
-    """Write flows in the flow_dict into the database (Flow table)"""
-
-    with model.write_lock:
-        with model.db:
-            for flow_key, flow_stat_dict in flow_dict.items():
-
-                # Unpack the flow key
-                src_mac_addr, dst_mac_addr, src_ip_addr, dst_ip_addr, src_port, dst_port, protocol = flow_key
-
-                # Find the country in both directions
-                src_country = ''
-                dst_country = ''
-                if src_mac_addr == '' and src_ip_addr != '':
-                    src_country = friendly_organizer.get_country_from_ip_addr(src_ip_addr)
-                if dst_mac_addr == '' and dst_ip_addr != '':
-                    dst_country = friendly_organizer.get_country_from_ip_addr(dst_ip_addr)
-
-                # Fill in the hostname information
-                src_hostname = friendly_organizer.get_hostname_from_ip_addr(src_ip_addr, in_memory_only=True)
-                dst_hostname = friendly_organizer.get_hostname_from_ip_addr(dst_ip_addr, in_memory_only=True)
-
-                # Fill out the registered domain info and tracker company info per hostname
-                src_reg_domain = ''
-                dst_reg_domain = ''
-                src_tracker_company = ''
-                dst_tracker_company = ''
-                if src_hostname:
-                    src_reg_domain = friendly_organizer.get_reg_domain(src_hostname)
-                    src_tracker_company = friendly_organizer.get_tracker_company(src_hostname)
-                if dst_hostname:
-                    dst_reg_domain = friendly_organizer.get_reg_domain(dst_hostname)
-                    dst_tracker_company = friendly_organizer.get_tracker_company(dst_hostname)
-
-                # Write to database
-                model.Flow.create(
-                    start_ts=flow_stat_dict['start_ts'],
-                    end_ts=flow_stat_dict['end_ts'],
-                    src_device_mac_addr=src_mac_addr,
-                    dst_device_mac_addr=dst_mac_addr,
-                    src_port=src_port,
-                    dst_port=dst_port,
-                    src_ip_addr=src_ip_addr,
-                    dst_ip_addr=dst_ip_addr,
-                    src_country=src_country,
-                    dst_country=dst_country,
-                    src_hostname=src_hostname,
-                    dst_hostname=dst_hostname,
-                    src_reg_domain=src_reg_domain,
-                    dst_reg_domain=dst_reg_domain,
-                    src_tracker_company=src_tracker_company,
-                    dst_tracker_company=dst_tracker_company,
-                    protocol=protocol,
-                    byte_count=flow_stat_dict['byte_count'],
-                    packet_count=flow_stat_dict['pkt_count']
-                )
-
-    common.log('[Pkt Processor] Wrote {} flows to database. Pending packet_queue size: {}'.format(
-        len(flow_dict), global_state.packet_queue.qsize()
-    ))
-
-    # Clear the flow_dict
-    flow_dict.clear()
+    """
+    Write flows in the flow_dict into the database (Flow table)
+
+    Hands the flows to the flow writer thread if it is running (see
+    core/flow_writer.py); otherwise writes them before returning.
+
+    """
+    if flow_writer.is_running():
+        flow_writer.submit(swap_flow_dict)
+        return
+
+    pending_flow_dict = swap_flow_dict()
+    try:
+        flow_writer.write_flows_to_db(pending_flow_dict)
+    except Exception:
+        # Keep the flows for the next write
+        merge_flows(pending_flow_dict)
+        raise
 
 
 def process_dhcp(pkt):
@@ -348,18 +481,8 @@ def process_dhcp(pkt):
     if device_mac == global_state.host_mac_addr:
         return
 
-    # Update the devices table
-    with model.write_lock:
-        with model.db:
-            device = model.Device.get_or_none(mac_addr=device_mac)
-            if device is None:
-                # Never seen this device before, so create one
-                model.Device.create(mac_addr=device_mac, ip_addr='', dhcp_hostname=device_hostname)
-            else:
-                # Update the hostname if different
-                if device.dhcp_hostname != device_hostname:
-                    device.dhcp_hostname = device_hostname
-                    device.save()
+    # Update the devices table (via the device cache)
+    device_cache.update(device_mac, dhcp_hostname=device_hostname)
 
     common.log(f'[Pkt Processor] DHCP: Device {device_mac}: {device_hostname}')
 
@@ -378,76 +501,54 @@ def process_client_hello(pkt):
     sni = sni.lower()
 
     # Write the SNI hostname to the `hostname` table of the database
-    created = False
-    with model.write_lock:
-        with model.db:
-            _, created = model.Hostname.get_or_create(
-                device_mac_addr=pkt[sc.Ether].src,
-                hostname=sni,
-                ip_addr=pkt[sc.IP].dst,
-                data_source='sni'
-            )
+    hostname_writer.add(pkt[sc.Ether].src, sni, {pkt[sc.IP].dst}, 'sni')
 
     # Write to local cache
-    with global_state.global_state_lock:
-        global_state.hostname_dict[pkt[sc.IP].dst] = sni
+    global_state.hostname_store.add(pkt[sc.IP].dst, sni, 'sni', ts=float(pkt.time))
 
-    if created:
-        common.log(f'[Pkt Processor] TLS: Device {pkt[sc.Ether].src}: {sni}')
 
 
 
-
-def process_retransmission(pkt):
+def process_retransmission(record):
     global seen_packets
-    # common.log(f"[Packet Processor] Processing packet for retransmission check SRC: \
-    #            {pkt[sc.IP].src} DST: {pkt[sc.IP].dst} \
-    #             SEQ: {pkt[sc.TCP].seq} ACK: {pkt[sc.TCP].ack}")
     if len(seen_packets) > 2000:
         # Keep the last 10% packets
         seen_packets = set(list(seen_packets)[-200:])  
 
-    try:
-        packet_hash = hash((pkt[sc.IP].src, pkt[sc.IP].dst, pkt[sc.TCP].seq, pkt[sc.TCP].ack))
-    except AttributeError:
+    if record.protocol != 'tcp':
         # If the packet is not TCP, we don't need to check for retransmission
         common.log(f"[Packet Processor] Not a TCP packet - retransmission check skipped")
         return False
-    
+
+    packet_hash = hash((record.src_ip, record.dst_ip, record.tcp_seq, record.tcp_ack))
+
     if packet_hash in seen_packets:
-        # common.log(f"[Packet Processor] Re-transmission detected SRC: \
-        #            {pkt[sc.IP].src} DST: {pkt[sc.IP].dst} \
-        #             SEQ: {pkt[sc.TCP].seq} ACK: {pkt[sc.TCP].ack}")
         return True
     else:
         seen_packets.add(packet_hash)
         return False
     
 
-def is_duplicate_udp(pkt):
+def is_duplicate_udp(record):
     global seen_packets
-    # common.log(f"[Packet Processor] Processing packet for duplicate UDP check {len(seen_packets)}")
     if len(seen_packets) > 2000:
         # Keep the last 10% packets
         seen_packets = set(list(seen_packets)[-200:])  
 
-    try:
-        if sc.UDP in pkt:
-            packet_hash = hash(
-                (pkt[sc.IP].src,
-                pkt[sc.IP].dst,
-                pkt[sc.UDP].sport, 
-                pkt[sc.UDP].dport, 
-                pkt.payload)
-            )
-    except AttributeError:
-        # If the packet is not TCP or UDP, we don't need to check for retransmission
-        common.log(f"[Packet Processor] Not a TCP or UDP packet - retransmission check skipped")
+    if record.protocol != 'udp':
+        # If the packet is not UDP, we don't need to check for duplicates
+        common.log(f"[Packet Processor] Not a UDP packet - duplicate check skipped")
         return False
 
+    packet_hash = hash(
+        (record.src_ip,
+        record.dst_ip,
+        record.src_port,
+        record.dst_port,
+        record.payload)
+    )
+
     if packet_hash in seen_packets:
-        # common.log(f"[Packet Processor] Duplicate UDP packet detected SRC: \
-        #            {pkt[sc.IP].src} DST: {pkt[sc.IP].dst} ")
         return True
     else:
         seen_packets.add(packet_hash)
@@ -462,17 +563,12 @@ def is_duplicate_udp(pkt):
 # BUG: process re-transmission and duplicate packets, potential cause of misclassification
 # ==========================================================================================
 
-def process_burst(pkt):
+def process_burst(record, ip_mac_dict=None):
     # Note: Packets must have TCP or UDP layer 
     # Note: WE only consider packets which has either TCP layer or UDP layer 
-    if sc.TCP in pkt:
-        protocol = 'TCP'
-        layer = sc.TCP
-    elif sc.UDP in pkt:
-        protocol = 'UDP'
-        layer = sc.UDP
-    else:
+    if not record.protocol:
         return
+    protocol = record.protocol.upper()
 
     # =================================================================
     # Parse packet informations
@@ -480,16 +576,16 @@ def process_burst(pkt):
     # frame_number = 0              # not useful for feature generation
     # time_delta = 0                # will be canculated lated
     # stream = 0                    # not useful for feature generation
-    time_epoch = pkt.time           # packet current time, to be used to generate time_delta for consecutive packets
-    frame_len = len(pkt)            # size of packet
-    ip_proto = pkt[sc.IP].proto     # protocol number: 6 (TCP), 17 (UDP)  
-    _ws_protocol = ''               # highest layer in the protocol
-    try:
-        highest_layer = pkt.lastlayer()
-        _ws_protocol = getattr(highest_layer, 'name', str(highest_layer))
-        # todo: check if highest layer captures the TLS versions; for now it is not 
-    except: 
-        _ws_protocol = protocol
+    time_epoch = record.ts          # packet current time, to be used to generate time_delta for consecutive packets
+    frame_len = record.length       # size of packet
+    ip_proto = record.ip_proto      # protocol number: 6 (TCP), 17 (UDP)  
+
+    # Highest layer in the protocol. Previously scapy's pkt.lastlayer().name;
+    # the burst features only keep DNS/DHCP/NTP/SSDP/MDNS from this field and
+    # fall back to TCP/UDP otherwise. DNS and DHCP never reach this function,
+    # and scapy names the others 'NTPHeader' / 'Raw', so the transport
+    # protocol yields the same features without dissecting the packet.
+    _ws_protocol = protocol
     
     # todo: set empty for now; useful for removing re/duplicate transmission
     _ws_expert = ""
@@ -497,20 +593,20 @@ def process_burst(pkt):
 
     if protocol == 'TCP':
         # Check for retransmission
-        if process_retransmission(pkt):
+        if process_retransmission(record):
             _ws_expert = "re-transmission"   
     # Check for duplicate UDP packets
     elif protocol == 'UDP':
-        if is_duplicate_udp(pkt):
+        if is_duplicate_udp(record):
             _ws_expert = "duplicate packet"            
 
     # Get MAC, IP addresses, port numbers 
-    src_mac_addr = pkt[sc.Ether].src
-    dst_mac_addr = pkt[sc.Ether].dst
-    src_ip_addr = pkt[sc.IP].src
-    dst_ip_addr = pkt[sc.IP].dst
-    src_port = pkt[layer].sport
-    dst_port = pkt[layer].dport
+    src_mac_addr = record.src_mac
+    dst_mac_addr = record.dst_mac
+    src_ip_addr = record.src_ip
+    dst_ip_addr = record.dst_ip
+    src_port = record.src_port
+    dst_port = record.dst_port
 
     # Note: Ignoring broscasting messes
     # Note: Maynot appropriate for anomaly detection 
@@ -528,15 +624,9 @@ def process_burst(pkt):
     # Find the actual MAC address that the Inspector host pretends to be if this is a 
     # local communication; otherwise, assume that Inspector pretends to be the gateway
     if src_mac_addr == inspector_host_mac_addr:
-        try:
-            src_mac_addr = global_state.arp_cache.get_mac_addr(src_ip_addr)
-        except KeyError:
-            src_mac_addr = ''
+        src_mac_addr = get_mac_addr(src_ip_addr, ip_mac_dict)
     elif dst_mac_addr == inspector_host_mac_addr:
-        try:
-            dst_mac_addr = global_state.arp_cache.get_mac_addr(dst_ip_addr)
-        except KeyError:
-            dst_mac_addr = ''
+        dst_mac_addr = get_mac_addr(dst_ip_addr, ip_mac_dict)
     else:
         return
 
@@ -545,8 +635,9 @@ def process_burst(pkt):
     # BehavIoT Method: look DNS, SNI for hostnames; if found: return else: use dig -x ip_address 
     # todo Ask Danny: change inmemory to False; ask NYU to find host name
     # Note: Jakaria changed the friendly_organizer.get_hostname_from_ip_addr() function
-    src_hostname = friendly_organizer.get_hostname_from_ip_addr(src_ip_addr, in_memory_only=True)
-    dst_hostname = friendly_organizer.get_hostname_from_ip_addr(dst_ip_addr, in_memory_only=True)
+    # Use the hostnames that the IP addresses had when the packet was captured
+    src_hostname = friendly_organizer.get_hostname_from_ip_addr(src_ip_addr, in_memory_only=True, ts=time_epoch)
+    dst_hostname = friendly_organizer.get_hostname_from_ip_addr(dst_ip_addr, in_memory_only=True, ts=time_epoch)
 
 
     # Note: Key is different from IoT Inspector: inspector use different sets of 7 elements, different order
@@ -555,40 +646,40 @@ def process_burst(pkt):
     hostname = dst_hostname.lower()
 
     #  check if local packet or incoming packet 
-    if ipaddress.ip_address(dst_ip_addr).is_private and ipaddress.ip_address(src_ip_addr).is_private == False: # incoming packet 
+    if ip_classifier.is_private(dst_ip_addr) and ip_classifier.is_private(src_ip_addr) == False: # incoming packet 
         flow_key = (ip_proto, dst_ip_addr, dst_port, src_ip_addr, src_port, dst_mac_addr)
         hostname = src_hostname.lower()
 
-    if ipaddress.ip_address(dst_ip_addr).is_private and ipaddress.ip_address(src_ip_addr).is_private: # incoming local packet
-        if ipaddress.ip_address(dst_ip_addr) > ipaddress.ip_address(src_ip_addr):
+    if ip_classifier.is_private(dst_ip_addr) and ip_classifier.is_private(src_ip_addr): # incoming local packet
+        if ip_classifier.get_sort_key(dst_ip_addr) > ip_classifier.get_sort_key(src_ip_addr):
             flow_key = (ip_proto, dst_ip_addr, dst_port, src_ip_addr, src_port, dst_mac_addr)
             hostname = src_hostname.lower()
 
     # todo: remove duplicate packets (behavIoT used WS comments to identify dupalicate packets);
-    # get the start time for the burst (aka flow)
-    burst_start_time = burst_dict_start_time.setdefault(flow_key, time_epoch)  
-
-    # clean previously stored burst packets if threshold has been passed
-    if (time_epoch - burst_start_time) > BURST_WRITE_INTERVAL:
-        # clean temp dicts 
-        pop_time = burst_dict_start_time.pop(flow_key, 0)                       # start time of burst 
-        pop_burst = burst_dict_all_burst.pop((flow_key, burst_start_time), [])  # list if packets
+    # close the burst (aka flow) of this packet if threshold has been passed,
+    # so that this packet starts a new one
+    burst_start_time = burst_table.get_start_ts(flow_key)
+    if burst_start_time is not None and (time_epoch - burst_start_time) > BURST_WRITE_INTERVAL:
+        pop_time, pop_burst = burst_table.pop(flow_key)
 
         # writing burst in file/db
         process_pending_burst(flow_key, pop_time, pop_burst)
 
-    # append the current packet with burst packets 
-    burst_dict_all_burst.setdefault((flow_key, burst_start_time), []).append([time_epoch, frame_len, _ws_protocol, hostname, ip_proto, src_ip_addr, src_port, dst_ip_addr, dst_port, dst_mac_addr])
-
-    # clear all the burst if current time pass the threshold
-    for key in burst_dict_all_burst:
-        if (time_epoch - key[1]) > BURST_WRITE_INTERVAL:
-            # clean temp dicts 
-            pop_time = burst_dict_start_time.pop(key[0], 0)
-            pop_burst = burst_dict_all_burst.pop((key[0], key[1]), [])
-
+    # add the current packet to the burst's running statistics
+    burst = burst_table.get(flow_key)
+    if burst is None:
+        burst = BurstAccumulator(flow_key)
+        burst_table.open(flow_key, time_epoch, burst)
+    burst.add(time_epoch, frame_len, _ws_protocol, hostname, ip_proto, src_ip_addr, dst_ip_addr, dst_mac_addr)
+
+    # clear all the bursts that started more than the threshold before the current time
+    expired_burst_list = burst_table.pop_expired(time_epoch, BURST_WRITE_INTERVAL)
+    if sum(pop_burst.packet_count for _, _, pop_burst in expired_burst_list) >= BURST_BATCH_MIN_PACKETS:
+        process_pending_burst_batch(expired_burst_list)
+    else:
+        for pop_flow_key, pop_time, pop_burst in expired_burst_list:
             # writing burst in file/db
-            process_pending_burst(key[0], pop_time, pop_burst)
+            process_pending_burst(pop_flow_key, pop_time, pop_burst)
     return 
     
 
@@ -602,155 +693,54 @@ def process_burst(pkt):
 # todo: check if this function needs to be running in a separate thread 
 # todo: because it will need to run in a separate thread to write the burst features to the database
 # process a burst from the queue to extract features
-def process_pending_burst(flow_key, pop_time, pop_burst):
+def process_pending_burst(flow_key, pop_time, burst, numeric_features=None):
     # log the burst information
     # todo: remove log if not needed 
-    common.log(f'[Writing Burst]: {flow_key} \t {pop_time} \t {pop_burst}')
-
-    # create a header for storing the burst into a dataframe corresponding to burst element
-    # [time_epoch, frame_len, _ws_protocol, hostname, ip_proto, src_ip_addr, src_port, dst_ip_addr, dst_port, dst_mac_addr]
-    header = ["ts","frame_len","protocol","host", "trans_proto", "ip_src", "srcport", "ip_dst", "dstport","mac_addr"]
+    common.log(f'[Writing Burst]: {flow_key} \t {pop_time} \t {burst.packet_count} packets')
 
     # check number of packets in the burst discart if 
     # burst has only one packet
-    if len(pop_burst) < 2: 
+    if burst.packet_count < 2: 
         return
-    
+
     # ----------------------------------------------------
-    # compute features from burst of packetes and flow key
+    # compute features from the burst's running statistics
     # ----------------------------------------------------
-    pd_burst = pd.DataFrame(pop_burst, columns=header)
-    pd_burst.frame_len = pd_burst.frame_len.astype(int)
-    pd_burst.ts = pd_burst.ts.astype(float)
-
-    # Calculate the time difference (delta) between consecutive rows and
-    # Set the first value of time_delta to 0
-    pd_burst['ts_delta'] = pd_burst['ts'].diff()
-    pd_burst.loc[0, 'ts_delta'] = 0.0      
-    pd_burst.ts_delta = pd_burst.ts_delta.astype(float)
-
-    # compute_tbp_features
-    start_time = pd_burst.ts.min()
-    meanBytes = pd_burst.frame_len.mean()
-    minBytes = pd_burst.frame_len.min()
-    maxBytes = pd_burst.frame_len.max()
-    medAbsDev = robust.mad(pd_burst.frame_len)
-    if medAbsDev < 1e-10:
-        skewL = 0
-        kurtL = 0
-    else:
-        skewL = skew(pd_burst.frame_len)
-        kurtL = kurtosis(pd_burst.frame_len)
-
-    # p = [10, 20, 30, 40, 50, 60, 70, 80, 90]
-    # percentiles = np.percentile(pd_burst.frame_len, p)
-    meanTBP = pd_burst.ts_delta.mean()
-    varTBP = pd_burst.ts_delta.var()
-    medTBP = pd_burst.ts_delta.median()
-    if varTBP < 1e-10:
-        kurtT = 0
-        skewT = 0
-    else:
-        kurtT = kurtosis(pd_burst.ts_delta)
-        skewT = skew(pd_burst.ts_delta)
-
-    # compute # of packet related features
-    network_in = 0 # Network going to target device.
-    network_out = 0 # Network going from target device 
-    # network_both = 0 # Network going to/from target device.
-    network_external = 0 # Network not going to just 192.168.10.248.
-    network_local = 0
-    network_in_local = 0 # 
-    network_out_local = 0 #
-    # anonymous_source_destination = 0
-    network_total = 0
-    meanBytes_out_external = 0 
-    meanBytes_in_external = 0 
-    meanBytes_out_local = 0 
-    meanBytes_in_local = 0 
-
-    # target devices meta information 
-    my_device_mac = flow_key[-1]
-    my_device_addr = flow_key[1]
-    external_destination_addr = flow_key[3]
-    local_destination_device = ''
-
-    # todo: check if not needed ; updated values with known knowledge above 
-
-    for j, m in zip(pd_burst.ip_dst, pd_burst.mac_addr):
-        if m == my_device_mac:
-            continue
-        elif ipaddress.ip_address(j).is_private==True:  # router IPs
-            local_destination_device = m
-            break
-    
-
-    for i, j, f_len, k_host in zip(pd_burst.ip_src, pd_burst.ip_dst, pd_burst.frame_len, pd_burst.host):
-        network_total += 1
-        
-        if ipaddress.ip_address(i).is_private==True and (ipaddress.ip_address(j).is_private==False): # source addr; outbound packet 
-            network_out += 1
-            network_external += 1
-            meanBytes_out_external += f_len
-            
-        elif ipaddress.ip_address(j).is_private==True and (ipaddress.ip_address(i).is_private==False): # destation addr; inbound packet 
-            network_in += 1
-            network_external += 1
-            meanBytes_in_external += f_len
-
-        elif i == my_device_addr and (ipaddress.ip_address(j).is_private==True) : # local outgoing packet 
-            network_out_local += 1
-            network_local += 1
-            meanBytes_out_local+= f_len
-
-        elif (ipaddress.ip_address(i).is_private==True) and j == my_device_addr: # local inbound packet 
-            network_in_local += 1
-            network_local += 1
-            meanBytes_in_local += f_len
-
-        elif k_host == '(local network)': 
-            network_local += 1           
-        else:
-            pass
-
-    meanBytes_out_external = meanBytes_out_external/network_out if network_out else 0
-    meanBytes_in_external = meanBytes_in_external/network_in if network_in else 0
-    meanBytes_out_local = meanBytes_out_local/network_out_local if network_out_local else 0
-    meanBytes_in_local = meanBytes_in_local/network_in_local if network_in_local else 0
-
+    # meanBytes, ..., meanBytes_in_local; see burst_features.numeric_cols_feat
+    if numeric_features is None:
+        numeric_features = burst.get_numeric_features()
+    network_total = numeric_features[11]
+    network_local = numeric_features[15]
 
     # host is either from the host column, or the destination IP if host doesn't exist
-    hosts = set([ str(host) for i, host in enumerate(pd_burst.host.fillna("")) ])
-    protocol = set([str(proto) for i, proto in enumerate(pd_burst.protocol.fillna(""))])
+    hosts = set(burst.hosts)
+    protocol = set(burst.protocols)
 
     if ('DNS' in protocol) or ('DHCP' in protocol) or ('NTP' in protocol) or ('SSDP' in protocol) or ('MDNS' in protocol):
         pass
     else:
-        if pd_burst.trans_proto[0] == 6:
+        if burst.trans_proto == 6:
             protocol = set(['TCP'])
-        elif pd_burst.trans_proto[0] == 17:
+        elif burst.trans_proto == 17:
             protocol = set(['UDP'])
     if network_total == network_local: 
         # hosts = set(['local'])
-        hosts = set([str(local_destination_device)])
+        hosts = set([str(burst.local_destination_device)])
     
     host_output = ";".join([x for x in hosts if x!= ""])
     # merge hostnames
     if host_output.startswith('ec') and (host_output.endswith('compute.amazonaws.com') or host_output.endswith('compute-1.amazonaws.com')):
             host_output = '*.compute.amazonaws.com'
     if host_output == '':
-        if str(external_destination_addr) == '':
-            common.log(f'[Creating Feature]: host error {my_device_mac} \t {external_destination_addr}')
+        if str(burst.external_destination_addr) == '':
+            common.log(f'[Creating Feature]: host error {burst.my_device_mac} \t {burst.external_destination_addr}')
             # print('Error:', device_name, state, event)
             # exit(1)   # todo Jakaria commented this line
-        host_output = str(external_destination_addr)
+        host_output = str(burst.external_destination_addr)
 
-    d = [ meanBytes, minBytes, maxBytes, medAbsDev, skewL, 
-         kurtL, meanTBP, varTBP, medTBP, kurtT,
-         skewT, network_total, network_in, network_out, network_external, 
-         network_local, network_in_local, network_out_local, meanBytes_out_external, meanBytes_in_external, 
-         meanBytes_out_local, meanBytes_in_local, my_device_mac, 'unctrl', 'unctrl',
-         start_time, ";".join([x for x in protocol if x!= ""]), host_output ]
+    d = numeric_features + [
+         burst.my_device_mac, 'unctrl', 'unctrl',
+         burst.start_time, ";".join([x for x in protocol if x!= ""]), host_output ]
 
     store_burst_in_db(d)
 
@@ -758,10 +748,20 @@ def process_pending_burst(flow_key, pop_time, pop_burst):
         
     # todo: check datafrme before storing
     # todo: store data to somewhere
-    # todo: debug Error processing packet: dictionary changed size during iteration, check the log file for detail of the error
-    # make the dictionary operation lock safe
     # common.log(f'[Writing Feature]: {flow_key} \t {pop_time} \t {d}')
 
+# process many bursts that closed at the same time; same as calling
+# process_pending_burst() on each, but computes the features in one batch
+def process_pending_burst_batch(expired_burst_list):
+    # single-packet bursts are discarded by process_pending_burst()
+    burst_list = [burst for _, _, burst in expired_burst_list if burst.packet_count >= 2]
+    feature_iter = iter(get_numeric_features_batch(burst_list)) if burst_list else None
+
+    for flow_key, pop_time, burst in expired_burst_list:
+        numeric_features = next(feature_iter) if burst.packet_count >= 2 else None
+        process_pending_burst(flow_key, pop_time, burst, numeric_features)
+
+
 # store processed burst features (data) into database
 # input: a data point
 # output: None
@@ -771,12 +771,20 @@ def store_burst_in_db(data):
     """
     Adds a data to the data queue.
     """
+    # In a shard worker process, hand the burst back to the main process
+    if shard_result_queue[0] is not None:
+        shard_result_queue[0].put(('burst', data))
+        return
+
     with global_state.global_state_lock:
         if not global_state.is_inspecting:
             return
 
      # check if device is idle, if idle store in a separate
-    if global_state.devices_state.get(data[-6], {'is_idle': 0})['is_idle']:
+    is_idle = global_state.devices_state.get(data[-6], {'is_idle': 0})['is_idle']
+    parquet_archive.add_burst(data, bool(is_idle))
+
+    if is_idle:
         # @idle_burst_processor.py stores the idle burst in CSV file
         global_state.idle_burst_queue.put(data)
 
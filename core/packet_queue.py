@@ -0,0 +1,182 @@
+"""
+A bounded packet queue with configurable overload policies.
+
+Drop-in replacement for the `queue.Queue` that holds captured packets. When
+the packet processor falls behind, one of the following policies applies:
+
+- 'drop_oldest': when full, discard the oldest queued packet to make room.
+- 'drop_newest': when full, discard the incoming packet.
+- 'sample': once the queue is above the high-water mark, keep only 1 in
+  `sample_rate` packets of each flow. Every kept packet carries a weight of
+  `sample_rate` so that flow byte/packet counts can be scaled back up. If the
+  queue still fills up, the incoming packet is discarded.
+- 'block': when full, the producer waits for room (i.e., the backpressure is
+  pushed to the capture layer).
+
+Exact drop counters are kept per policy; see `get_stats()`.
+
+"""
+import collections
+import queue
+import struct
+import threading
+import time
+import core.packet_parser as packet_parser
+
+
+POLICIES = ('drop_oldest', 'drop_newest', 'sample', 'block')
+
+# Forget per-flow sampling counters once this many flows are tracked
+_MAX_SAMPLED_FLOWS = 65536
+
+_PORTS = struct.Struct('!HH')
+
+
+class BoundedPacketQueue(object):
+
+    def __init__(self, maxsize=100000, policy='drop_oldest', high_water_mark=None, sample_rate=10):
+
+        if policy not in POLICIES:
+            raise ValueError('Unknown packet queue policy: %s' % policy)
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.high_water_mark = maxsize * 8 // 10 if high_water_mark is None else high_water_mark
+        self.sample_rate = sample_rate
+
+        # Holds (packet, weight) tuples
+        self._deque = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+        # Maps a flow key to the number of packets seen while sampling
+        self._sample_counter_dict = {}
+
+        self._stat_dict = {
+            'enqueued': 0,
+            'drop_oldest': 0,
+            'drop_newest': 0,
+            'sampled_out': 0,
+            'max_depth': 0
+        }
+
+    def put(self, pkt, block=True, timeout=None):
+        """Adds a packet to the queue, subject to the overload policy."""
+
+        with self._lock:
+
+            depth = len(self._deque)
+            weight = 1
+
+            if self.policy == 'sample' and depth >= self.high_water_mark:
+                weight = self._sample(pkt)
+                if weight == 0:
+                    self._stat_dict['sampled_out'] += 1
+                    return
+            elif self.policy == 'sample' and self._sample_counter_dict:
+                # Back below the high-water mark
+                self._sample_counter_dict.clear()
+
+            if depth >= self.maxsize:
+                if self.policy == 'drop_oldest':
+                    self._deque.popleft()
+                    self._stat_dict['drop_oldest'] += 1
+                elif self.policy == 'block' and block:
+                    if not self._not_full.wait_for(lambda: len(self._deque) < self.maxsize, timeout):
+                        raise queue.Full
+                else:
+                    self._stat_dict['drop_newest'] += 1
+                    return
+
+            self._deque.append((pkt, weight))
+            self._stat_dict['enqueued'] += 1
+            self._stat_dict['max_depth'] = max(self._stat_dict['max_depth'], len(self._deque))
+            self._not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        """Removes and returns a packet; raises queue.Empty on timeout."""
+
+        return self.get_with_weight(block, timeout)[0]
+
+    def get_with_weight(self, block=True, timeout=None):
+        """
+        Removes and returns a (packet, weight) tuple, where weight is the
+        number of captured packets that this packet stands for.
+
+        """
+        with self._lock:
+            if not self._deque:
+                if not block or not self._not_empty.wait_for(lambda: self._deque, timeout):
+                    raise queue.Empty
+            item = self._deque.popleft()
+            self._not_full.notify()
+            return item
+
+    def get_batch(self, max_items, max_wait=0.01):
+        """
+        Removes and returns up to `max_items` (packet, weight) tuples in one
+        go. Blocks until at least one packet is available, then keeps
+        collecting until `max_items` packets or `max_wait` seconds have passed.
+
+        """
+        batch = []
+
+        with self._lock:
+            self._not_empty.wait_for(lambda: self._deque)
+            deadline = time.time() + max_wait
+            while len(batch) < max_items:
+                if not self._deque:
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or not self._not_empty.wait_for(lambda: self._deque, remaining):
+                        break
+                batch.append(self._deque.popleft())
+            self._not_full.notify_all()
+
+        return batch
+
+    def qsize(self) -> int:
+        with self._lock:
+            return len(self._deque)
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def get_stats(self) -> dict:
+        """Returns the current depth and the drop counters."""
+
+        with self._lock:
+            stat_dict = dict(self._stat_dict)
+            stat_dict['depth'] = len(self._deque)
+            stat_dict['dropped'] = stat_dict['drop_oldest'] + stat_dict['drop_newest'] + stat_dict['sampled_out']
+            return stat_dict
+
+    def _sample(self, pkt) -> int:
+        """
+        Returns the weight of the packet if it is kept under 1-in-N per-flow
+        sampling, or 0 if it should be discarded. Must hold the lock.
+
+        """
+        flow_key = get_flow_key(pkt)
+        count = self._sample_counter_dict.get(flow_key, 0)
+        if count == 0 and len(self._sample_counter_dict) >= _MAX_SAMPLED_FLOWS:
+            self._sample_counter_dict.clear()
+        self._sample_counter_dict[flow_key] = (count + 1) % self.sample_rate
+
+        return self.sample_rate if count == 0 else 0
+
+
+def get_flow_key(pkt):
+    """
+    Returns a cheap flow key for a scapy packet or a raw (frame, ts) tuple:
+    the IPv4 addresses, protocol and ports, as raw bytes.
+
+    """
+    frame = pkt[0] if isinstance(pkt, tuple) else getattr(pkt, 'original', None) or bytes(pkt)
+
+    try:
+        _, l3 = packet_parser.get_ether_type(frame)
+        ihl = (frame[l3] & 0x0f) * 4
+        return (bytes(frame[l3 + 9:l3 + 10]), bytes(frame[l3 + 12:l3 + 20]), _PORTS.unpack_from(frame, l3 + ihl))
+    except (IndexError, struct.error):
+        return bytes(frame[0:14])
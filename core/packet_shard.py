@@ -0,0 +1,292 @@
+"""
+Distributes packet processing across worker processes.
+
+The main process drains `global_state.packet_queue` and only reads the few
+header bytes needed to hash each raw frame on its 5-tuple to one of
+SHARD_COUNT worker processes; ARP frames are processed right away (see
+`packet_processor.preprocess_packet`), since they update the ARP cache. The
+hash is symmetric in the two endpoints, so both directions of a connection
+land in the same worker.
+
+Each worker parses its frames, owns its own `flow_dict` and burst state, and
+sends flows and burst features back to the main process over a shared results
+queue, where they are merged and written as usual. DHCP, DNS and TLS
+ClientHello frames are also handed back, as they update the devices and
+hostnames, which only the main process writes.
+
+Every SHARD_STATE_INTERVAL seconds, workers get the changes to the ARP cache,
+the hostnames and this host's addresses since the previous update. Workers
+are started with SHARD_START_METHOD, so that they inherit neither the threads'
+locks nor the database connections of the main process. `stop_shards()` asks
+the workers for the flows they have not handed back yet and writes them.
+
+"""
+import multiprocessing
+import queue
+import struct
+import threading
+import time
+import traceback
+import core.global_state as global_state
+import core.common as common
+import core.networking as networking
+import core.packet_parser as packet_parser
+import core.packet_processor as packet_processor
+import core.flow_writer as flow_writer
+
+
+# Number of worker processes; 0 or 1 disables sharding, i.e., all packets are
+# processed by `packet_processor.process_packet` in a single thread.
+SHARD_COUNT = 0
+
+# How to start the worker processes; 'fork' would copy the locks held by the
+# main process's threads into the workers
+SHARD_START_METHOD = 'spawn'
+
+# How many packets to send to a worker at once, and the longest time (in
+# seconds) to wait for a full batch
+SHARD_BATCH_SIZE = 256
+SHARD_BATCH_TIMEOUT = 0.05
+
+# Maximum number of pending batches per worker
+SHARD_QUEUE_SIZE = 256
+
+# How often to send the changes to the ARP cache and hostnames to the workers (in seconds)
+SHARD_STATE_INTERVAL = 1
+
+# How long to wait for the workers to hand back their flows when stopping (in seconds)
+SHARD_STOP_TIMEOUT = 5
+
+# Per-worker input queues and processes; populated by start_shards()
+_shard_queue_list = []
+_shard_process_list = []
+
+# Queue of ('flows', flow_dict), ('burst', data), ('control', (kind, frame, ts))
+# and ('stopped', shard_ix) messages from the workers
+_result_queue = [None]
+
+# State last sent to the workers
+_sync_state_dict = {
+    'last_sync_ts': 0,
+    'hostname_change_count': 0,
+    'arp_dict': {},
+    'host_addr': None
+}
+
+# Set once every worker has handed back its flows after stop_shards()
+_stopped_shard_set = set()
+_all_stopped_event = threading.Event()
+
+
+def is_enabled() -> bool:
+    """Returns True if packets are processed by worker processes."""
+
+    return SHARD_COUNT > 1
+
+
+def start_shards():
+    """Starts SHARD_COUNT worker processes and the result collector thread."""
+
+    context = multiprocessing.get_context(SHARD_START_METHOD)
+
+    result_queue = context.Queue()
+    _result_queue[0] = result_queue
+
+    for shard_ix in range(SHARD_COUNT):
+        shard_queue = context.Queue(maxsize=SHARD_QUEUE_SIZE)
+        process = context.Process(
+            target=_shard_worker,
+            args=(shard_ix, shard_queue, result_queue),
+            daemon=True
+        )
+        process.start()
+        _shard_queue_list.append(shard_queue)
+        _shard_process_list.append(process)
+
+    common.SafeLoopThread(collect_shard_results, sleep_time=0)
+    common.log(f'[Packet Shard] Started {SHARD_COUNT} packet processing workers')
+
+
+def get_shard_ix(frame) -> int:
+    """Returns the worker index for a raw frame, based on its 5-tuple."""
+
+    try:
+        ether_type, l3 = packet_parser.get_ether_type(frame)
+        if ether_type != packet_parser.ETHER_TYPE_IPV4:
+            return 0
+        ip_proto = frame[l3 + 9]
+        src_ip = bytes(frame[l3 + 12:l3 + 16])
+        dst_ip = bytes(frame[l3 + 16:l3 + 20])
+        src_port = dst_port = b''
+        frag_offset, = struct.unpack_from('!H', frame, l3 + 6)
+        if ip_proto in (packet_parser.IP_PROTO_TCP, packet_parser.IP_PROTO_UDP) and not frag_offset & 0x1fff:
+            l4 = l3 + (frame[l3] & 0x0f) * 4
+            src_port = bytes(frame[l4:l4 + 2])
+            dst_port = bytes(frame[l4 + 2:l4 + 4])
+    except (IndexError, struct.error):
+        return 0
+
+    endpoint_a = (src_ip, src_port)
+    endpoint_b = (dst_ip, dst_port)
+    if endpoint_b < endpoint_a:
+        endpoint_a, endpoint_b = endpoint_b, endpoint_a
+
+    return hash((ip_proto, endpoint_a, endpoint_b)) % len(_shard_queue_list)
+
+
+def dispatch_packets():
+    """
+    Takes a batch of packets off the packet queue and forwards each raw frame
+    to its worker.
+
+    Replaces `packet_processor.process_packet` when sharding is enabled.
+
+    """
+    if time.time() - _sync_state_dict['last_sync_ts'] > SHARD_STATE_INTERVAL:
+        _send_state()
+        _sync_state_dict['last_sync_ts'] = time.time()
+
+    batch = global_state.packet_queue.get_batch(SHARD_BATCH_SIZE, SHARD_BATCH_TIMEOUT)
+
+    shard_batch_list = [[] for _ in _shard_queue_list]
+
+    for pkt, weight in batch:
+        if isinstance(pkt, tuple):
+            frame, ts = pkt
+        else:
+            frame, ts = getattr(pkt, 'original', None) or bytes(pkt), float(pkt.time)
+
+        if packet_parser.is_arp_frame(frame):
+            try:
+                packet_processor.preprocess_packet(pkt, weight)
+            except Exception as e:
+                common.log('[Packet Shard] Error processing packet: ' + str(e) + '\n' + traceback.format_exc())
+            continue
+
+        shard_batch_list[get_shard_ix(frame)].append((bytes(frame), ts, weight))
+
+    for shard_ix, shard_batch in enumerate(shard_batch_list):
+        if shard_batch:
+            _shard_queue_list[shard_ix].put(('frames', shard_batch))
+
+
+def _send_state():
+    """Sends the changes to the ARP cache, the hostnames and this host's addresses to every worker."""
+
+    arp_dict = global_state.arp_cache.snapshot()
+    arp_delta_dict = {
+        ip_addr: mac_addr for ip_addr, mac_addr in arp_dict.items()
+        if _sync_state_dict['arp_dict'].get(ip_addr) != mac_addr
+    }
+
+    change_count, hostname_delta_dict = global_state.hostname_store.get_changes(_sync_state_dict['hostname_change_count'])
+
+    with global_state.global_state_lock:
+        host_addr = (global_state.host_ip_addr, global_state.host_mac_addr)
+
+    if not arp_delta_dict and not hostname_delta_dict and host_addr == _sync_state_dict['host_addr']:
+        return
+
+    for shard_queue in _shard_queue_list:
+        shard_queue.put(('state', (host_addr, arp_delta_dict, hostname_delta_dict)))
+
+    _sync_state_dict['arp_dict'] = arp_dict
+    _sync_state_dict['hostname_change_count'] = change_count
+    _sync_state_dict['host_addr'] = host_addr
+
+
+def collect_shard_results():
+    """Merges flows, bursts and control packets from the workers into the main process."""
+
+    msg_type, payload = _result_queue[0].get()
+
+    if msg_type == 'flows':
+        packet_processor.merge_flows(payload)
+    elif msg_type == 'burst':
+        packet_processor.store_burst_in_db(payload)
+    elif msg_type == 'control':
+        try:
+            packet_processor.process_control_packet(*payload)
+        except Exception as e:
+            common.log('[Packet Shard] Error processing control packet: ' + str(e) + '\n' + traceback.format_exc())
+    elif msg_type == 'stopped':
+        _stopped_shard_set.add(payload)
+        if len(_stopped_shard_set) == len(_shard_queue_list):
+            _all_stopped_event.set()
+
+    if time.time() - packet_processor.flow_dict_last_db_write_ts['_'] > packet_processor.FLOW_WRITE_INTERVAL:
+        packet_processor.write_pending_flows_to_db()
+        packet_processor.flow_dict_last_db_write_ts['_'] = time.time()
+
+
+def stop_shards():
+    """Asks the workers to stop and writes the flows they have not handed back yet."""
+
+    if not _shard_queue_list:
+        return
+
+    for shard_queue in _shard_queue_list:
+        shard_queue.put(('stop', None))
+
+    if not _all_stopped_event.wait(SHARD_STOP_TIMEOUT):
+        common.log('[Packet Shard] Timed out waiting for the workers to stop; some flows may be lost')
+
+    for process in _shard_process_list:
+        process.join(timeout=1)
+
+    pending_flow_dict = packet_processor.swap_flow_dict()
+    if pending_flow_dict:
+        flow_writer.write_flows_to_db(pending_flow_dict)
+
+    common.log('[Packet Shard] Stopped the packet processing workers')
+
+
+def _shard_worker(shard_ix, shard_queue, result_queue):
+    """Entry point of a worker process."""
+
+    global_state.arp_cache = networking.ARPCache(load_from_db=False)
+    packet_processor.shard_result_queue[0] = result_queue
+
+    last_flow_flush_ts = time.time()
+
+    while True:
+
+        try:
+            msg_type, payload = shard_queue.get(timeout=packet_processor.FLOW_WRITE_INTERVAL)
+        except queue.Empty:
+            msg_type, payload = None, None
+
+        try:
+            if msg_type == 'frames':
+                for frame, ts, weight in payload:
+                    record = packet_processor.preprocess_packet((frame, ts), weight)
+                    if record is None:
+                        continue
+                    try:
+                        packet_processor.process_burst(record)
+                    except Exception as e:
+                        common.log(f'[Packet Shard {shard_ix}] Error processing burst: ' + str(e) + '\n' + traceback.format_exc())
+                    packet_processor.process_flow(record)
+
+            elif msg_type == 'state':
+                (host_ip_addr, host_mac_addr), arp_delta_dict, hostname_delta_dict = payload
+                global_state.host_ip_addr = host_ip_addr
+                global_state.host_mac_addr = host_mac_addr
+                for ip_addr, mac_addr in arp_delta_dict.items():
+                    global_state.arp_cache.update(ip_addr, mac_addr)
+                global_state.hostname_store.merge(hostname_delta_dict)
+
+        except Exception as e:
+            common.log(f'[Packet Shard {shard_ix}] Error processing message: ' + str(e) + '\n' + traceback.format_exc())
+
+        if msg_type == 'stop':
+            if packet_processor.flow_dict:
+                result_queue.put(('flows', packet_processor.swap_flow_dict()))
+            result_queue.put(('stopped', shard_ix))
+            return
+
+        # Hand the flows accumulated so far back to the main process
+        if time.time() - last_flow_flush_ts > packet_processor.FLOW_WRITE_INTERVAL:
+            if packet_processor.flow_dict:
+                result_queue.put(('flows', packet_processor.swap_flow_dict()))
+            last_flow_flush_ts = time.time()
@@ -0,0 +1,318 @@
+"""
+Archives flows and burst feature vectors as Parquet files for offline
+analysis and model retraining.
+
+Every ARCHIVE_INTERVAL seconds, `run()` writes
+- the flows of every hour that ended more than ARCHIVE_DELAY seconds ago (so
+  that their hostnames have been filled in) to
+  ARCHIVE_DIRECTORY/flows/date=YYYY-MM-DD/hour=HH.parquet, and
+- the burst feature vectors collected by `add_burst()` since the last run
+  (both the bursts for prediction and the idle bursts that also go to the
+  idle-data CSV files) to ARCHIVE_DIRECTORY/bursts/date=YYYY-MM-DD/<ts>.parquet.
+The idle-data CSV files of earlier runs are imported once.
+
+MAC address, hostname and other repetitive string columns are dictionary
+encoded. `read_flows()` and `read_bursts()` only read the requested columns,
+the date partitions of the requested time range and the row groups whose
+statistics match it:
+
+table = parquet_archive.read_flows(['end_ts', 'src_device_mac_addr', 'byte_count'], start_ts=..., end_ts=...)
+df = table.to_pandas()
+
+"""
+import collections
+import datetime
+import glob
+import os
+import shutil
+import threading
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import core.common as common
+import core.config as config
+import core.flow_shard as flow_shard
+import core.model as model
+from core.burst_features import numeric_cols_feat
+
+
+# How often to archive (in seconds)
+ARCHIVE_INTERVAL = 3600
+
+# Only archive the flows that ended at least this many seconds ago
+ARCHIVE_DELAY = 600
+
+ARCHIVE_DIRECTORY = os.path.join(common.get_project_directory(), 'archive')
+
+# Maximum number of bursts to hold between runs; older ones are dropped
+ARCHIVE_BURST_BUFFER_SIZE = 200000
+
+ARCHIVE_ROW_GROUP_SIZE = 65536
+
+FLOW_COLUMN_LIST = [
+    field.name for field in model.Flow._meta.sorted_fields if field.name != 'id'
+]
+
+BURST_COLUMN_LIST = numeric_cols_feat + ['device', 'state', 'event', 'start_time', 'protocol', 'hosts']
+
+FLOW_SCHEMA = pa.schema([
+    (field.name, pa.float64() if isinstance(field, model.FloatField) else
+                 pa.int64() if isinstance(field, model.IntegerField) else
+                 pa.string())
+    for field in model.Flow._meta.sorted_fields if field.name != 'id'
+])
+
+BURST_SCHEMA = pa.schema(
+    [(col, pa.float64()) for col in numeric_cols_feat] + [
+        ('device', pa.string()),
+        ('state', pa.string()),
+        ('event', pa.string()),
+        ('start_time', pa.float64()),
+        ('protocol', pa.string()),
+        ('hosts', pa.string()),
+        ('is_idle', pa.bool_()),
+    ]
+)
+
+# Columns to dictionary-encode
+FLOW_DICTIONARY_COLUMN_LIST = [
+    col for col in FLOW_COLUMN_LIST
+    if col.endswith(('_mac_addr', '_ip_addr', '_hostname', '_reg_domain', '_tracker_company', '_country')) or col == 'protocol'
+]
+BURST_DICTIONARY_COLUMN_LIST = ['device', 'state', 'event', 'protocol', 'hosts']
+
+_burst_lock = threading.Lock()
+
+# (burst data, is_idle) tuples collected since the last run
+_burst_buffer = collections.deque(maxlen=ARCHIVE_BURST_BUFFER_SIZE)
+
+# Bursts that closed before this time are only in the idle-data CSV files
+_burst_buffer_start_ts = time.time()
+
+_stat_lock = threading.Lock()
+
+_stat_dict = {
+    'archived_flows': 0,
+    'archived_bursts': 0,
+    'imported_idle_bursts': 0,
+    'last_run_duration': 0,
+}
+
+
+def add_burst(data, is_idle):
+    """Collects a burst feature vector (see packet_processor.store_burst_in_db) for the archive."""
+
+    with _burst_lock:
+        _burst_buffer.append((data, is_idle))
+
+
+def run():
+    """Archives the flows of the hours that have ended and the collected bursts."""
+
+    start_ts = time.time()
+
+    import_idle_csv_files()
+    flow_count = archive_flows(start_ts - ARCHIVE_DELAY)
+    burst_count = archive_bursts()
+
+    duration = time.time() - start_ts
+    with _stat_lock:
+        _stat_dict['archived_flows'] += flow_count
+        _stat_dict['archived_bursts'] += burst_count
+        _stat_dict['last_run_duration'] = duration
+
+    common.log(f'[Parquet Archive] Archived {flow_count} flows and {burst_count} bursts in {duration:.3f} seconds')
+
+
+def get_stats() -> dict:
+
+    with _stat_lock:
+        return dict(_stat_dict)
+
+
+def delete_archive():
+    """Deletes the archive and the collected bursts, e.g., when the local data is reset."""
+
+    with _burst_lock:
+        _burst_buffer.clear()
+
+    shutil.rmtree(ARCHIVE_DIRECTORY, ignore_errors=True)
+
+    # The idle-data CSV files hold bursts from before the reset; do not import them again
+    config.set('archive_idle_csv_imported', True)
+
+
+def _get_date(ts) -> str:
+
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime('%Y-%m-%d')
+
+
+def _write_table(table, path, dictionary_column_list):
+    """Writes a table to a Parquet file atomically."""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    pq.write_table(
+        table,
+        temp_path,
+        use_dictionary=dictionary_column_list,
+        row_group_size=ARCHIVE_ROW_GROUP_SIZE,
+        compression='zstd'
+    )
+    os.replace(temp_path, path)
+
+
+def archive_flows(until_ts) -> int:
+    """Archives the flows of each whole hour that ended before `until_ts`; returns the number of flows."""
+
+    hour_start_ts = config.get('archive_flow_end_ts', 0)
+    if hour_start_ts == 0:
+        # Start with the hour of the oldest flow
+        oldest_end_ts_list = []
+        for flow_db in flow_shard.get_flow_databases():
+            with flow_db:
+                oldest_end_ts = model.Flow.select(model.fn.MIN(model.Flow.end_ts)).scalar(flow_db)
+            if oldest_end_ts is not None:
+                oldest_end_ts_list.append(oldest_end_ts)
+        if not oldest_end_ts_list:
+            return 0
+        hour_start_ts = int(min(oldest_end_ts_list)) // 3600 * 3600
+
+    flow_count = 0
+
+    while hour_start_ts + 3600 <= until_ts:
+
+        hour_end_ts = hour_start_ts + 3600
+        column_dict = {col: [] for col in FLOW_COLUMN_LIST}
+
+        for flow_db in flow_shard.get_flow_databases(hour_start_ts, hour_end_ts):
+            with flow_db:
+                query = model.Flow.select(*[getattr(model.Flow, col) for col in FLOW_COLUMN_LIST]).where(
+                    (model.Flow.end_ts >= hour_start_ts) & (model.Flow.end_ts < hour_end_ts)
+                ).order_by(model.Flow.end_ts).tuples()
+                for row in query.execute(flow_db):
+                    for col, value in zip(FLOW_COLUMN_LIST, row):
+                        column_dict[col].append(value)
+
+        row_count = len(column_dict['end_ts'])
+        if row_count:
+            hour_path = os.path.join(
+                ARCHIVE_DIRECTORY, 'flows', 'date=' + _get_date(hour_start_ts),
+                'hour={:02d}.parquet'.format(datetime.datetime.fromtimestamp(hour_start_ts, datetime.timezone.utc).hour)
+            )
+            _write_table(pa.Table.from_pydict(column_dict, schema=FLOW_SCHEMA), hour_path, FLOW_DICTIONARY_COLUMN_LIST)
+            flow_count += row_count
+
+        hour_start_ts = hour_end_ts
+        config.set('archive_flow_end_ts', hour_start_ts)
+
+    return flow_count
+
+
+def _write_bursts(row_list, name) -> int:
+    """Writes burst rows (lists of BURST_SCHEMA values) into the partitions of their dates."""
+
+    # Maps date -> rows
+    date_row_dict = {}
+    start_time_ix = BURST_SCHEMA.get_field_index('start_time')
+    for row in row_list:
+        date_row_dict.setdefault(_get_date(row[start_time_ix]), []).append(row)
+
+    for date, date_row_list in date_row_dict.items():
+        table = pa.Table.from_pylist(
+            [dict(zip(BURST_SCHEMA.names, row)) for row in date_row_list],
+            schema=BURST_SCHEMA
+        )
+        path = os.path.join(ARCHIVE_DIRECTORY, 'bursts', 'date=' + date, name + '.parquet')
+        _write_table(table, path, BURST_DICTIONARY_COLUMN_LIST)
+
+    return len(row_list)
+
+
+def _to_burst_row(data, is_idle) -> list:
+
+    row = [float(value) for value in data[:len(numeric_cols_feat)]]
+    device, state, event, start_time, protocol, hosts = data[len(numeric_cols_feat):]
+    return row + [str(device), str(state), str(event), float(start_time), str(protocol), str(hosts), is_idle]
+
+
+def archive_bursts() -> int:
+    """Archives the bursts collected since the last run; returns the number of bursts."""
+
+    with _burst_lock:
+        burst_list = list(_burst_buffer)
+        _burst_buffer.clear()
+
+    if not burst_list:
+        return 0
+
+    return _write_bursts(
+        [_to_burst_row(data, is_idle) for data, is_idle in burst_list],
+        'part-{}'.format(int(time.time() * 1000))
+    )
+
+
+def import_idle_csv_files():
+    """Imports the idle bursts that earlier runs wrote to the idle-data CSV files; runs once."""
+
+    if config.get('archive_idle_csv_imported', False):
+        return
+
+    row_list = []
+    for csv_path in glob.glob(os.path.join(common.get_project_directory(), 'idle-data', '*.csv')):
+        idle_df = pd.read_csv(csv_path, dtype={col: str for col in BURST_DICTIONARY_COLUMN_LIST})
+        # Later bursts are collected by add_burst()
+        idle_df = idle_df[idle_df['start_time'] < _burst_buffer_start_ts]
+        row_list += [
+            _to_burst_row(row, True)
+            for row in idle_df[BURST_COLUMN_LIST].itertuples(index=False)
+        ]
+
+    if row_list:
+        _write_bursts(row_list, 'idle-data')
+
+    config.set('archive_idle_csv_imported', True)
+
+    with _stat_lock:
+        _stat_dict['imported_idle_bursts'] += len(row_list)
+
+
+def _read(name, columns, ts_col, start_ts, end_ts, filter_expr) -> pa.Table:
+
+    dataset_path = os.path.join(ARCHIVE_DIRECTORY, name)
+    if not os.path.isdir(dataset_path):
+        return None
+
+    dataset = ds.dataset(dataset_path, format='parquet', partitioning='hive')
+
+    # The date filters prune partitions; the timestamp filters prune row groups
+    if start_ts is not None:
+        start_expr = (ds.field('date') >= _get_date(start_ts)) & (ds.field(ts_col) >= start_ts)
+        filter_expr = start_expr if filter_expr is None else filter_expr & start_expr
+    if end_ts is not None:
+        end_expr = (ds.field('date') <= _get_date(end_ts)) & (ds.field(ts_col) < end_ts)
+        filter_expr = end_expr if filter_expr is None else filter_expr & end_expr
+
+    return dataset.to_table(columns=columns, filter=filter_expr)
+
+
+def read_flows(columns=None, start_ts=None, end_ts=None, filter_expr=None) -> pa.Table:
+    """
+    Returns the archived flows whose end_ts is in [start_ts, end_ts), with the
+    given columns (all if None). `filter_expr` is an optional
+    pyarrow.dataset expression, e.g. `ds.field('src_device_mac_addr') == mac`.
+    Returns None if nothing has been archived.
+
+    """
+    return _read('flows', columns, 'end_ts', start_ts, end_ts, filter_expr)
+
+
+def read_bursts(columns=None, start_ts=None, end_ts=None, filter_expr=None) -> pa.Table:
+    """
+    Returns the archived bursts whose start_time is in [start_ts, end_ts); see
+    `read_flows()`.
+
+    """
+    return _read('bursts', columns, 'start_time', start_ts, end_ts, filter_expr)
@@ -0,0 +1,274 @@
+"""
+Reverse-DNS (PTR) lookups of remote IP addresses that have no hostname.
+
+BehavIoT falls back to `dig -x` when neither DNS nor SNI gave a hostname for
+an IP address. Here, the IP addresses that add_hostname_info_to_flows() cannot
+resolve, and the NYU server has no hostname for (see core/hostname_resolver.py),
+are handed to `submit()`, which returns right away; a pool of
+PTR_RESOLVER_WORKERS threads sends the PTR queries, at most
+PTR_MAX_QUERIES_PER_SECOND of them. A hostname found is saved in
+global_state.hostname_store (unless the IP address got one from DNS or SNI in
+the meantime), so later bursts and flows pick it up, and is passed to
+`callback(ip_addr, hostname)`.
+
+Queries go to PTR_DNS_SERVER, or to the first nameserver in /etc/resolv.conf
+if it is None; the system resolver (socket.gethostbyaddr) is used if there is
+no such file, as on Windows. Answers are cached for the TTL of the record
+(within PTR_MIN_TTL and PTR_MAX_TTL), and IP addresses without a PTR record
+or whose query failed for PTR_NEGATIVE_TTL seconds.
+
+"""
+import collections
+import concurrent.futures
+import ipaddress
+import os
+import random
+import socket
+import threading
+import time
+from scapy.layers.dns import DNS, DNSQR
+import core.common as common
+import core.global_state as global_state
+
+
+# Number of threads that send queries
+PTR_RESOLVER_WORKERS = 4
+
+# Maximum query rate over all threads
+PTR_MAX_QUERIES_PER_SECOND = 20
+
+# Maximum number of IP addresses waiting for a query; others are dropped until the next submit
+PTR_MAX_PENDING = 4096
+
+# (host, port) of the DNS server; None to use the system's nameserver
+PTR_DNS_SERVER = None
+
+# Timeout per query (in seconds)
+PTR_TIMEOUT = 3
+
+# Bounds of the time (in seconds) to cache a hostname for
+PTR_MIN_TTL = 600
+PTR_MAX_TTL = 24 * 3600
+
+# How long to wait before querying again for an IP address without a hostname (in seconds)
+PTR_NEGATIVE_TTL = 1800
+
+# Maximum number of cached answers
+PTR_CACHE_SIZE = 65536
+
+RESOLV_CONF_PATH = '/etc/resolv.conf'
+
+DNS_TYPE_PTR = 12
+DNS_CLASS_IN = 1
+DNS_RCODE_NXDOMAIN = 3
+
+_lock = threading.Lock()
+
+_executor = [None]
+
+# IP addresses that are queued or being resolved
+_pending_ip_addr_set = set()
+
+# Maps IP address -> (hostname, expiry timestamp); the hostname is '' if not found
+_cache = collections.OrderedDict()
+
+# Earliest time of the next query
+_next_query_ts = [0]
+
+# Nameserver from /etc/resolv.conf, once read
+_system_dns_server = []
+
+_stat_dict = {
+    'queries': 0,
+    'resolved': 0,
+    'not_found': 0,
+    'failed': 0,
+    'dropped': 0,
+}
+
+
+def submit(ip_addr_list, callback=None) -> int:
+    """
+    Queues PTR lookups of IP addresses, skipping those that are pending or
+    cached; returns the number of IP addresses queued.
+
+    """
+    queued_count = 0
+    now = time.time()
+
+    with _lock:
+        if _executor[0] is None:
+            _executor[0] = concurrent.futures.ThreadPoolExecutor(
+                max_workers=PTR_RESOLVER_WORKERS,
+                thread_name_prefix='ptr_resolver'
+            )
+
+        for ip_addr in ip_addr_list:
+            if ip_addr in _pending_ip_addr_set:
+                continue
+            cached = _cache.get(ip_addr)
+            if cached is not None and cached[1] > now:
+                continue
+            if len(_pending_ip_addr_set) >= PTR_MAX_PENDING:
+                _stat_dict['dropped'] += 1
+                continue
+            _pending_ip_addr_set.add(ip_addr)
+            _executor[0].submit(_resolve_and_save, ip_addr, callback)
+            queued_count += 1
+
+    return queued_count
+
+
+def get_cached(ip_addr: str) -> str:
+    """Returns the cached hostname of an IP address; '' if it has none, None if unknown or expired."""
+
+    with _lock:
+        cached = _cache.get(ip_addr)
+
+    if cached is None or cached[1] <= time.time():
+        return None
+
+    return cached[0]
+
+
+def get_stats() -> dict:
+
+    with _lock:
+        return dict(_stat_dict, pending=len(_pending_ip_addr_set), cached=len(_cache))
+
+
+def _wait_for_rate_limit():
+    """Sleeps until the next query is allowed."""
+
+    with _lock:
+        now = time.time()
+        query_ts = max(now, _next_query_ts[0])
+        _next_query_ts[0] = query_ts + 1.0 / PTR_MAX_QUERIES_PER_SECOND
+
+    if query_ts > now:
+        time.sleep(query_ts - now)
+
+
+def _resolve_and_save(ip_addr, callback):
+    """Looks up the PTR record of an IP address on a worker thread and saves the answer."""
+
+    try:
+        _wait_for_rate_limit()
+        hostname = _resolve_and_cache(ip_addr)
+
+        # Hostnames from DNS or SNI take precedence
+        if hostname and global_state.hostname_store.add(ip_addr, hostname, 'ptr', only_if_missing=True):
+            if callback is not None:
+                callback(ip_addr, hostname)
+
+    except Exception as ex:
+        common.log(f'[PTR Resolver] Error: saving the hostname of {ip_addr} failed: {ex}')
+
+    finally:
+        with _lock:
+            _pending_ip_addr_set.discard(ip_addr)
+
+
+def _resolve_and_cache(ip_addr) -> str:
+    """Looks up the PTR record of an IP address and caches the answer; returns '' if not found."""
+
+    try:
+        hostname, ttl = resolve(ip_addr)
+        outcome = 'resolved' if hostname else 'not_found'
+    except Exception as ex:
+        common.log(f'[PTR Resolver] Error: query for {ip_addr} failed: {ex}')
+        hostname = ''
+        outcome = 'failed'
+
+    if hostname:
+        ttl = min(max(ttl, PTR_MIN_TTL), PTR_MAX_TTL)
+        # Add question mark to denote uncertainty, as for hostnames from the NYU server
+        hostname = hostname.rstrip('.') + '?'
+    else:
+        ttl = PTR_NEGATIVE_TTL
+
+    with _lock:
+        _stat_dict['queries'] += 1
+        _stat_dict[outcome] += 1
+        _cache[ip_addr] = (hostname, time.time() + ttl)
+        _cache.move_to_end(ip_addr)
+        while len(_cache) > PTR_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return hostname
+
+
+def resolve(ip_addr: str):
+    """Returns (hostname, ttl) of the PTR record of an IP address; hostname is '' if there is none."""
+
+    dns_server = PTR_DNS_SERVER or get_system_dns_server()
+    if dns_server is not None:
+        return query_ptr(ip_addr, dns_server)
+
+    # The system resolver does not report the TTL
+    try:
+        return socket.gethostbyaddr(ip_addr)[0], PTR_MIN_TTL
+    except (socket.herror, socket.gaierror):
+        return '', PTR_NEGATIVE_TTL
+
+
+def get_system_dns_server():
+    """Returns (host, 53) of the first nameserver in /etc/resolv.conf, or None."""
+
+    if not _system_dns_server:
+        dns_server = None
+        if os.path.exists(RESOLV_CONF_PATH):
+            with open(RESOLV_CONF_PATH) as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) >= 2 and fields[0] == 'nameserver':
+                        dns_server = (fields[1].split('%')[0], 53)
+                        break
+        _system_dns_server.append(dns_server)
+
+    return _system_dns_server[0]
+
+
+def get_ptr_name(ip_addr: str) -> str:
+    """Returns the reverse-lookup name of an IP address, e.g. 4.3.2.1.in-addr.arpa for 1.2.3.4."""
+
+    return ipaddress.ip_address(ip_addr).reverse_pointer
+
+
+def query_ptr(ip_addr, dns_server, timeout=None):
+    """Sends a PTR query for an IP address over UDP; returns (hostname, ttl), hostname being '' if not found."""
+
+    if timeout is None:
+        timeout = PTR_TIMEOUT
+
+    query_id = random.randrange(0x10000)
+    query = DNS(id=query_id, rd=1, qd=DNSQR(qname=get_ptr_name(ip_addr), qtype='PTR'))
+
+    family = socket.AF_INET6 if ':' in dns_server[0] else socket.AF_INET
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.sendto(bytes(query), dns_server)
+        deadline = time.time() + timeout
+        while True:
+            sock.settimeout(max(deadline - time.time(), 0.001))
+            response = DNS(sock.recvfrom(4096)[0])
+            if response.qr == 1 and response.id == query_id:
+                break
+
+    return parse_ptr_response(response)
+
+
+def parse_ptr_response(response):
+    """Returns (hostname, ttl) of the first PTR answer in a DNS response; hostname is '' if there is none."""
+
+    if response.rcode == DNS_RCODE_NXDOMAIN:
+        return '', PTR_NEGATIVE_TTL
+    if response.rcode != 0:
+        raise IOError(f'DNS response code {response.rcode}')
+
+    for ix in range(response.ancount):
+        record = response.an[ix]
+        if record.type == DNS_TYPE_PTR and record.rclass == DNS_CLASS_IN:
+            return record.rdata.decode('ascii', errors='replace').rstrip('.'), record.ttl
+
+    return '', PTR_NEGATIVE_TTL
@@ -15,7 +15,15 @@ import core.arp_scanner
 import core.arp_spoofer
 import core.packet_collector
 import core.packet_processor
+import core.flow_writer
+import core.flow_rollup
+import core.flow_retention
+import core.parquet_archive
+import core.hostname_writer
+import core.device_cache
+import core.packet_shard
 import core.friendly_organizer
+import core.hostname_resolver
 import core.data_donation
 import os
 
@@ -34,6 +42,12 @@ def start_threads():
     # Initialize the database
     core.common.log('Initializing the database')
     core.model.initialize_tables()
+    core.flow_retention.initialize()
+    core.flow_rollup.initialize()
+    core.friendly_organizer.load_hostname_store()
+
+    # Compile the tracker lists for get_tracker_company() if they changed
+    core.friendly_organizer.get_tracker_trie()
 
     # Initialize the networking variables
     core.common.log('Initializing the networking variables')
@@ -43,9 +57,22 @@ def start_threads():
     # Start various threads
     core.common.SafeLoopThread(core.arp_scanner.start_arp_scanner, sleep_time=5)
     core.common.SafeLoopThread(core.packet_collector.start_packet_collector, sleep_time=0)
-    core.common.SafeLoopThread(core.packet_processor.process_packet, sleep_time=0)
+    core.flow_writer.start()
+    core.common.SafeLoopThread(core.hostname_writer.flush, sleep_time=core.hostname_writer.HOSTNAME_FLUSH_INTERVAL)
+    core.common.SafeLoopThread(core.device_cache.flush, sleep_time=core.device_cache.DEVICE_FLUSH_INTERVAL)
+    core.common.SafeLoopThread(core.flow_retention.run, sleep_time=core.flow_retention.RETENTION_INTERVAL)
+    core.common.SafeLoopThread(core.parquet_archive.run, sleep_time=core.parquet_archive.ARCHIVE_INTERVAL)
+    if core.packet_shard.is_enabled():
+        core.packet_shard.start_shards()
+        core.common.SafeLoopThread(core.packet_shard.dispatch_packets, sleep_time=0)
+    elif core.packet_processor.PACKET_BATCH_SIZE > 1:
+        core.common.SafeLoopThread(core.packet_processor.process_packet_batch, sleep_time=0)
+    else:
+        core.common.SafeLoopThread(core.packet_processor.process_packet, sleep_time=0)
     core.common.SafeLoopThread(core.arp_spoofer.spoof_internet_traffic, sleep_time=5)
     core.common.SafeLoopThread(core.friendly_organizer.add_hostname_info_to_flows, sleep_time=5)
+    core.common.SafeLoopThread(core.hostname_resolver.run, sleep_time=0)
+    core.common.SafeLoopThread(core.friendly_organizer.save_hostname_store, sleep_time=core.friendly_organizer.HOSTNAME_STORE_SAVE_INTERVAL)
     core.common.SafeLoopThread(core.friendly_organizer.add_product_info_to_devices, sleep_time=5)
     core.common.SafeLoopThread(core.data_donation.start, sleep_time=15)
 
@@ -65,6 +92,7 @@ def start_threads():
 
 def clean_up():
 
+    core.packet_shard.stop_shards()
     core.networking.disable_ip_forwarding()
 
 
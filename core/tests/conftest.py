@@ -0,0 +1,35 @@
+import os
+import sys
+
+import peewee
+import pytest
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import core.model as model
+
+
+@pytest.fixture
+def test_db(request, tmp_path, monkeypatch):
+    """
+    Binds a list of models to a temporary SQLite database and makes it
+    model.db for the duration of a test.
+
+    The models are the test module's MODEL_LIST, unless the fixture is
+    parametrized indirectly with a model list; the database is opened with the
+    module's DB_PRAGMAS, if any.
+
+    """
+    model_list = getattr(request, 'param', None) or request.module.MODEL_LIST
+    original_db = model.db
+
+    db = peewee.SqliteDatabase(str(tmp_path / 'test.sqlite3'), pragmas=getattr(request.module, 'DB_PRAGMAS', None))
+    db.bind(model_list)
+    db.create_tables(model_list)
+    monkeypatch.setattr(model, 'db', db)
+
+    yield db
+
+    original_db.bind(model_list)
+    db.close()
@@ -0,0 +1,101 @@
+import os
+import sys
+import random
+
+import numpy as np
+import pandas as pd
+from scipy.stats import kurtosis, skew
+from statsmodels import robust
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from core.burst_features import BurstAccumulator, get_numeric_features_batch, numeric_cols_feat, _ROUNDED_FEATURE_IX_LIST
+
+
+def reference_numeric_features(packet_list):
+    """The pandas/scipy/statsmodels computation that BurstAccumulator replaces."""
+
+    frame_len = pd.Series([p[1] for p in packet_list]).astype(int)
+    ts_delta = pd.Series([p[0] for p in packet_list]).astype(float).diff()
+    ts_delta[0] = 0.0
+
+    medAbsDev = robust.mad(frame_len)
+    skewL, kurtL = (0, 0) if medAbsDev < 1e-10 else (skew(frame_len), kurtosis(frame_len))
+    varTBP = ts_delta.var()
+    kurtT, skewT = (0, 0) if varTBP < 1e-10 else (kurtosis(ts_delta), skew(ts_delta))
+
+    return [
+        frame_len.mean(), frame_len.min(), frame_len.max(), medAbsDev, skewL,
+        kurtL, ts_delta.mean(), varTBP, ts_delta.median(), kurtT, skewT
+    ]
+
+
+def test_numeric_features_match_pandas():
+    rng = random.Random(0)
+    flow_key = (6, '192.168.1.10', 5000, '93.184.216.34', 443, '5c:e9:1e:22:84:7d')
+
+    for packet_count in [2, 3, 10, 101]:
+        ts = 1700000000.0
+        packet_list = []
+        burst = BurstAccumulator(flow_key)
+        for _ in range(packet_count):
+            ts += rng.expovariate(50)
+            frame_len = rng.choice([54, 60, 66, rng.randint(54, 1514)])
+            packet_list.append((ts, frame_len))
+            burst.add(ts, frame_len, 'TCP', 'example.com', 6, '192.168.1.10', '93.184.216.34', 'aa:aa:aa:aa:aa:aa')
+
+        features = burst.get_numeric_features()
+        np.testing.assert_allclose(features[:11], reference_numeric_features(packet_list), rtol=1e-9, atol=1e-12)
+        assert features[11:15] == [packet_count, 0, packet_count, packet_count]
+        assert burst.start_time == packet_list[0][0]
+
+
+def test_direction_counters_and_local_destination():
+    flow_key = (17, '192.168.1.10', 5353, '192.168.1.20', 5353, 'aa:aa:aa:aa:aa:01')
+    burst = BurstAccumulator(flow_key)
+    burst.add(1.0, 100, 'UDP', '(local network)', 17, '192.168.1.10', '192.168.1.20', 'aa:aa:aa:aa:aa:02')
+    burst.add(1.1, 200, 'UDP', '(local network)', 17, '192.168.1.20', '192.168.1.10', 'aa:aa:aa:aa:aa:01')
+    burst.add(1.2, 300, 'UDP', '(local network)', 17, '192.168.1.20', '192.168.1.10', 'aa:aa:aa:aa:aa:01')
+
+    features = burst.get_numeric_features()
+    # network_total, network_in, network_out, network_external, network_local,
+    # network_in_local, network_out_local
+    assert features[11:18] == [3, 0, 0, 0, 3, 2, 1]
+    assert features[18:22] == [0, 0, 100.0, 250.0]
+    assert burst.local_destination_device == 'aa:aa:aa:aa:aa:02'
+
+
+def test_batch_features_match_scalar_path():
+    rng = random.Random(1)
+    burst_list = []
+
+    for burst_ix in range(50):
+        flow_key = (6, '192.168.1.10', 5000 + burst_ix, '93.184.216.34', 443, '5c:e9:1e:22:84:7d')
+        burst = BurstAccumulator(flow_key)
+        ts = 1700000000.0
+        for _ in range(rng.randint(2, 40)):
+            ts += rng.expovariate(50)
+            if rng.random() < 0.5:
+                burst.add(ts, rng.randint(54, 1514), 'TCP', 'example.com', 6, '192.168.1.10', '93.184.216.34', '')
+            else:
+                burst.add(ts, rng.choice([54, 60]), 'TCP', 'example.com', 6, '93.184.216.34', '192.168.1.10', '5c:e9:1e:22:84:7d')
+        burst_list.append(burst)
+
+    # A burst with constant lengths and gaps, where the skew and kurtosis are 0
+    burst = BurstAccumulator((6, '192.168.1.10', 4999, '93.184.216.34', 443, '5c:e9:1e:22:84:7d'))
+    for ix in range(5):
+        burst.add(1700000000.0 + ix, 60, 'TCP', 'example.com', 6, '192.168.1.10', '93.184.216.34', '')
+    burst_list.append(burst)
+
+    batch_feature_list = get_numeric_features_batch(burst_list)
+    for burst, batch_features in zip(burst_list, batch_feature_list):
+        features = burst.get_numeric_features()
+        for ix, (batch_value, value) in enumerate(zip(batch_features, features)):
+            if ix in _ROUNDED_FEATURE_IX_LIST:
+                # Two-pass and online moments differ only by rounding
+                np.testing.assert_allclose(batch_value, value, rtol=1e-9, atol=1e-12)
+            else:
+                assert batch_value == value, numeric_cols_feat[ix]
+        # Same types as the scalar path, so that the CSV rows do not depend on the path taken
+        assert [type(value) for value in batch_features] == [type(value) for value in features]
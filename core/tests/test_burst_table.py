@@ -0,0 +1,35 @@
+import os
+import sys
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from core.burst_table import BurstTable
+
+
+def test_open_and_pop_expired_in_start_order():
+    table = BurstTable()
+    table.open('b', 10.5, ['b1'])
+    table.open('a', 10.0, ['a1'])
+    table.get('a').append('a2')
+    table.open('c', 11.8, ['c1'])
+
+    assert table.get_start_ts('a') == 10.0
+    assert table.pop_expired(11.2, 1) == [('a', 10.0, ['a1', 'a2'])]
+    assert table.pop_expired(11.6, 1) == [('b', 10.5, ['b1'])]
+    assert 'c' in table
+    assert len(table) == 1
+
+
+def test_stale_heap_entries_are_skipped():
+    table = BurstTable()
+    table.open('a', 10.0, ['a1'])
+    assert table.pop('a') == (10.0, ['a1'])
+
+    # Reopen the same flow; the old heap entry must not close the new burst
+    table.open('a', 10.5, ['a2'])
+    assert table.pop_expired(11.2, 1) == []
+    assert table.pop_expired(11.6, 1) == [('a', 10.5, ['a2'])]
+    assert table.pop('a') is None
+    assert table.get('a') is None
+    assert len(table) == 0
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import peewee
+import pytest
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import core.db_writer as db_writer
+import core.model as model
+
+
+class Item(peewee.Model):
+    name = peewee.TextField()
+
+
+MODEL_LIST = [Item]
+
+
+def test_group_commit_and_savepoints(test_db):
+    future_list = [db_writer.submit(Item.create, name=str(ix)) for ix in range(20)]
+
+    def fail():
+        Item.create(name='rolled back')
+        raise ValueError('failed write')
+
+    with pytest.raises(ValueError):
+        db_writer.execute(fail)
+
+    assert [future.result().name for future in future_list] == [str(ix) for ix in range(20)]
+    with test_db:
+        assert Item.select().count() == 20
+        assert Item.select().where(Item.name == 'rolled back').count() == 0
+
+
+def test_nested_writes_run_inline(test_db):
+
+    def outer():
+        Item.create(name='outer')
+        return db_writer.execute(lambda: Item.create(name='inner').name)
+
+    assert db_writer.execute(outer) == 'inner'
+    with test_db:
+        assert Item.select().count() == 2
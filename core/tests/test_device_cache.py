@@ -0,0 +1,85 @@
+import os
+import sys
+
+import pytest
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import core.device_cache as device_cache
+import core.model as model
+
+
+MODEL_LIST = [model.Device]
+
+
+@pytest.fixture(autouse=True)
+def device_db(test_db, monkeypatch):
+    with test_db:
+        model.Device.create(mac_addr='aa:01', ip_addr='192.168.1.10')
+    monkeypatch.setattr(device_cache, '_device_dict', [None])
+    monkeypatch.setattr(device_cache, '_new_mac_set', set())
+    monkeypatch.setattr(device_cache, '_dirty_mac_set', set())
+    monkeypatch.setattr(device_cache, '_generation', [0])
+
+
+def test_only_changed_devices_are_written(test_db):
+    assert device_cache.get_ip_mac_dict() == {'192.168.1.10': 'aa:01'}
+
+    # Unchanged values do not mark the device dirty
+    assert not device_cache.update('aa:01', ip_addr='192.168.1.10')
+    assert not device_cache._dirty_mac_set
+
+    assert device_cache.update('aa:01', ip_addr='192.168.1.11')
+    assert device_cache.update('aa:02', dhcp_hostname='camera')
+    device_cache.flush()
+    assert not device_cache._dirty_mac_set
+
+    with test_db:
+        row_list = model.Device.select(model.Device.mac_addr, model.Device.ip_addr, model.Device.dhcp_hostname).tuples()
+        assert sorted(row_list) == [('aa:01', '192.168.1.11', ''), ('aa:02', '', 'camera')]
+
+
+def test_clear_drops_unwritten_devices(test_db):
+    assert device_cache.update('aa:02', dhcp_hostname='camera')
+
+    # Devices deleted from the table are not written back by the next flush
+    with test_db:
+        model.Device.delete().execute()
+    device_cache.clear()
+    device_cache.flush()
+
+    assert device_cache.get_ip_mac_dict() == {}
+    with test_db:
+        assert model.Device.select().count() == 0
+
+
+def test_existing_devices_are_not_added_again(test_db):
+    assert device_cache.update('aa:02', dhcp_hostname='camera')
+
+    # Written by someone else before the flush
+    with test_db:
+        model.Device.create(mac_addr='aa:02', ip_addr='192.168.1.12')
+    device_cache.flush()
+
+    with test_db:
+        row_list = model.Device.select(model.Device.ip_addr, model.Device.dhcp_hostname) \
+            .where(model.Device.mac_addr == 'aa:02').tuples()
+        assert list(row_list) == [('', 'camera')]
+
+
+def test_flush_in_flight_during_clear_is_dropped(test_db, monkeypatch):
+    assert device_cache.update('aa:02', dhcp_hostname='camera')
+
+    # The reset clears the cache on the DB writer after the flush took its rows
+    execute = device_cache.db_writer.execute
+
+    def clear_then_execute(func, *args):
+        execute(device_cache.clear)
+        return execute(func, *args)
+
+    monkeypatch.setattr(device_cache.db_writer, 'execute', clear_then_execute)
+    device_cache.flush()
+
+    with test_db:
+        assert model.Device.select().where(model.Device.mac_addr == 'aa:02').count() == 0
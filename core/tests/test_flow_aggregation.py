@@ -0,0 +1,142 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import analysis.flow_aggregation as flow_aggregation
+import analysis.traffic_rate as traffic_rate
+import core.model as model
+
+
+MODEL_LIST = [model.FlowRollup, model.Device]
+
+NOW_TS = 1700000040
+
+MAC_A = '00:00:00:00:00:aa'
+MAC_B = '00:00:00:00:00:bb'
+MAC_C = '00:00:00:00:00:cc'
+
+
+@pytest.fixture(autouse=True)
+def rollups(test_db, monkeypatch):
+    monkeypatch.setattr(flow_aggregation.time, 'time', lambda: NOW_TS)
+
+    def get_row(bucket_size, bucket_ts, mac_addr, ip_addr, hostname, upload, download):
+        return dict(
+            bucket_size=bucket_size, bucket_ts=bucket_ts, device_mac_addr=mac_addr,
+            remote_ip_addr=ip_addr, remote_hostname=hostname,
+            upload_byte_count=upload, download_byte_count=download
+        )
+
+    with test_db:
+        model.FlowRollup.insert_many([
+            get_row(2, NOW_TS - 10, MAC_A, '1.1.1.1', 'a.com', 100, 1000),
+            get_row(2, NOW_TS - 10, MAC_A, '2.2.2.2', 'b.com', 50, 0),
+            get_row(2, NOW_TS - 8, MAC_B, '1.1.1.1', 'a.com', 30, 300),
+            get_row(2, NOW_TS - 8, MAC_C, '3.3.3.3', '', 5, 0),
+            # Too old for the last 20 seconds
+            get_row(2, NOW_TS - 100, MAC_A, '1.1.1.1', 'a.com', 999, 999),
+            # A different bucket size
+            get_row(60, NOW_TS - 60, MAC_A, '1.1.1.1', 'a.com', 7777, 7777),
+        ]).execute()
+
+
+def add_devices():
+    with model.db:
+        model.Device.create(mac_addr=MAC_A, ip_addr='10.0.0.2', product_name='Phone')
+        model.Device.create(mac_addr=MAC_B, ip_addr='10.0.0.3')
+
+
+def test_get_top_labels():
+    mac_col = model.FlowRollup.device_mac_addr
+
+    search_filter = flow_aggregation.get_search_filter(2, 20, upload=True)
+    assert flow_aggregation.get_top_labels(mac_col, search_filter, upload=True) == [MAC_A, MAC_B, MAC_C]
+    assert flow_aggregation.get_top_labels(mac_col, search_filter, upload=True, limit=2) == [MAC_A, MAC_B]
+
+    # Rollups without download traffic are left out
+    search_filter = flow_aggregation.get_search_filter(2, 20, upload=False)
+    assert flow_aggregation.get_top_labels(mac_col, search_filter, upload=False) == [MAC_A, MAC_B]
+
+
+def test_get_label_totals():
+    label_array, byte_count_array = flow_aggregation.get_label_totals(
+        model.FlowRollup.remote_hostname,
+        flow_aggregation.get_search_filter(2, 20, upload=True),
+        upload=True
+    )
+    assert dict(zip(label_array, byte_count_array)) == {'a.com': 130, 'b.com': 50, '': 5}
+
+    label_array, byte_count_array = flow_aggregation.get_label_totals(
+        model.FlowRollup.remote_hostname,
+        flow_aggregation.get_search_filter(
+            2, 20, upload=False, search_filter=(model.FlowRollup.device_mac_addr == MAC_A)
+        ),
+        upload=False
+    )
+    assert dict(zip(label_array, byte_count_array)) == {'a.com': 1000}
+
+
+def test_get_bucket_sums_and_to_matrix():
+    ts_array, label_array, byte_count_array = flow_aggregation.get_bucket_sums(
+        model.FlowRollup.device_mac_addr,
+        flow_aggregation.get_search_filter(2, 20, upload=True),
+        upload=True,
+        top_label_list=[MAC_A]
+    )
+    assert sorted(zip(ts_array.tolist(), label_array, byte_count_array.tolist())) == [
+        (NOW_TS - 10, MAC_A, 150),
+        (NOW_TS - 8, flow_aggregation.OTHERS_LABEL, 35),
+    ]
+
+    ts_axis = np.arange(NOW_TS - 10, NOW_TS - 7, 2)
+    matrix = flow_aggregation.to_matrix(
+        ts_array, label_array, byte_count_array, ts_axis, [flow_aggregation.OTHERS_LABEL, MAC_A]
+    )
+    assert matrix.tolist() == [[0, 150], [35, 0]]
+
+    # Sums outside the axis or the label list are dropped
+    matrix = flow_aggregation.to_matrix(ts_array, label_array, byte_count_array, ts_axis[:1], [MAC_B])
+    assert matrix.tolist() == [[0]]
+
+
+def test_get_all_device_rate_uses_rollup_bucket_size():
+    add_devices()
+
+    # Ninety seconds are graphed from the 2-second rollups
+    upload_df = traffic_rate.get_all_device_rate_helper(upload=True, last_n_seconds=90)
+
+    # Devices that are not in the Device table are dropped
+    assert sorted(upload_df.columns) == ['Phone', 'Time', 'Unnamed Device 00bb']
+    assert upload_df['Phone'].tolist() == [150 * 8 / 1000000 / 2, 0]
+    assert upload_df['Unnamed Device 00bb'].tolist() == [0, 30 * 8 / 1000000 / 2]
+
+
+def test_get_traffic_rate_df():
+    add_devices()
+
+    upload_df, download_df = traffic_rate.get_traffic_rate_df(last_n_seconds=20)
+
+    assert len(upload_df) == 2 * 3
+    device_df = upload_df[upload_df['device_mac_addr'] == MAC_A]
+    assert device_df['ts'].tolist() == [NOW_TS - 10, NOW_TS - 9, NOW_TS - 8]
+    assert device_df['Bandwidth (Mbps)'].tolist() == [150 * 8 / 1000000 / 2, 0, 0]
+
+    device_df = download_df[download_df['device_mac_addr'] == MAC_B]
+    assert device_df['Bandwidth (Mbps)'].tolist() == [0, 0, 300 * 8 / 1000000 / 2]
+
+
+def test_get_traffic_rate_df_without_devices():
+    upload_df, download_df = traffic_rate.get_traffic_rate_df(last_n_seconds=20)
+
+    assert len(upload_df) == 0
+    assert len(download_df) == 0
+    assert list(upload_df.columns) == ['device_mac_addr', 'ts', 'Bandwidth (Mbps)', 'Time']
+
+    with model.db:
+        model.FlowRollup.delete().execute()
+    assert traffic_rate.get_traffic_rate_df(last_n_seconds=20) == (None, None)
@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+
+import pytest
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import core.config as config
+import core.db_writer as db_writer
+import core.flow_retention as flow_retention
+import core.flow_writer as flow_writer
+import core.model as model
+
+
+MODEL_LIST = [model.Flow, model.FlowRollup, model.Configuration]
+
+
+DB_PRAGMAS = (('auto_vacuum', 'incremental'), ('journal_mode', 'wal'))
+
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch):
+    monkeypatch.setattr(flow_retention, 'RETENTION_DELETE_BATCH_SIZE', 2)
+    monkeypatch.setattr(flow_retention, 'RETENTION_BATCH_PAUSE', 0)
+
+
+def get_flow_row(end_ts, byte_count):
+    return dict(
+        start_ts=end_ts - 1, end_ts=end_ts,
+        src_device_mac_addr='aa:aa', dst_device_mac_addr='',
+        src_port=1234, dst_port=443, src_ip_addr='10.0.0.2', dst_ip_addr='1.1.1.1',
+        protocol='tcp', byte_count=byte_count, packet_count=1
+    )
+
+
+def test_old_flows_are_rolled_up_and_deleted(test_db):
+    day = 24 * 3600
+    now = time.time()
+
+    # Flows from before the rollups existed are only in the Flow table
+    with test_db:
+        model.Flow.insert_many([get_flow_row(now - 30 * day + i, 10) for i in range(5)]).execute()
+    config.set('flow_rollup_start_ts', now - 20 * day)
+
+    db_writer.execute(flow_writer.insert_flow_rows, [get_flow_row(now - 10 * day + i, 20) for i in range(3)])
+    db_writer.execute(flow_writer.insert_flow_rows, [get_flow_row(now - 60, 30)])
+
+    flow_retention.run()
+
+    with test_db:
+        # Only the recent flow is left
+        assert [flow.byte_count for flow in model.Flow.select()] == [30]
+
+        # 2-second rollups are kept for a day, 1800-second ones forever
+        rollup_dict = {}
+        for rollup in model.FlowRollup.select():
+            rollup_dict.setdefault(rollup.bucket_size, 0)
+            rollup_dict[rollup.bucket_size] += rollup.upload_byte_count
+        assert rollup_dict[2] == 30
+        assert rollup_dict[1800] == 5 * 10 + 3 * 20 + 30
+
+    tier_dict = flow_retention.get_stats()['tiers']
+    assert tier_dict['flow']['rows'] == 1
+    assert tier_dict['rollup_2']['rows'] == 1
+    assert tier_dict['database']['bytes'] > 0
+
+
+def test_free_pages_are_vacuumed_in_batches(test_db, monkeypatch):
+    monkeypatch.setattr(flow_retention, 'VACUUM_BATCH_SIZE', 3)
+    monkeypatch.setattr(flow_retention, 'VACUUM_PAGES_PER_RUN', 10)
+
+    row = dict(get_flow_row(time.time(), 1), dst_hostname='x' * 4000)
+    db_writer.execute(flow_writer.insert_flow_rows, [row] * 20)
+    db_writer.execute(lambda: model.Flow.delete().execute())
+    with test_db:
+        free_count = test_db.pragma('freelist_count')
+    assert free_count > 10
+
+    vacuumed_page_count = flow_retention.get_stats()['vacuumed_pages']
+    flow_retention.run()
+
+    assert flow_retention.get_stats()['vacuumed_pages'] == vacuumed_page_count + 10
+    with test_db:
+        assert test_db.pragma('freelist_count') == free_count - 10
+
+
+
+
+@pytest.fixture
+def without_incremental_vacuum(request, monkeypatch):
+    # Databases of earlier versions are not rebuilt by default
+    monkeypatch.setattr(request.module, 'DB_PRAGMAS', (('journal_mode', 'wal'),))
+
+
+def test_vacuum_without_incremental_vacuum(without_incremental_vacuum, test_db):
+    with test_db:
+        assert test_db.pragma('auto_vacuum') == 0
+
+    row = dict(get_flow_row(time.time(), 1), dst_hostname='x' * 4000)
+    db_writer.execute(flow_writer.insert_flow_rows, [row] * 20)
+    db_writer.execute(lambda: model.Flow.delete().execute())
+    with test_db:
+        assert test_db.pragma('freelist_count') > 0
+
+    # Neither waits for free pages that are never returned
+    assert flow_retention._vacuum_in_batches() == 0
+    assert db_writer.execute(flow_retention._incremental_vacuum, 10) == 0
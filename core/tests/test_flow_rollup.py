@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pytest
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import core.db_writer as db_writer
+import core.flow_rollup as flow_rollup
+import core.flow_writer as flow_writer
+import core.model as model
+
+
+MODEL_LIST = [model.Flow, model.FlowRollup]
+
+
+def get_flow_row(end_ts, src_mac_addr, dst_mac_addr, src_ip_addr, dst_ip_addr, byte_count, dst_hostname=''):
+    return dict(
+        start_ts=end_ts - 1, end_ts=end_ts,
+        src_device_mac_addr=src_mac_addr, dst_device_mac_addr=dst_mac_addr,
+        src_port=1234, dst_port=443, src_ip_addr=src_ip_addr, dst_ip_addr=dst_ip_addr,
+        src_country='', dst_country='', src_hostname='', dst_hostname=dst_hostname,
+        src_reg_domain='', dst_reg_domain='', src_tracker_company='', dst_tracker_company='',
+        protocol='tcp', byte_count=byte_count, packet_count=1
+    )
+
+
+def get_rollup_list(db):
+    with db:
+        return sorted(model.FlowRollup.select(
+            model.FlowRollup.bucket_size, model.FlowRollup.bucket_ts,
+            model.FlowRollup.device_mac_addr, model.FlowRollup.remote_ip_addr,
+            model.FlowRollup.remote_hostname,
+            model.FlowRollup.upload_byte_count, model.FlowRollup.download_byte_count
+        ).tuples())
+
+
+def test_rollups_match_backfill(test_db):
+    flow_row_list = [
+        get_flow_row(1000.5, 'aa:aa', '', '10.0.0.2', '1.1.1.1', 100),
+        get_flow_row(1001.5, 'aa:aa', '', '10.0.0.2', '1.1.1.1', 50, dst_hostname='one.one'),
+        get_flow_row(1003.0, '', 'aa:aa', '1.1.1.1', '10.0.0.2', 300),
+        get_flow_row(1003.0, 'aa:aa', 'bb:bb', '10.0.0.2', '10.0.0.3', 7),
+    ]
+    db_writer.execute(flow_writer.insert_flow_rows, flow_row_list[:2])
+    db_writer.execute(flow_writer.insert_flow_rows, flow_row_list[2:])
+    rollup_list = get_rollup_list(test_db)
+
+    assert (2, 1000, 'aa:aa', '1.1.1.1', 'one.one', 150, 0) in rollup_list
+    assert (2, 1002, 'aa:aa', '1.1.1.1', '', 0, 300) in rollup_list
+    assert (60, 960, 'aa:aa', '1.1.1.1', 'one.one', 150, 300) in rollup_list
+    assert (60, 960, 'bb:bb', '10.0.0.2', '', 0, 7) in rollup_list
+
+    # Rebuilding the rollups from the Flow table gives the same result
+    with test_db:
+        model.FlowRollup.delete().execute()
+    db_writer.execute(flow_rollup.backfill, 0)
+    assert get_rollup_list(test_db) == rollup_list
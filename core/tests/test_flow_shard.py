@@ -0,0 +1,103 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import core.flow_shard as flow_shard
+import core.flow_writer as flow_writer
+import core.model as model
+
+
+MODEL_LIST = [model.Flow]
+
+
+@pytest.fixture
+def shard_directory(test_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(flow_shard, 'FLOW_SHARDS_ENABLED', True)
+    monkeypatch.setattr(flow_shard, 'FLOW_SHARD_DIRECTORY', str(tmp_path / 'flow_shards'))
+    monkeypatch.setattr(flow_shard, '_shard_db_dict', {})
+    monkeypatch.setattr(flow_shard, '_deleted_before_day', [''])
+    return tmp_path / 'flow_shards'
+
+
+def get_flow_row(end_ts, byte_count):
+    return dict(
+        start_ts=end_ts - 1, end_ts=end_ts,
+        src_device_mac_addr='aa:aa', dst_device_mac_addr='',
+        src_ip_addr='10.0.0.2', dst_ip_addr='1.1.1.1',
+        byte_count=byte_count, packet_count=1
+    )
+
+
+def get_byte_count_list(start_ts=None, end_ts=None):
+    byte_count_list = []
+    for flow_db in flow_shard.get_flow_databases(start_ts, end_ts):
+        with flow_db:
+            byte_count_list += [flow.byte_count for flow in model.Flow.select().execute(flow_db)]
+    return sorted(byte_count_list)
+
+
+def test_flows_are_routed_to_daily_shards(shard_directory):
+    day = 24 * 3600
+    now = time.time()
+    flow_shard.insert_flow_rows([
+        get_flow_row(now - 2 * day, 1), get_flow_row(now - day, 2), get_flow_row(now, 3)
+    ], batch_size=2)
+
+    assert len(os.listdir(shard_directory)) == 3
+    assert get_byte_count_list() == [1, 2, 3]
+    assert get_byte_count_list(now - 60, now) == [3]
+
+    # Expiring a day deletes its file
+    assert flow_shard.delete_shards_before(now - day) == 1
+    assert get_byte_count_list() == [2, 3]
+
+
+def test_deleted_shards_are_closed_and_not_recreated(shard_directory):
+    day = 24 * 3600
+    now = time.time()
+    flow_shard.insert_flow_rows([get_flow_row(now - 2 * day, 1), get_flow_row(now, 2)], batch_size=2)
+
+    # Another thread keeps a connection to the old shard open
+    old_shard_db = flow_shard.get_shard_db(flow_shard.get_day(now - 2 * day))
+    connected_event = threading.Event()
+    threading.Thread(target=lambda: (old_shard_db.connect(), connected_event.set())).start()
+    connected_event.wait()
+
+    assert flow_shard.delete_shards_before(now - day) == 1
+    assert not old_shard_db._conn_set
+
+    # A late flow of the deleted day is dropped, and readers do not recreate the file
+    flow_shard.insert_flow_rows([get_flow_row(now - 2 * day, 3)], batch_size=2)
+    assert len(os.listdir(shard_directory)) == 1
+    assert flow_shard.get_shard_db(flow_shard.get_day(now - 2 * day)) is None
+    assert get_byte_count_list() == [2]
+
+    assert flow_shard.delete_all_shards() == 1
+    assert os.listdir(shard_directory) == []
+
+
+def test_failed_rollup_update_does_not_duplicate_flows(shard_directory, monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(flow_writer, 'get_flow_row', lambda flow_key, flow_stat_dict: get_flow_row(now, flow_stat_dict['byte_count']))
+    monkeypatch.setattr(flow_writer.time, 'sleep', lambda seconds: None)
+
+    update_call_list = []
+
+    def update(flow_row_list):
+        update_call_list.append(flow_row_list)
+        if len(update_call_list) == 1:
+            raise ValueError('failed rollup update')
+
+    monkeypatch.setattr(flow_writer.flow_rollup, 'update', update)
+
+    flow_writer.write_flows_to_db({('flow', 1): {'byte_count': 5}}, attempts=2)
+
+    # Only the rollup update is retried
+    assert len(update_call_list) == 2
+    assert get_byte_count_list() == [5]
@@ -0,0 +1,33 @@
+import os
+import queue
+import sys
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import core.flow_writer as flow_writer
+
+
+def test_handoff_is_skipped_when_writer_falls_behind(monkeypatch):
+    monkeypatch.setattr(flow_writer, '_handoff_queue', queue.Queue(maxsize=2))
+    swapped_list = []
+
+    def swap_flow_dict():
+        swapped_list.append({('flow', len(swapped_list)): {}})
+        return swapped_list[-1]
+
+    assert flow_writer.submit(swap_flow_dict)
+    assert flow_writer.submit(swap_flow_dict)
+    # The queue is full; the flows must stay with the packet processor
+    assert not flow_writer.submit(swap_flow_dict)
+    assert len(swapped_list) == 2
+
+    stat_dict = flow_writer.get_stats()
+    assert stat_dict['backlog'] == 2
+    assert stat_dict['skipped_handoffs'] >= 1
+
+    written_list = []
+    monkeypatch.setattr(flow_writer, 'write_flows_to_db', lambda pending_flow_dict, attempts: written_list.append(pending_flow_dict))
+    flow_writer.write_next_flows()
+    assert written_list == swapped_list[:1]
+    assert flow_writer.submit(swap_flow_dict)
@@ -0,0 +1,116 @@
+import collections
+import http.server
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import core.global_state as global_state
+from core.hostname_store import HostnameStore
+import core.hostname_resolver as hostname_resolver
+
+
+# Maps IP address -> hostname known to the stub server
+STUB_HOSTNAME_DICT = {
+    '1.1.1.1': 'one.one.one.one.',
+    '8.8.8.8': 'dns.google',
+}
+
+# IP address whose requests fail
+FAILING_IP_ADDR = '6.6.6.6'
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    request_counter = collections.Counter()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            ip_addr = self.path.rsplit('/', 1)[-1]
+            request_counter[ip_addr] += 1
+            if ip_addr == FAILING_IP_ADDR:
+                self.send_error(500)
+                return
+            if ip_addr in STUB_HOSTNAME_DICT:
+                response_dict = {'success': True, 'hostname': STUB_HOSTNAME_DICT[ip_addr]}
+            else:
+                response_dict = {'success': False, 'error': 'No data for this ip_addr'}
+            body = json.dumps(response_dict).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setattr(hostname_resolver, '_cache', collections.OrderedDict())
+    monkeypatch.setattr(hostname_resolver, '_pending_queue', hostname_resolver.queue.Queue())
+    monkeypatch.setattr(hostname_resolver, '_pending_ip_addr_set', set())
+    monkeypatch.setattr(hostname_resolver, 'RESOLVER_BATCH_WAIT', 0)
+    monkeypatch.setattr(global_state, 'hostname_store', HostnameStore())
+
+    yield f'http://127.0.0.1:{server.server_port}/get_hostname_from_ip/key', request_counter
+
+    hostname_resolver.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_resolve_with_negative_caching(stub_server):
+    url_prefix, request_counter = stub_server
+    resolved_list = []
+
+    ip_addr_list = ['1.1.1.1', '8.8.8.8', '9.9.9.9']
+    # Duplicates are queued once
+    assert hostname_resolver.submit(ip_addr_list + ['1.1.1.1'], url_prefix, lambda *args: resolved_list.append(args)) == 3
+    hostname_resolver.run()
+
+    assert sorted(resolved_list) == [('1.1.1.1', 'one.one.one.one?'), ('8.8.8.8', 'dns.google?')]
+    assert global_state.hostname_store.get('1.1.1.1') == 'one.one.one.one?'
+    assert global_state.hostname_store.get('8.8.8.8') == 'dns.google?'
+    assert global_state.hostname_store.get('9.9.9.9') == ''
+    assert hostname_resolver.get_cached('9.9.9.9') == ''
+    assert hostname_resolver.get_cached('4.4.4.4') is None
+
+    # Cached answers, positive or negative, are not requested again
+    assert hostname_resolver.submit(ip_addr_list, url_prefix) == 0
+    assert request_counter == {'1.1.1.1': 1, '8.8.8.8': 1, '9.9.9.9': 1}
+
+
+def test_negative_answers_expire(stub_server, monkeypatch):
+    url_prefix, request_counter = stub_server
+    monkeypatch.setattr(hostname_resolver, 'RESOLVER_NEGATIVE_TTL', -1)
+
+    hostname_resolver.submit(['9.9.9.9'], url_prefix)
+    hostname_resolver.run()
+
+    assert hostname_resolver.submit(['9.9.9.9'], url_prefix) == 1
+    hostname_resolver.run()
+    assert request_counter['9.9.9.9'] == 2
+
+
+def test_not_found_callback(stub_server):
+    url_prefix, _ = stub_server
+    resolved_list = []
+    not_found_list = []
+
+    hostname_resolver.submit(
+        ['1.1.1.1', '9.9.9.9', FAILING_IP_ADDR], url_prefix,
+        lambda *args: resolved_list.append(args), not_found_list.append
+    )
+    hostname_resolver.run()
+
+    # Only negative answers are passed on, not failed requests
+    assert resolved_list == [('1.1.1.1', 'one.one.one.one?')]
+    assert not_found_list == ['9.9.9.9']
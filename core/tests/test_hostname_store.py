@@ -0,0 +1,89 @@
+import os
+import sys
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from core.hostname_store import HostnameStore
+
+
+def test_get_by_time():
+    store = HostnameStore()
+
+    store.add('1.1.1.1', 'a.example.com', 'dns', ts=100)
+    store.add('1.1.1.1', 'a.example.com', 'dns', ts=150)
+    store.add('1.1.1.1', 'b.example.com', 'sni', ts=200)
+
+    assert store.get('1.1.1.1') == 'b.example.com'
+    assert store.get('1.1.1.1', ts=120) == 'a.example.com'
+    assert store.get('1.1.1.1', ts=200) == 'b.example.com'
+    # Before the first sighting, the earliest hostname is the best guess
+    assert store.get('1.1.1.1', ts=50) == 'a.example.com'
+    assert store.get('2.2.2.2') == ''
+
+    assert store.get_entries('1.1.1.1') == [
+        ('a.example.com', 100, 150, 'dns'),
+        ('b.example.com', 200, 200, 'sni'),
+    ]
+
+    # Out-of-order sightings (e.g., from shard snapshots) are merged by time
+    store.add('1.1.1.1', 'a.example.com', 'dns', ts=90)
+    store.add('1.1.1.1', 'c.example.com', 'dns', ts=170)
+    assert store.get('1.1.1.1', ts=95) == 'a.example.com'
+    assert store.get('1.1.1.1', ts=180) == 'c.example.com'
+    assert len(store.get_entries('1.1.1.1')) == 3
+
+
+def test_bounds_and_only_if_missing():
+    store = HostnameStore(maxsize=2, history_size=2)
+
+    store.add('1.1.1.1', 'a', 'dns', ts=1)
+    store.add('1.1.1.1', 'b', 'dns', ts=2)
+    store.add('1.1.1.1', 'c', 'dns', ts=3)
+    assert [entry[0] for entry in store.get_entries('1.1.1.1')] == ['b', 'c']
+
+    assert not store.add('1.1.1.1', 'd', 'ptr', only_if_missing=True)
+    assert store.add('2.2.2.2', 'e', 'ptr', only_if_missing=True)
+
+    # The least recently used IP address is evicted
+    store.get('1.1.1.1')
+    store.add('3.3.3.3', 'f', 'dns')
+    assert store.get('2.2.2.2') == ''
+    assert store.get('1.1.1.1') == 'c'
+    assert len(store) == 2
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'hostname_store.json')
+
+    store = HostnameStore()
+    store.add('1.1.1.1', 'a.example.com', 'dns', ts=100)
+    store.add('1.1.1.1', 'b.example.com', 'sni', ts=200)
+    store.save(path)
+
+    restored_store = HostnameStore()
+    assert restored_store.load(path) == 1
+    assert restored_store.get_entries('1.1.1.1') == store.get_entries('1.1.1.1')
+    assert restored_store.get('1.1.1.1', ts=150) == 'a.example.com'
+
+    assert HostnameStore().load(str(tmp_path / 'missing.json')) == 0
+
+
+def test_get_changes():
+    store = HostnameStore(maxsize=2)
+
+    store.add('1.1.1.1', 'a.example.com', 'dns', ts=100)
+    store.add('2.2.2.2', 'b.example.com', 'dns', ts=100)
+    change_count, change_dict = store.get_changes()
+    assert sorted(change_dict) == ['1.1.1.1', '2.2.2.2']
+
+    # Only the IP addresses changed since the last call
+    store.add('1.1.1.1', 'c.example.com', 'sni', ts=200)
+    change_count, change_dict = store.get_changes(change_count)
+    assert change_dict == {'1.1.1.1': [['a.example.com', 100, 100, 'dns'], ['c.example.com', 200, 200, 'sni']]}
+    assert store.get_changes(change_count) == (change_count, {})
+
+    # Evicted IP addresses are not reported
+    store.add('3.3.3.3', 'd.example.com', 'dns', ts=300)
+    assert list(store.get_changes(change_count)[1]) == ['3.3.3.3']
+    assert sorted(store.get_changes()[1]) == ['1.1.1.1', '3.3.3.3']
@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import core.hostname_writer as hostname_writer
+import core.model as model
+
+
+MODEL_LIST = [model.Hostname]
+
+
+@pytest.fixture(autouse=True)
+def reset_hostname_writer(monkeypatch):
+    monkeypatch.setattr(hostname_writer, '_known_set', set())
+    monkeypatch.setattr(hostname_writer, '_pending_list', [])
+
+
+def test_repeated_hostnames_are_written_once(test_db):
+    hostname_writer.add('aa:aa', 'example.com', {'1.2.3.4', '1.2.3.5'}, 'dns')
+    hostname_writer.add('aa:aa', 'example.com', {'1.2.3.4'}, 'dns')
+    hostname_writer.add('aa:aa', 'example.com', {'1.2.3.4'}, 'sni')
+    assert len(hostname_writer._pending_list) == 3
+    hostname_writer.flush()
+
+    # Rows that already exist in the database are ignored
+    hostname_writer._known_set.clear()
+    hostname_writer.add('aa:aa', 'example.com', {'1.2.3.4'}, 'dns')
+    hostname_writer.flush()
+
+    with test_db:
+        row_list = model.Hostname.select(model.Hostname.ip_addr, model.Hostname.data_source).tuples()
+        assert sorted(row_list) == [('1.2.3.4', 'dns'), ('1.2.3.4', 'sni'), ('1.2.3.5', 'dns')]
+
+
+def test_clear_forgets_known_hostnames(test_db):
+    hostname_writer.add('aa:aa', 'example.com', {'1.2.3.4'}, 'dns')
+    hostname_writer.flush()
+
+    # After the table is emptied, the same hostname is written again
+    with test_db:
+        model.Hostname.delete().execute()
+    hostname_writer.clear()
+    hostname_writer.add('aa:aa', 'example.com', {'1.2.3.4'}, 'dns')
+    hostname_writer.flush()
+
+    with test_db:
+        assert model.Hostname.select().count() == 1
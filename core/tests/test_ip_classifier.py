@@ -0,0 +1,30 @@
+import ipaddress
+import os
+import sys
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import core.ip_classifier as ip_classifier
+
+
+def test_flags_match_ipaddress():
+    for ip_addr in ['192.168.1.10', '10.0.0.1', '8.8.8.8', '224.0.0.251', '239.255.255.250',
+                    '169.254.1.1', '127.0.0.1', '255.255.255.255', '100.64.0.1', 'fe80::1', '2001:4860::8888']:
+        ip_obj = ipaddress.ip_address(ip_addr)
+        assert ip_classifier.is_private(ip_addr) == ip_obj.is_private
+        assert ip_classifier.is_global(ip_addr) == ip_obj.is_global
+        assert ip_classifier.is_multicast(ip_addr) == ip_obj.is_multicast
+        assert bool(ip_classifier.classify(ip_addr) & ip_classifier.LINK_LOCAL) == ip_obj.is_link_local
+
+    assert ip_classifier.classify('255.255.255.255') & ip_classifier.BROADCAST
+    assert ip_classifier.classify(int(ipaddress.ip_address('8.8.8.8'))) == ip_classifier.classify('8.8.8.8')
+
+
+def test_invalid_addresses_and_sort_key():
+    assert not ip_classifier.is_valid('not an ip')
+    assert not ip_classifier.is_valid('256.1.1.1')
+    assert ip_classifier.is_valid('192.168.1.1')
+
+    assert ip_classifier.get_sort_key('192.168.1.20') > ip_classifier.get_sort_key('192.168.1.3')
+    assert ip_classifier.get_sort_key('::1') > ip_classifier.get_sort_key('255.255.255.255')
@@ -0,0 +1,104 @@
+import os
+import sys
+
+import scapy.all as sc
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from core import packet_parser
+
+
+SRC_MAC = '5c:e9:1e:22:84:7d'
+DST_MAC = '08:b4:b1:23:08:a8'
+
+
+def test_parse_tcp_matches_scapy():
+    pkt = sc.Ether(src=SRC_MAC, dst=DST_MAC) / \
+        sc.IP(src='192.168.1.10', dst='93.184.216.34') / \
+        sc.TCP(sport=51000, dport=443, seq=1234, ack=5678) / (b'x' * 100)
+    frame = bytes(pkt)
+
+    record = packet_parser.parse_frame(frame, ts=12.5)
+
+    assert record.ts == 12.5
+    assert record.length == len(pkt)
+    assert record.src_mac == pkt[sc.Ether].src
+    assert record.dst_mac == pkt[sc.Ether].dst
+    assert record.src_ip == pkt[sc.IP].src
+    assert record.dst_ip == pkt[sc.IP].dst
+    assert record.ip_proto == 6
+    assert record.protocol == 'tcp'
+    assert (record.src_port, record.dst_port) == (51000, 443)
+    assert (record.tcp_seq, record.tcp_ack) == (1234, 5678)
+    assert record.payload == b'x' * 100
+
+
+def test_parse_udp_with_vlan_tag():
+    pkt = sc.Ether(src=SRC_MAC, dst=DST_MAC) / sc.Dot1Q(vlan=10) / \
+        sc.IP(src='192.168.1.10', dst='8.8.8.8') / sc.UDP(sport=5000, dport=123) / b'abc'
+
+    record = packet_parser.parse_frame(bytes(pkt))
+
+    assert record.protocol == 'udp'
+    assert record.ip_proto == 17
+    assert (record.src_ip, record.dst_ip) == ('192.168.1.10', '8.8.8.8')
+    assert (record.src_port, record.dst_port) == (5000, 123)
+    assert record.payload == b'abc'
+
+
+def test_parse_qinq_and_vlan_tagged_arp():
+    pkt = sc.Ether(src=SRC_MAC, dst=DST_MAC, type=0x88a8) / sc.Dot1Q(vlan=100) / sc.Dot1Q(vlan=10) / \
+        sc.IP(src='192.168.1.10', dst='8.8.8.8') / sc.TCP(sport=5000, dport=443) / b'abc'
+
+    record = packet_parser.parse_frame(bytes(pkt))
+
+    assert (record.src_ip, record.dst_ip) == ('192.168.1.10', '8.8.8.8')
+    assert (record.src_port, record.dst_port) == (5000, 443)
+    assert record.payload == b'abc'
+
+    arp = bytes(sc.Ether(src=SRC_MAC, dst='ff:ff:ff:ff:ff:ff') / sc.Dot1Q(vlan=10) / sc.ARP(pdst='192.168.1.1'))
+    assert packet_parser.get_ether_type(arp) == (packet_parser.ETHER_TYPE_ARP, 18)
+    assert packet_parser.is_arp_frame(arp)
+    assert packet_parser.parse_frame(arp) is None
+
+
+def test_parse_non_ipv4_and_truncated_frames():
+    arp = bytes(sc.Ether(src=SRC_MAC, dst='ff:ff:ff:ff:ff:ff') / sc.ARP(pdst='192.168.1.1'))
+    assert packet_parser.parse_frame(arp) is None
+    assert packet_parser.is_arp_frame(arp)
+
+    tcp = bytes(sc.Ether() / sc.IP(dst='1.2.3.4') / sc.TCP())
+    assert packet_parser.parse_frame(tcp[:20]) is None
+    assert not packet_parser.is_arp_frame(tcp)
+
+
+def test_non_first_fragment_has_no_ports():
+    pkt = sc.Ether() / sc.IP(src='10.0.0.1', dst='1.2.3.4', proto=17, frag=100) / b'payload'
+
+    record = packet_parser.parse_frame(bytes(pkt))
+
+    assert record.protocol == ''
+    assert record.src_port is None
+
+
+def test_needs_dissection():
+    dns = packet_parser.parse_frame(bytes(
+        sc.Ether() / sc.IP(dst='8.8.8.8') / sc.UDP(sport=5555, dport=53) / sc.DNS(qd=sc.DNSQR(qname='example.com'))
+    ))
+    dhcp = packet_parser.parse_frame(bytes(
+        sc.Ether() / sc.IP(src='0.0.0.0', dst='255.255.255.255') / sc.UDP(sport=68, dport=67) / sc.BOOTP()
+    ))
+    client_hello = packet_parser.parse_frame(bytes(
+        sc.Ether() / sc.IP(dst='1.2.3.4') / sc.TCP(dport=443) / bytes.fromhex('160301004a01000046')
+    ))
+    other = packet_parser.parse_frame(bytes(
+        sc.Ether() / sc.IP(dst='1.2.3.4') / sc.TCP(dport=443) / bytes.fromhex('170303004a')
+    ))
+
+    assert packet_parser.needs_dns_dissection(dns)
+    assert not packet_parser.needs_dns_dissection(dhcp)
+    assert packet_parser.needs_dhcp_dissection(dhcp)
+    assert packet_parser.needs_client_hello_dissection(client_hello)
+    assert not packet_parser.needs_client_hello_dissection(other)
+    assert not packet_parser.needs_client_hello_dissection(dns)
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import scapy.all as sc
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import core.global_state as global_state
+import core.networking as networking
+import core.packet_processor as packet_processor
+from core.packet_queue import BoundedPacketQueue
+
+
+HOST_MAC = '00:00:00:00:00:01'
+DEVICE_MAC = '5c:e9:1e:22:84:7d'
+OTHER_DEVICE_MAC = '08:b4:b1:23:08:a8'
+
+
+def test_batch_uses_arp_packets_of_the_same_batch(monkeypatch):
+    monkeypatch.setattr(global_state, 'packet_queue', BoundedPacketQueue())
+    monkeypatch.setattr(global_state, 'arp_cache', networking.ARPCache(load_from_db=False))
+    monkeypatch.setattr(global_state, 'host_mac_addr', HOST_MAC)
+    monkeypatch.setattr(global_state, 'host_ip_addr', '192.168.1.2')
+    monkeypatch.setattr(packet_processor, 'flow_dict', {})
+    monkeypatch.setattr(packet_processor, 'PACKET_BATCH_SIZE', 2)
+    monkeypatch.setitem(packet_processor.flow_dict_last_db_write_ts, '_', 2 ** 40)
+    monkeypatch.setattr(packet_processor.device_cache, 'update', lambda *args, **kwargs: False)
+
+    arp_frame = bytes(
+        sc.Ether(src=OTHER_DEVICE_MAC, dst='ff:ff:ff:ff:ff:ff') /
+        sc.ARP(op=2, hwsrc=OTHER_DEVICE_MAC, psrc='192.168.1.20', pdst='192.168.1.10')
+    )
+    tcp_frame = bytes(
+        sc.Ether(src=DEVICE_MAC, dst=HOST_MAC) / sc.IP(src='192.168.1.10', dst='192.168.1.20') /
+        sc.TCP(sport=51000, dport=80)
+    )
+    global_state.packet_queue.put((arp_frame, 1.0))
+    global_state.packet_queue.put((tcp_frame, 2.0))
+
+    packet_processor.process_packet_batch()
+
+    assert list(packet_processor.flow_dict) == [
+        (DEVICE_MAC, OTHER_DEVICE_MAC, '192.168.1.10', '192.168.1.20', 51000, 80, 'tcp')
+    ]
@@ -0,0 +1,70 @@
+import os
+import queue
+import sys
+
+import pytest
+import scapy.all as sc
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from core.packet_queue import BoundedPacketQueue
+
+
+def make_frame(sport, dport=443):
+    pkt = sc.Ether() / sc.IP(src='192.168.1.10', dst='1.2.3.4') / sc.TCP(sport=sport, dport=dport)
+    return (bytes(pkt), 0.0)
+
+
+def test_drop_oldest():
+    q = BoundedPacketQueue(maxsize=3, policy='drop_oldest')
+    for ix in range(5):
+        q.put(ix)
+
+    assert [q.get() for _ in range(3)] == [2, 3, 4]
+    stats = q.get_stats()
+    assert stats['drop_oldest'] == 2
+    assert stats['dropped'] == 2
+    assert stats['depth'] == 0
+
+
+def test_drop_newest():
+    q = BoundedPacketQueue(maxsize=3, policy='drop_newest')
+    for ix in range(5):
+        q.put(ix)
+
+    assert [q.get() for _ in range(3)] == [0, 1, 2]
+    assert q.get_stats()['drop_newest'] == 2
+
+
+def test_sample_keeps_one_in_n_per_flow_with_weight():
+    q = BoundedPacketQueue(maxsize=100, policy='sample', high_water_mark=0, sample_rate=4)
+    for _ in range(8):
+        q.put(make_frame(1000))
+        q.put(make_frame(2000))
+
+    items = []
+    while not q.empty():
+        items.append(q.get_with_weight())
+
+    # Two packets per flow are kept, each standing for four packets
+    assert len(items) == 4
+    assert all(weight == 4 for _, weight in items)
+    assert q.get_stats()['sampled_out'] == 12
+
+
+def test_sample_below_high_water_mark_keeps_everything():
+    q = BoundedPacketQueue(maxsize=100, policy='sample', high_water_mark=50, sample_rate=4)
+    for _ in range(10):
+        q.put(make_frame(1000))
+
+    assert q.qsize() == 10
+    assert q.get_with_weight()[1] == 1
+
+
+def test_get_timeout_and_unknown_policy():
+    q = BoundedPacketQueue(maxsize=3)
+    with pytest.raises(queue.Empty):
+        q.get(timeout=0.01)
+    with pytest.raises(ValueError):
+        BoundedPacketQueue(policy='unknown')
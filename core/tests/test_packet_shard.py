@@ -0,0 +1,97 @@
+import os
+import sys
+import threading
+
+import pytest
+import scapy.all as sc
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import core.global_state as global_state
+import core.networking as networking
+import core.packet_processor as packet_processor
+import core.packet_shard as packet_shard
+from core.hostname_store import HostnameStore
+from core.packet_queue import BoundedPacketQueue
+
+
+HOST_MAC = '00:00:00:00:00:01'
+DEVICE_MAC = '5c:e9:1e:22:84:7d'
+
+
+def get_frame(src_ip, dst_ip, sport, dport, payload=b'x'):
+    return bytes(
+        sc.Ether(src=DEVICE_MAC, dst=HOST_MAC) / sc.IP(src=src_ip, dst=dst_ip) /
+        sc.TCP(sport=sport, dport=dport) / payload
+    )
+
+
+@pytest.fixture
+def shards(monkeypatch):
+    monkeypatch.setattr(packet_shard, 'SHARD_COUNT', 2)
+    monkeypatch.setattr(packet_shard, '_shard_queue_list', [])
+    monkeypatch.setattr(packet_shard, '_shard_process_list', [])
+    monkeypatch.setattr(packet_shard, '_result_queue', [None])
+    monkeypatch.setattr(packet_shard, '_stopped_shard_set', set())
+    monkeypatch.setattr(packet_shard, '_all_stopped_event', threading.Event())
+    monkeypatch.setattr(packet_shard, '_sync_state_dict', dict(packet_shard._sync_state_dict, last_sync_ts=0, host_addr=None))
+    monkeypatch.setattr(global_state, 'packet_queue', BoundedPacketQueue())
+    monkeypatch.setattr(global_state, 'arp_cache', networking.ARPCache(load_from_db=False))
+    monkeypatch.setattr(global_state, 'hostname_store', HostnameStore())
+    monkeypatch.setattr(global_state, 'host_mac_addr', HOST_MAC)
+    monkeypatch.setattr(global_state, 'host_ip_addr', '192.168.1.2')
+    monkeypatch.setattr(packet_processor, 'flow_dict', {})
+    monkeypatch.setattr(packet_processor, 'FLOW_WRITE_INTERVAL', 3600)
+    monkeypatch.setitem(packet_processor.flow_dict_last_db_write_ts, '_', 2 ** 40)
+
+    written_flow_dict = {}
+    monkeypatch.setattr(packet_shard.flow_writer, 'write_flows_to_db', written_flow_dict.update)
+
+    # Collect the results in this test's own thread rather than a SafeLoopThread
+    monkeypatch.setattr(packet_shard.common, 'SafeLoopThread', lambda *args, **kwargs: None)
+    packet_shard.start_shards()
+
+    def _collect():
+        while not packet_shard._all_stopped_event.is_set():
+            packet_shard.collect_shard_results()
+
+    collector_thread = threading.Thread(target=_collect, daemon=True)
+    collector_thread.start()
+
+    yield written_flow_dict
+
+    collector_thread.join(timeout=1)
+
+    for process in packet_shard._shard_process_list:
+        process.kill()
+
+
+def test_shard_ix_is_symmetric(monkeypatch):
+    monkeypatch.setattr(packet_shard, '_shard_queue_list', [None] * 4)
+
+    request = get_frame('192.168.1.10', '93.184.216.34', 51000, 443)
+    response = bytes(
+        sc.Ether(src=HOST_MAC, dst=DEVICE_MAC) / sc.Dot1Q(vlan=10) /
+        sc.IP(src='93.184.216.34', dst='192.168.1.10') / sc.TCP(sport=443, dport=51000)
+    )
+
+    assert packet_shard.get_shard_ix(request) == packet_shard.get_shard_ix(response)
+    assert packet_shard.get_shard_ix(b'\x00' * 10) == 0
+
+
+def test_workers_hand_back_flows_on_stop(shards):
+    written_flow_dict = shards
+
+    # The workers resolve MAC addresses with the ARP cache sent to them
+    global_state.arp_cache.update('192.168.1.20', '08:b4:b1:23:08:a8')
+
+    for ix in range(20):
+        global_state.packet_queue.put((get_frame('192.168.1.10', '192.168.1.20', 51000 + ix, 443), 1.0 + ix))
+    packet_shard.dispatch_packets()
+
+    packet_shard.stop_shards()
+
+    assert sorted(flow_key[4] for flow_key in written_flow_dict) == [51000 + ix for ix in range(20)]
+    assert {flow_key[1] for flow_key in written_flow_dict} == {'08:b4:b1:23:08:a8'}
+    assert all(flow_stat_dict['pkt_count'] == 1 for flow_stat_dict in written_flow_dict.values())
@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytest
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import core.parquet_archive as parquet_archive
+import core.model as model
+from core.burst_features import numeric_cols_feat
+
+
+MODEL_LIST = [model.Flow, model.Configuration]
+
+
+@pytest.fixture(autouse=True)
+def archive_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(parquet_archive, 'ARCHIVE_DIRECTORY', str(tmp_path / 'archive'))
+    monkeypatch.setattr(parquet_archive, '_burst_buffer', parquet_archive.collections.deque())
+
+
+def get_flow_row(end_ts, mac_addr, byte_count):
+    return dict(
+        start_ts=end_ts - 1, end_ts=end_ts,
+        src_device_mac_addr=mac_addr, dst_device_mac_addr='',
+        src_port=1234, dst_port=443, src_ip_addr='10.0.0.2', dst_ip_addr='1.1.1.1',
+        dst_hostname='example.com', protocol='tcp', byte_count=byte_count, packet_count=1
+    )
+
+
+def test_flows_are_archived_by_hour(test_db):
+    hour_start_ts = int(time.time()) // 3600 * 3600 - 3 * 3600
+
+    with test_db:
+        model.Flow.insert_many([
+            get_flow_row(hour_start_ts + 10, 'aa:aa', 1),
+            get_flow_row(hour_start_ts + 20, 'bb:bb', 2),
+            get_flow_row(hour_start_ts + 3600 + 10, 'aa:aa', 4),
+            # Too recent to archive
+            get_flow_row(time.time(), 'aa:aa', 8),
+        ]).execute()
+
+    assert parquet_archive.archive_flows(time.time() - parquet_archive.ARCHIVE_DELAY) == 3
+    # Archived hours are not archived again
+    assert parquet_archive.archive_flows(time.time() - parquet_archive.ARCHIVE_DELAY) == 0
+
+    table = parquet_archive.read_flows(['end_ts', 'byte_count'])
+    assert sorted(table.column('byte_count').to_pylist()) == [1, 2, 4]
+
+    table = parquet_archive.read_flows(
+        ['byte_count'],
+        start_ts=hour_start_ts + 3600,
+        filter_expr=ds.field('src_device_mac_addr') == 'aa:aa'
+    )
+    assert table.column_names == ['byte_count']
+    assert table.column('byte_count').to_pylist() == [4]
+
+    # MAC addresses and hostnames are dictionary-encoded
+    parquet_path = next(
+        os.path.join(dir_path, file_name)
+        for dir_path, _, file_name_list in os.walk(parquet_archive.ARCHIVE_DIRECTORY)
+        for file_name in file_name_list
+    )
+    column_encoding_dict = {}
+    row_group = pq.ParquetFile(parquet_path).metadata.row_group(0)
+    for ix in range(row_group.num_columns):
+        column = row_group.column(ix)
+        column_encoding_dict[column.path_in_schema] = column.encodings
+    assert 'RLE_DICTIONARY' in column_encoding_dict['src_device_mac_addr']
+    assert 'RLE_DICTIONARY' in column_encoding_dict['dst_hostname']
+
+
+def test_bursts_are_archived(test_db):
+    start_time = time.time()
+    for ix, device in enumerate(['aa:aa', 'bb:bb']):
+        data = [float(ix)] * len(numeric_cols_feat) + [device, 'on', 'unknown', start_time + ix, 'tcp', 'example.com']
+        parquet_archive.add_burst(data, ix == 1)
+
+    assert parquet_archive.archive_bursts() == 2
+    assert parquet_archive.archive_bursts() == 0
+
+    table = parquet_archive.read_bursts(['device', 'is_idle'], filter_expr=ds.field('device') == 'bb:bb')
+    assert table.to_pylist() == [{'device': 'bb:bb', 'is_idle': True}]
+
+
+def test_delete_archive(test_db):
+    data = [0.0] * len(numeric_cols_feat) + ['aa:aa', 'on', 'unknown', time.time(), 'tcp', 'example.com']
+    parquet_archive.add_burst(data, False)
+    assert parquet_archive.archive_bursts() == 1
+    parquet_archive.add_burst(data, False)
+
+    parquet_archive.delete_archive()
+
+    assert not os.path.exists(parquet_archive.ARCHIVE_DIRECTORY)
+    assert parquet_archive.archive_bursts() == 0
+    assert parquet_archive.config.get('archive_idle_csv_imported')
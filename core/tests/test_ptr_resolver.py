@@ -0,0 +1,95 @@
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+from scapy.layers.dns import DNS, DNSRR
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import core.global_state as global_state
+from core.hostname_store import HostnameStore
+import core.ptr_resolver as ptr_resolver
+
+
+# Maps reverse-lookup name -> hostname known to the stub server
+STUB_PTR_DICT = {
+    '4.3.2.1.in-addr.arpa': 'host.example.com',
+}
+
+
+@pytest.fixture
+def stub_dns_server(monkeypatch):
+    query_list = []
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+
+    def serve():
+        while True:
+            try:
+                query, address = sock.recvfrom(4096)
+            except OSError:
+                return
+            query = DNS(query)
+            name = query.qd.qname.decode().rstrip('.')
+            query_list.append(name)
+            if name in STUB_PTR_DICT:
+                response = DNS(
+                    id=query.id, qr=1, rd=1, ra=1, qd=query.qd,
+                    an=DNSRR(rrname=query.qd.qname, type='PTR', ttl=300, rdata=STUB_PTR_DICT[name])
+                )
+            else:
+                response = DNS(id=query.id, qr=1, rd=1, ra=1, rcode=3, qd=query.qd)
+            sock.sendto(bytes(response), address)
+
+    threading.Thread(target=serve, daemon=True).start()
+
+    monkeypatch.setattr(ptr_resolver, 'PTR_DNS_SERVER', sock.getsockname())
+    monkeypatch.setattr(ptr_resolver, '_cache', ptr_resolver.collections.OrderedDict())
+    monkeypatch.setattr(ptr_resolver, '_pending_ip_addr_set', set())
+    hostname_store = HostnameStore()
+    hostname_store.add('5.5.5.5', 'dns.example.net', 'dns')
+    monkeypatch.setattr(global_state, 'hostname_store', hostname_store)
+
+    yield query_list
+
+    sock.close()
+
+
+def wait_for_pending():
+    deadline = time.time() + 5
+    while ptr_resolver.get_stats()['pending'] and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_query_ptr(stub_dns_server):
+    assert ptr_resolver.query_ptr('1.2.3.4', ptr_resolver.PTR_DNS_SERVER) == ('host.example.com', 300)
+    assert ptr_resolver.query_ptr('1.2.3.5', ptr_resolver.PTR_DNS_SERVER)[0] == ''
+
+
+def test_submit_fills_hostname_store(stub_dns_server):
+    resolved_list = []
+
+    assert ptr_resolver.submit(['1.2.3.4', '1.2.3.5', '1.2.3.4'], lambda *args: resolved_list.append(args)) == 2
+    wait_for_pending()
+
+    assert resolved_list == [('1.2.3.4', 'host.example.com?')]
+    assert global_state.hostname_store.get('1.2.3.4') == 'host.example.com?'
+    assert ptr_resolver.get_cached('1.2.3.5') == ''
+
+    # Cached answers, positive or negative, are not queried again
+    assert ptr_resolver.submit(['1.2.3.4', '1.2.3.5']) == 0
+    assert sorted(stub_dns_server) == ['4.3.2.1.in-addr.arpa', '5.3.2.1.in-addr.arpa']
+
+
+def test_hostnames_from_dns_take_precedence(stub_dns_server, monkeypatch):
+    monkeypatch.setitem(STUB_PTR_DICT, '5.5.5.5.in-addr.arpa', 'ptr.example.net')
+
+    ptr_resolver.submit(['5.5.5.5'])
+    wait_for_pending()
+
+    assert ptr_resolver.get_cached('5.5.5.5') == 'ptr.example.net?'
+    assert global_state.hostname_store.get('5.5.5.5') == 'dns.example.net'
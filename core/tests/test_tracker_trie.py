@@ -0,0 +1,74 @@
+import json
+import os
+import sys
+
+# Add the parent directory to the sys.path to import core module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import core.tracker_trie as tracker_trie
+
+
+def parse_tracking_json(json_contents):
+    return {domain: info['owner']['displayName'] for domain, info in json_contents['trackers'].items()}
+
+
+def write_block_list(path, tracker_dict):
+    with open(path, 'w') as f:
+        json.dump({'trackers': {
+            domain: {'owner': {'displayName': company}} for domain, company in tracker_dict.items()
+        }}, f)
+
+
+def test_lookup_matches_parent_domains(tmp_path):
+    json_path = str(tmp_path / 'tds.json')
+    write_block_list(json_path, {
+        'doubleclick.net': 'Google',
+        'ads.example.com': 'Example Ads',
+        'b.ads.example.com': 'Other Ads',
+    })
+
+    trie = tracker_trie.load([json_path], parse_tracking_json, str(tmp_path / 'trie.bin'), str(tmp_path / 'prebuilt.bin'))
+
+    assert trie.lookup('doubleclick.net') == 'Google'
+    assert trie.lookup('stats.g.doubleclick.net') == 'Google'
+    assert trie.lookup('Ads.Example.com') == 'Example Ads'
+    assert trie.lookup('a.ads.example.com') == 'Example Ads'
+    # The longest listed suffix wins
+    assert trie.lookup('x.b.ads.example.com') == 'Other Ads'
+    assert trie.lookup('example.com') == ''
+    assert trie.lookup('net') == ''
+    assert trie.lookup('notdoubleclick.net') == ''
+    assert trie.lookup('') == ''
+
+
+def test_trie_is_rebuilt_when_lists_change(tmp_path, monkeypatch):
+    json_path = str(tmp_path / 'tds.json')
+    trie_path = str(tmp_path / 'trie.bin')
+    monkeypatch.setattr(tracker_trie, 'PREBUILT_TRACKER_TRIE_PATH', str(tmp_path / 'prebuilt.bin'))
+
+    write_block_list(json_path, {'tracker.com': 'Old'})
+    assert tracker_trie.load([json_path], parse_tracking_json, trie_path).lookup('tracker.com') == 'Old'
+
+    # Unchanged lists are not parsed again
+    assert tracker_trie.load([json_path], None, trie_path).lookup('tracker.com') == 'Old'
+
+    write_block_list(json_path, {'tracker.com': 'New'})
+    assert tracker_trie.load([json_path], parse_tracking_json, trie_path).lookup('tracker.com') == 'New'
+
+
+def test_prebuilt_trie_is_used_if_current(tmp_path):
+    json_path = str(tmp_path / 'tds.json')
+    trie_path = str(tmp_path / 'trie.bin')
+    prebuilt_path = str(tmp_path / 'prebuilt.bin')
+
+    write_block_list(json_path, {'tracker.com': 'Prebuilt'})
+    tracker_trie.compile_lists([json_path], parse_tracking_json, prebuilt_path)
+
+    # The block lists are not parsed, and nothing is compiled at startup
+    assert tracker_trie.load([json_path], None, trie_path, prebuilt_path).lookup('tracker.com') == 'Prebuilt'
+    assert not os.path.exists(trie_path)
+
+    # Lists updated without rebuilding the prebuilt trie are compiled at startup
+    write_block_list(json_path, {'tracker.com': 'New'})
+    assert tracker_trie.load([json_path], parse_tracking_json, trie_path, prebuilt_path).lookup('tracker.com') == 'New'
+    assert os.path.exists(trie_path)
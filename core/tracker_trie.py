@@ -0,0 +1,250 @@
+"""
+Tracker-company lookup with a suffix trie of the tracker block lists.
+
+The trie is keyed by the reversed labels of the tracker domains
+(`ads.example.com` -> com, example, ads), so a lookup walks the labels of a
+hostname from the top-level domain down and returns the company of the
+longest listed suffix; `a.b.doubleclick.net` matches the `doubleclick.net`
+entry.
+
+The trie is compiled from the block lists at build time into
+PREBUILT_TRACKER_TRIE_PATH, which ships with the block lists:
+
+python -m core.tracker_trie
+
+At startup, the prebuilt trie is memory-mapped if the checksum of the block
+lists matches; otherwise, e.g. if the lists were updated without rebuilding it,
+the trie is compiled at first start into TRACKER_TRIE_PATH. File layout
+(little-endian):
+
+    header: magic, version, block list checksum (SHA-256), node count, company count
+    nodes: (label offset, label length, first child, child count, company index) each;
+           node 0 is the root, and the children of a node are consecutive and
+           sorted by label
+    companies: (name offset, name length) each
+    strings: UTF-8 labels and company names
+
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import core.common as common
+
+
+TRACKER_TRIE_PATH = os.path.join(common.get_project_directory(), 'tracker_trie.bin')
+
+PREBUILT_TRACKER_TRIE_PATH = os.path.join(common.get_python_code_directory(), '..', 'data', 'tracker_trie.bin')
+
+TRACKER_TRIE_MAGIC = b'ITRI'
+
+TRACKER_TRIE_VERSION = 1
+
+HEADER_STRUCT = struct.Struct('<4sI32sII')
+
+NODE_STRUCT = struct.Struct('<IIIIi')
+
+COMPANY_STRUCT = struct.Struct('<II')
+
+
+def get_checksum(json_path_list) -> bytes:
+    """Returns the SHA-256 digest of the given block list files."""
+
+    checksum = hashlib.sha256()
+    for json_path in json_path_list:
+        with open(json_path, 'rb') as f:
+            checksum.update(f.read())
+
+    return checksum.digest()
+
+
+def build(tracker_dict, checksum, path):
+    """Compiles a dict of domain -> tracker company into a trie file at `path`."""
+
+    # Nested dicts of label -> [child dict, company]
+    root = [{}, None]
+    for domain, company in tracker_dict.items():
+        node = root
+        for label in reversed(domain.lower().strip('.').split('.')):
+            node = node[0].setdefault(label, [{}, None])
+        node[1] = company
+
+    company_list = sorted(set(tracker_dict.values()))
+    company_index_dict = {company: index for index, company in enumerate(company_list)}
+
+    strings = bytearray()
+    string_offset_dict = {}
+
+    def add_string(s):
+        if s not in string_offset_dict:
+            string_offset_dict[s] = len(strings)
+            strings.extend(s.encode('utf-8'))
+        return string_offset_dict[s], len(s.encode('utf-8'))
+
+    # Lay the nodes out breadth-first, so that the children of a node are consecutive
+    node_list = [('', root)]
+    node_record_list = []
+    index = 0
+    while index < len(node_list):
+        label, (child_dict, company) = node_list[index]
+        child_list = sorted(child_dict.items(), key=lambda item: item[0].encode('utf-8'))
+        label_offset, label_length = add_string(label)
+        node_record_list.append((
+            label_offset,
+            label_length,
+            len(node_list),
+            len(child_list),
+            company_index_dict[company] if company is not None else -1
+        ))
+        node_list.extend(child_list)
+        index += 1
+
+    company_record_list = [add_string(company) for company in company_list]
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER_STRUCT.pack(
+            TRACKER_TRIE_MAGIC, TRACKER_TRIE_VERSION, checksum,
+            len(node_record_list), len(company_record_list)
+        ))
+        for node_record in node_record_list:
+            f.write(NODE_STRUCT.pack(*node_record))
+        for company_record in company_record_list:
+            f.write(COMPANY_STRUCT.pack(*company_record))
+        f.write(strings)
+    os.replace(temp_path, path)
+
+
+class TrackerTrie(object):
+    """Read-only view of a trie file."""
+
+    def __init__(self, path):
+
+        with open(path, 'rb') as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.checksum, node_count, company_count = HEADER_STRUCT.unpack_from(self._buf, 0)
+        if magic != TRACKER_TRIE_MAGIC or version != TRACKER_TRIE_VERSION:
+            raise ValueError(f'Not a tracker trie file: {path}')
+
+        self._node_offset = HEADER_STRUCT.size
+        company_offset = self._node_offset + node_count * NODE_STRUCT.size
+        self._string_offset = company_offset + company_count * COMPANY_STRUCT.size
+
+        # The company names are few; decode them once
+        self._company_list = []
+        for index in range(company_count):
+            offset, length = COMPANY_STRUCT.unpack_from(self._buf, company_offset + index * COMPANY_STRUCT.size)
+            self._company_list.append(self._get_string(offset, length).decode('utf-8'))
+
+    def _get_string(self, offset, length) -> bytes:
+
+        return self._buf[self._string_offset + offset:self._string_offset + offset + length]
+
+    def _get_node(self, index):
+
+        return NODE_STRUCT.unpack_from(self._buf, self._node_offset + index * NODE_STRUCT.size)
+
+    def lookup(self, hostname: str) -> str:
+        """Returns the company of the longest listed suffix of the hostname, or an empty string."""
+
+        company_index = -1
+        _, _, first_child, child_count, _ = self._get_node(0)
+
+        for label in reversed(hostname.lower().strip('.').split('.')):
+            label = label.encode('utf-8')
+
+            # Binary search for the label among the children
+            low = first_child
+            high = first_child + child_count
+            while low < high:
+                middle = (low + high) // 2
+                label_offset, label_length, _, _, _ = self._get_node(middle)
+                if self._get_string(label_offset, label_length) < label:
+                    low = middle + 1
+                else:
+                    high = middle
+
+            if low == first_child + child_count:
+                break
+            label_offset, label_length, first_child, child_count, node_company_index = self._get_node(low)
+            if self._get_string(label_offset, label_length) != label:
+                break
+
+            if node_company_index >= 0:
+                company_index = node_company_index
+
+        if company_index < 0:
+            return ''
+
+        return self._company_list[company_index]
+
+    def close(self):
+
+        self._buf.close()
+
+
+def load(json_path_list, parse_func, path=None, prebuilt_path=None) -> TrackerTrie:
+    """
+    Returns the trie of the block lists: the prebuilt one at `prebuilt_path`
+    (by default PREBUILT_TRACKER_TRIE_PATH) if it was built from these lists,
+    else the one at `path` (by default TRACKER_TRIE_PATH), which is compiled if
+    it is missing or was built from other lists. `parse_func` turns the parsed
+    JSON of a block list into a dict of domain -> tracker company.
+
+    """
+    if path is None:
+        path = TRACKER_TRIE_PATH
+    if prebuilt_path is None:
+        prebuilt_path = PREBUILT_TRACKER_TRIE_PATH
+
+    checksum = get_checksum(json_path_list)
+
+    for trie_path in (prebuilt_path, path):
+        trie = _load_if_current(trie_path, checksum)
+        if trie is not None:
+            return trie
+
+    common.log('[Tracker Trie] Compiling the tracker block lists')
+    compile_lists(json_path_list, parse_func, path, checksum)
+
+    return TrackerTrie(path)
+
+
+def compile_lists(json_path_list, parse_func, path, checksum=None):
+    """Compiles the block lists into a trie file at `path`."""
+
+    if checksum is None:
+        checksum = get_checksum(json_path_list)
+
+    tracker_dict = dict()
+    for json_path in json_path_list:
+        with open(json_path, 'r') as f:
+            tracker_dict.update(parse_func(json.load(f)))
+
+    build(tracker_dict, checksum, path)
+
+
+def _load_if_current(path, checksum):
+    """Returns the trie at `path` if it exists and was built from the lists with this checksum, else None."""
+
+    if not os.path.exists(path):
+        return None
+
+    try:
+        trie = TrackerTrie(path)
+    except (ValueError, struct.error, OSError):
+        return None
+
+    if trie.checksum == checksum:
+        return trie
+
+    trie.close()
+    return None
+
+
+if __name__ == '__main__':
+    # Build step: compile the default block lists into the prebuilt trie
+    import core.friendly_organizer as friendly_organizer
+    compile_lists(friendly_organizer.tracker_json_list, friendly_organizer.parse_tracking_json, PREBUILT_TRACKER_TRIE_PATH)
@@ -1,6 +1,6 @@
-import ipaddress
 from functools import lru_cache
 from core.common import get_project_directory
+import core.ip_classifier as ip_classifier
 import os
 import json
 from difflib import SequenceMatcher
@@ -16,13 +16,7 @@ def validate_ip_address(address):
     Returns:
         bool: true as valid 
     """
-    try:
-        ip = ipaddress.ip_address(address)
-        # print("IP address {} is valid. The object returned is {}".format(address, ip))
-        return True
-    except ValueError:
-        # print("IP address {} is not valid".format(address)) 
-        return False
+    return ip_classifier.is_valid(address)
 
 
 # NOTE: Currently using hard coded values for device names
@@ -10,6 +10,7 @@ import template as template
 from template import show
 import ui.common as common
 import core.model as model
+import core.db_writer as db_writer
 import analysis.traffic_rate as traffic_rate
 import core.global_state as global_state
 import urllib.parse
@@ -335,13 +336,11 @@ def save_device_name_callback(device_mac_addr, rename_box):
 
     rename_box.markdown('Saving to database...')
 
-    with model.write_lock:
-        with model.db:
-            # Update the product_name field of the device, given the mac_addr
-            query = model.Device \
-                .update(product_name=st.session_state[f'device_name_{device_mac_addr}']) \
-                .where(model.Device.mac_addr == device_mac_addr)
-            query.execute()
+    # Update the product_name field of the device, given the mac_addr
+    query = model.Device \
+        .update(product_name=st.session_state[f'device_name_{device_mac_addr}']) \
+        .where(model.Device.mac_addr == device_mac_addr)
+    db_writer.execute(query.execute)
 
     st.session_state[f'rename_box_visibility_{device_mac_addr}'] = False
     rename_box.empty()
@@ -354,9 +353,9 @@ def set_device_inspected_callback(device_mac_addr):
     else:
         is_inspected = 0
 
-    with model.write_lock:
-        with model.db:
-            model.Device.update(is_inspected=is_inspected).where(model.Device.mac_addr == device_mac_addr).execute()
+    db_writer.execute(
+        model.Device.update(is_inspected=is_inspected).where(model.Device.mac_addr == device_mac_addr).execute
+    )
 
 
 def set_device_favorite_callback(device_mac_addr):
@@ -366,9 +365,9 @@ def set_device_favorite_callback(device_mac_addr):
     else:
         favorite_time = 0
 
-    with model.write_lock:
-        with model.db:
-            model.Device.update(favorite_time=favorite_time).where(model.Device.mac_addr == device_mac_addr).execute()
+    db_writer.execute(
+        model.Device.update(favorite_time=favorite_time).where(model.Device.mac_addr == device_mac_addr).execute
+    )
 
 # Jakaria: Added the function to handle the idle device on checkbox click
 def set_device_idle_callback(device_mac_addr):
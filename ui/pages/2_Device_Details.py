@@ -2,6 +2,7 @@ import time
 import streamlit as st
 import template
 import core.model as model
+import core.db_writer as db_writer
 import analysis.traffic_rate as traffic_rate
 import plotly.express as px
 import core.deferred_action as deferred_action
@@ -71,13 +72,11 @@ def get_color_for_type(type_name):
 
 def save_device_name_callback(device_mac_addr):
 
-    with model.write_lock:
-        with model.db:
-            # Update the product_name field of the device, given the mac_addr
-            query = model.Device \
-                .update(product_name=st.session_state[f'device_name_{device_mac_addr}']) \
-                .where(model.Device.mac_addr == device_mac_addr)
-            query.execute()
+    # Update the product_name field of the device, given the mac_addr
+    query = model.Device \
+        .update(product_name=st.session_state[f'device_name_{device_mac_addr}']) \
+        .where(model.Device.mac_addr == device_mac_addr)
+    db_writer.execute(query.execute)
 
 
 def show_device_details(mac_addr):
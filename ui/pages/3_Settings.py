@@ -4,8 +4,14 @@ import streamlit as st
 import template
 import core.config as config
 import core.model as model
+import core.db_writer as db_writer
 import core.common as common
 import core.global_state as global_state
+import core.friendly_organizer as friendly_organizer
+import core.hostname_writer as hostname_writer
+import core.device_cache as device_cache
+import core.flow_shard as flow_shard
+import core.parquet_archive as parquet_archive
 import sidebar
 
 
@@ -47,15 +53,24 @@ def show_settings():
 
 def reset_local_data():
 
-    with model.write_lock:
-
+    def _delete_all():
         model.Device.delete().execute()
+        device_cache.clear()
         model.Flow.delete().execute()
+        model.FlowRollup.delete().execute()
         model.Hostname.delete().execute()
+        hostname_writer.clear()
         model.FriendlyIdentity.delete().execute()
+        # Also resets flow_rollup_start_ts, so that the rollups are rebuilt
+        # from scratch at the next start
         model.Configuration.delete().execute()
         model.AdTracker.delete().execute()
 
+    db_writer.execute(_delete_all)
+    flow_shard.delete_all_shards()
+    parquet_archive.delete_archive()
+    friendly_organizer.clear_hostname_store()
+
     sidebar.quit()
 
 
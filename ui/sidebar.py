@@ -3,6 +3,8 @@ import signal
 import time
 import streamlit as st
 import core.model as model
+import core.flow_shard as flow_shard
+import core.packet_shard as packet_shard
 import peewee
 import core.deferred_action as deferred_action
 import core.global_state as global_state
@@ -107,25 +109,31 @@ def get_overall_bandwidth_consumption(time_window=10):
     upload_Mbps = 0
     download_Mbps = 0
 
-    with model.db:
+    max_ts = int(time.time())
+
+    upload_bytes = 0
+    download_bytes = 0
 
-        max_ts = int(time.time())
+    # Only read the flow shards (if enabled) of the time window
+    for flow_db in flow_shard.get_flow_databases(max_ts - time_window):
 
-        upload_bytes = model.Flow.select(
-            peewee.fn.Sum(model.Flow.byte_count)
-            ).where(
-                (model.Flow.src_device_mac_addr != '') &
-                (model.Flow.dst_device_mac_addr == '') &
-                (model.Flow.end_ts > max_ts - time_window)
-            ).scalar()
+        with flow_db:
 
-        download_bytes = model.Flow.select(
-            peewee.fn.Sum(model.Flow.byte_count)
-            ).where(
-                (model.Flow.dst_device_mac_addr != '') &
-                (model.Flow.src_device_mac_addr == '') &
-                (model.Flow.end_ts > max_ts - time_window)
-            ).scalar()
+            upload_bytes += model.Flow.select(
+                peewee.fn.Sum(model.Flow.byte_count)
+                ).where(
+                    (model.Flow.src_device_mac_addr != '') &
+                    (model.Flow.dst_device_mac_addr == '') &
+                    (model.Flow.end_ts > max_ts - time_window)
+                ).scalar(flow_db) or 0
+
+            download_bytes += model.Flow.select(
+                peewee.fn.Sum(model.Flow.byte_count)
+                ).where(
+                    (model.Flow.dst_device_mac_addr != '') &
+                    (model.Flow.src_device_mac_addr == '') &
+                    (model.Flow.end_ts > max_ts - time_window)
+                ).scalar(flow_db) or 0
 
     if upload_bytes:
         upload_Mbps = upload_bytes * 8.0 / 1000000.0 / time_window
@@ -167,6 +175,9 @@ def quit():
 
     time.sleep(5)
 
+    # Write the flows still held by the packet processing workers, if any
+    packet_shard.stop_shards()
+
     # Get the current process ID
     pid = os.getpid()
 